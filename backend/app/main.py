@@ -10,6 +10,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.routers import connections
 from app.routers import queries     # El endpoint /human_query
 from app.routers import feedback    # Endpoints para feedback (like/dislike/comentarios)
+from app.services.db_pool import pool_manager
+from app.utils.concurrency import shutdown_executors
+from app.services.llm_client import llm_client
+from app.utils.audit_log import shutdown_audit_log
+from app.services.query_logger import query_log_writer
 
 app = FastAPI(
     title="DatabaseQueryMaster API",
@@ -32,6 +37,30 @@ app.include_router(connections.router)
 app.include_router(queries.router)
 app.include_router(feedback.router)
 
+# --- Arranque: el escritor de query_logs reserva IDs antes de la primera petición ---
+@app.on_event("startup")
+def start_query_logs():
+    query_log_writer.start()
+
+# --- Cierre ordenado: executors de llamadas bloqueantes y conexiones hacia las bases de los usuarios ---
+@app.on_event("shutdown")
+def close_db_pools():
+    shutdown_executors()
+    pool_manager.close_all()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm_client.close()
+
+@app.on_event("shutdown")
+def flush_audit_log():
+    shutdown_audit_log()
+
+@app.on_event("shutdown")
+def flush_query_logs():
+    # Escribe los logs encolados; lo que no alcance queda respaldado en disco
+    query_log_writer.stop()
+
 # --- Endpoints básicos ---
 @app.get("/")
 def root():
@@ -9,13 +9,23 @@ from app.services.supabase_service import (
     activate_connection_supabase,
     delete_connection_supabase,
     get_active_connection_supabase,
+    get_connection_supabase,
     deactivate_connection_supabase,
 )
 from app.services.db_connector import get_table_names
+from app.services.db_pool import invalidate_connection_pools
+from app.services.schema_cache import get_schema_entry, invalidate_schema_cache
+from app.services.result_cache import result_cache
+from app.utils.credential_cache import invalidate_credentials
+from app.services.row_count import invalidate_exact_counts
+from app.services.sql_cache import sql_cache
 from app.utils.crypto import encrypt_password
 from typing import List
-import pyodbc
 import logging
+try:
+    import pyodbc
+except ImportError:  # Driver opcional: solo hace falta para conexiones SQL Server
+    pyodbc = None
 
 router = APIRouter(
     prefix="/connections",
@@ -31,6 +41,8 @@ def test_connection(params: ConnectionCreate = Body(...)):
     logging.info(f"[TEST_CONN] Intentando conexión DB: {params.db_type} host={params.host} db={params.database}")
     try:
         if params.db_type.lower() == "sqlserver":
+            if pyodbc is None:
+                return {"success": False, "message": "pyodbc no está instalado en el servidor"}
             if "\\" in params.host:
                 conn_str = (
                     f"DRIVER={{ODBC Driver 17 for SQL Server}};"
@@ -148,12 +160,44 @@ def delete_connection(
     """
     try:
         delete_connection_supabase(str(user["user_id"]), connection_id, user["jwt"])
+        invalidate_connection_pools(connection_id)
+        invalidate_schema_cache(connection_id)
+        result_cache.invalidate_connection(connection_id)
+        invalidate_credentials(connection_id)
+        invalidate_exact_counts(connection_id)
+        sql_cache.invalidate_connection(connection_id)
         logging.info(f"[DELETE_CONN] Usuario {user['user_id']} eliminó conexión {connection_id}")
         return {"success": True, "message": "Conexión eliminada"}
     except Exception as e:
         logging.error(f"[DELETE_CONN] Error: {e}")
         raise HTTPException(status_code=500, detail=f"Error eliminando conexión: {str(e)}")
 
+# ---- Forzar recarga del esquema cacheado ----
+@router.post("/{connection_id}/refresh-schema", response_model=dict)
+def refresh_schema(
+    connection_id: str,
+    user=Depends(get_current_user)
+):
+    """
+    Vuelve a introspectar el esquema de la conexión ignorando el cache.
+    """
+    try:
+        connection = get_connection_supabase(connection_id, str(user["user_id"]), user["jwt"])
+    except Exception as e:
+        logging.error(f"[REFRESH_SCHEMA] Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Error obteniendo conexión: {str(e)}")
+    if not connection:
+        raise HTTPException(status_code=404, detail="Conexión no encontrada")
+    entry = get_schema_entry(connection, force_refresh=True)
+    if not entry:
+        raise HTTPException(status_code=400, detail="No se pudo extraer el esquema de la base de datos.")
+    logging.info(f"[REFRESH_SCHEMA] Usuario {user['user_id']} recargó esquema de conexión {connection_id}")
+    return {
+        "success": True,
+        "tables": len(entry["catalog"]),
+        "fingerprint": entry.get("fingerprint"),
+    }
+
 # ---- Obtener la conexión activa ----
 @router.get("/active", response_model=ConnectionOut)
 def get_active_connection(user=Depends(get_current_user)):
@@ -4,8 +4,9 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import update, select
 from sqlalchemy.exc import SQLAlchemyError
 from app.deps.auth import get_current_user
-from app.services.query_logger import engine, query_logs
+from app.services.query_logger import engine, get_query_logs_table, query_log_writer, update_query_log
 from app.schemas.query_log import QueryLogFeedback
+from app.services.sql_cache import sql_cache
 
 router = APIRouter(
     prefix="/feedback",
@@ -23,7 +24,17 @@ async def submit_feedback(
     """
     user_id = str(user["user_id"])  # <-- Convierte a str para evitar comparaciones ambiguas
 
+    # El log puede estar todavía en la cola del escritor (write-behind): el feedback viaja detrás del INSERT
+    pending = query_log_writer.pending(log_id)
+    if pending is not None:
+        if str(pending.get("user_id")) != user_id:
+            raise HTTPException(status_code=403, detail="No puedes modificar feedback de otro usuario.")
+        update_query_log(log_id, {"feedback": feedback.feedback, "feedback_comment": feedback.feedback_comment})
+        sql_cache.record_feedback(log_id, feedback.feedback)
+        return {"success": True, "log_id": log_id}
+
     try:
+        query_logs = get_query_logs_table()
         with engine.begin() as conn:
             # 1. Verifica que el log existe y pertenece al usuario
             result = conn.execute(
@@ -53,4 +64,7 @@ async def submit_feedback(
         # Captura otros errores no previstos
         raise HTTPException(status_code=500, detail=f"Error inesperado: {str(e)}")
 
+    # El feedback decide si el SQL cacheado para esa pregunta se sigue reutilizando
+    sql_cache.record_feedback(log_id, feedback.feedback)
+
     return {"success": True, "log_id": log_id}
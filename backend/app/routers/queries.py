@@ -1,19 +1,60 @@
 # app/routers/queries.py
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import List, Any, Optional, Dict
+from typing import List, Any, Optional, Dict, Tuple, Iterator, AsyncIterator, Callable, Awaitable
 from datetime import datetime
+import asyncio
+import contextlib
+import time
+import csv
+import os
+import io
+import json
+import logging
 
 from app.deps.auth import get_current_user
 from app.services.supabase_service import get_active_connection_for_user
-from app.services.db_connector import get_database_schema, execute_sql_query
+from app.services.db_connector import (
+    iter_sql_query,
+    resolve_row_budget,
+    resolve_query_timeout,
+    QueryCancelHandle,
+    QueryTimeoutError,
+    QueryCancelledError,
+)
+from app.services.schema_cache import peek_schema_entry, get_schema_entry
+from app.services.schema_index import get_prompt_schema
+from app.services.sql_cache import sql_cache, cached_llm_response, SQL_CACHE_ENABLED
+from app.services.result_cache import execute_sql_query_cached, result_cache
+from app.services.arrow_export import export_query_result, is_export_available, EXPORT_FORMATS
 from app.services.llm_query import (
     call_openai_generate_sql,
     call_openai_explain_answer,
+    stream_openai_explain_answer,
     sanitize_value  # <--- Importa sanitize_value para limpiar datos si lo tienes en llm_query.py
 )
-from app.services.query_logger import log_query_attempt
+from app.services.row_count import (
+    build_exact_count_sql,
+    format_count,
+    get_cached_exact_count,
+    schedule_exact_count,
+    store_exact_count,
+)
+from app.services.result_store import result_blob_store
+from app.services.cost_gate import (
+    check_query_cost,
+    QueryCostRejectedError,
+    QueryNeedsConfirmationError,
+    COST_GATE_ENABLED,
+)
+from app.services.intent_engine import match_intent, format_intent_answer, intent_stats
+from app.services.llm_client import llm_client, LLMOverloadedError
+from app.services.query_logger import log_query_attempt, get_query_log, update_query_log, query_log_writer
+from app.utils.concurrency import run_db, run_io, io_executor
+from app.utils.audit_log import audit_stats
 
 router = APIRouter(
     prefix="/human_query",
@@ -30,34 +71,90 @@ class HumanQueryResponse(BaseModel):
     chart: Optional[Dict[str, Any]] = None
     list: Optional[List[Any]] = None
     table: Optional[List[List[Any]]] = None
+    truncated: Optional[bool] = None
+    approx_total_rows: Optional[int] = None
+    cache_hit: Optional[bool] = None
+    approximate_count: Optional[bool] = None
+    explanation_pending: Optional[bool] = None  # True: pedir la explicación a /logs/{id}/explain
+    plan: Optional[Dict[str, Any]] = None  # Plan estimado revisado antes de ejecutar (ver cost_gate)
 
 class HumanQueryRequest(BaseModel):
     question: str
     table: Optional[str] = None
     connection_id: Optional[str] = None
+    max_rows: Optional[int] = None  # Solo puede reducir el presupuesto de la conexión
+    timeout_ms: Optional[int] = None  # Solo puede reducir el deadline de la conexión
+    exact_count: Optional[bool] = None  # Fuerza COUNT(*) en preguntas de conteo de registros
+    lazy_explain: Optional[bool] = None  # No genera la explicación en esta respuesta (ver EXPLAIN_MODE)
+    confirm_cost: Optional[bool] = None  # Ejecuta aunque el costo estimado pida confirmación (409)
 
-@router.post("/", response_model=HumanQueryResponse)
-async def human_query(
-    request: HumanQueryRequest,
+# inline: la explicación (si hace falta) se genera en la misma respuesta, en paralelo con el log
+# lazy: se responde sin explicación y el frontend la pide a POST /human_query/logs/{id}/explain
+EXPLAIN_MODE = os.getenv("EXPLAIN_MODE", "inline").lower()
+
+# Cada cuánto se revisa si el cliente sigue conectado mientras se espera una etapa lenta
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+async def await_unless_disconnected(
+    awaitable: Awaitable[Any],
     fastapi_request: Request,
-    user=Depends(get_current_user)
-):
-    user_email = user.get("email") or str(user.get("user_id"))
-    user_id = user["user_id"]
-    user_token = user["jwt"]
+    on_disconnect: Optional[Callable[[], None]] = None,
+) -> Any:
+    """
+    Espera una etapa del pipeline revisando periódicamente si el cliente se fue.
+    Si se desconecta, llama a on_disconnect (ej. cancelar la consulta) y lanza QueryCancelledError.
+    """
+    task = asyncio.ensure_future(awaitable)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            return task.result()
+        if await fastapi_request.is_disconnected():
+            if on_disconnect is not None:
+                on_disconnect()
+            # Se deja terminar la tarea (la cancelación del driver la corta) para no dejar errores sueltos
+            task.add_done_callback(lambda t: t.exception() if not t.cancelled() else None)
+            raise QueryCancelledError("El cliente se desconectó")
+
+def _count_rows_answer(table_name: str, value: Any, count_mode: str, cached_count: Optional[Dict[str, Any]]) -> str:
+    if value is None:
+        return f"No fue posible contar los registros de la tabla **{table_name}**."
+    if count_mode == "approx":
+        return (
+            f"La tabla **{table_name}** tiene aproximadamente **{format_count(value)}** registros. "
+            "Es una estimación obtenida de las estadísticas del catálogo y puede diferir del total real; "
+            "si necesitas la cifra exacta, pide el conteo exacto."
+        )
+    if cached_count is not None:
+        computed_at = datetime.fromtimestamp(cached_count["computed_at"]).strftime("%H:%M")
+        return f"La tabla **{table_name}** tiene **{format_count(value)}** registros (conteo exacto calculado a las {computed_at})."
+    return f"La tabla **{table_name}** tiene **{format_count(value)}** registros (conteo exacto)."
 
+# ---------- Etapas del pipeline (compartidas por /human_query y /human_query/stream) ----------
+
+def _elapsed_ms(t0: float) -> float:
+    return (time.perf_counter() - t0) * 1000
+
+def _server_timing(timings: Dict[str, float]) -> str:
+    """
+    Header Server-Timing (ej. "connection;dur=3.1, llm_sql;dur=812.4, db;dur=20.7").
+    Lo ven las devtools del navegador y lo usa el benchmark de /human_query.
+    """
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+def _new_query_log(request: HumanQueryRequest, fastapi_request: Request, user: Dict[str, Any]) -> Dict[str, Any]:
     client_ip = fastapi_request.client.host if fastapi_request.client else None
     user_agent = fastapi_request.headers.get("user-agent", "")
-
-    query_log_data = {
-        "user_id": user_id,
-        "user_email": user_email,
+    return {
+        "user_id": user["user_id"],
+        "user_email": user.get("email") or str(user.get("user_id")),
         "question": request.question,
         "table_used": request.table,
         "llm_model": "gpt-4o",
         "llm_tokens_prompt": None,
         "llm_tokens_completion": None,
         "llm_tokens_total": None,
+        "llm_tokens_cached": None,
         "llm_response_time_ms": None,
         "sql_exec_time_ms": None,
         "sql_generated": None,
@@ -77,166 +174,954 @@ async def human_query(
         "feedback": None,
         "feedback_comment": None,
         "llm_final_answer": None,
-        "sql_raw_result": None
+        "sql_raw_result": None,
+        "truncated": None,
+        "approx_total_rows": None,
+        "cancel_reason": None,
+        "result_cache_hit": None,
+        "count_mode": None,
+        "sql_cache_match": None,
+        "plan_summary": None,
+        "connection_id": None,
     }
-    query_log_id = None
-    exec_time = None  # <--- Se define aquí para que esté disponible en cualquier caso
 
+async def _guarded(awaitable: Awaitable[Any], query_log_data: Dict[str, Any]) -> Any:
+    """
+    Ejecuta una etapa del pipeline; si falla, registra el intento y traduce el error a HTTPException.
+    """
     try:
-        # 1. Recupera la conexión activa
-        connection = get_active_connection_for_user(user_id, user_token)
-        if not connection:
-            query_log_data["error_message"] = "No hay conexión activa para el usuario."
-            query_log_id = log_query_attempt(query_log_data)
-            raise HTTPException(
-                status_code=400,
-                detail="No hay conexión activa para el usuario. Por favor conecta tu base de datos primero."
-            )
+        return await awaitable
+
+    except HTTPException as http_exc:
+        # Las etapas no registran antes de lanzar: un solo log por intento
+        await run_io(log_query_attempt, query_log_data)
+        raise http_exc
+
+    except LLMOverloadedError as e:
+        query_log_data["error_message"] = str(e)
+        query_log_data["cancel_reason"] = "llm_overloaded"
+        await run_io(log_query_attempt, query_log_data)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
 
-        # 2. Extrae el esquema de la base de datos activa
-        schema = get_database_schema(connection)
+    except QueryCostRejectedError as e:
+        query_log_data["error_message"] = str(e)
+        query_log_data["cancel_reason"] = "cost_rejected"
+        query_log_data["plan_summary"] = e.plan
+        await run_io(log_query_attempt, query_log_data)
+        raise HTTPException(status_code=422, detail={"message": str(e), "plan": e.plan})
+
+    except QueryNeedsConfirmationError as e:
+        query_log_data["error_message"] = str(e)
+        query_log_data["cancel_reason"] = "needs_confirmation"
+        query_log_data["plan_summary"] = e.plan
+        await run_io(log_query_attempt, query_log_data)
+        # 409: el frontend muestra el plan y reenvía la pregunta con confirm_cost=true
+        raise HTTPException(
+            status_code=409,
+            detail={"message": str(e), "plan": e.plan, "sql_query": query_log_data["sql_generated"]},
+        )
+
+    except QueryTimeoutError as e:
+        query_log_data["error_message"] = str(e)
+        query_log_data["cancel_reason"] = "timeout"
+        await run_io(log_query_attempt, query_log_data)
+        raise HTTPException(
+            status_code=504,
+            detail="La consulta tardó demasiado y fue cancelada. Intenta acotar la pregunta."
+        )
+
+    except QueryCancelledError as e:
+        query_log_data["error_message"] = f"Consulta cancelada: {e}"
+        query_log_data["cancel_reason"] = "client_disconnect"
+        await run_io(log_query_attempt, query_log_data)
+        # 499: el cliente cerró la petición (nadie recibirá esta respuesta)
+        raise HTTPException(status_code=499, detail="Consulta cancelada")
+
+    except Exception as e:
+        query_log_data["error_message"] = str(e)
+        await run_io(log_query_attempt, query_log_data)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al procesar la consulta: {str(e)}"
+        )
+
+async def _generate_sql_stage(
+    request: HumanQueryRequest,
+    fastapi_request: Request,
+    user: Dict[str, Any],
+    query_log_data: Dict[str, Any],
+    connection: Optional[Dict[str, Any]] = None,
+    llm_slot: Optional[asyncio.Semaphore] = None,
+) -> Dict[str, Any]:
+    """
+    Pasos 1-4: conexión activa, plantillas sin LLM y, si ninguna aplica, esquema y SQL
+    (desde el cache pregunta->SQL o desde el LLM).
+    connection: conexión ya resuelta (lote de preguntas); llm_slot: limita las llamadas al LLM en curso.
+    Retorna el contexto de la consulta; si el LLM respondió un saludo, ctx["info"] trae el mensaje.
+    """
+    user_email = query_log_data["user_email"]
+    timings: Dict[str, float] = {}
+
+    # 1. Recupera la conexión activa
+    if connection is None:
+        t0 = time.perf_counter()
+        connection = await run_io(get_active_connection_for_user, user["user_id"], user["jwt"])
+        timings["connection"] = _elapsed_ms(t0)
+    if not connection:
+        query_log_data["error_message"] = "No hay conexión activa para el usuario."
+        raise HTTPException(
+            status_code=400,
+            detail="No hay conexión activa para el usuario. Por favor conecta tu base de datos primero."
+        )
+    if connection.get("id") is not None:
+        query_log_data["connection_id"] = str(connection["id"])
+
+    # 2. Preguntas con una plantilla conocida (columnas, conteos, top-N, distintos, agregados,
+    #    rango de fechas, "muestra la tabla X"): SQL armado en el backend, sin esquema ni LLM.
+    #    Tablas y columnas se resuelven contra el catálogo cacheado (si aún no hay, se introspecta una vez)
+    selected_table = request.table or connection.get("dictionary_table")
+    schema_entry = peek_schema_entry(connection) or await run_db(get_schema_entry, connection)
+    schema_fingerprint = schema_entry.get("fingerprint") if schema_entry else None
+    sql_cache_entry = None
+    t0 = time.perf_counter()
+    llm_json = match_intent(
+        request.question,
+        connection.get("db_type", ""),
+        selected_table,
+        catalog=schema_entry.get("catalog") if schema_entry else None,
+        exact_count=request.exact_count,
+    )
+    timings["intent"] = _elapsed_ms(t0)
+    if llm_json is not None:
+        sql_result = llm_json["sql_query"]
+        query_log_data["llm_model"] = llm_json["model"]
+    else:
+        # 3. Extrae el esquema de la base de datos activa (cacheado; solo se re-introspecta si cambió)
+        #    En bases grandes se marcan las tablas relevantes para la pregunta (o se recorta el esquema)
+        t0 = time.perf_counter()
+        schema, relevant_tables = await run_db(get_prompt_schema, connection, request.question, selected_table)
+        timings["schema"] = _elapsed_ms(t0)
         if not schema or schema.strip() == "":
             query_log_data["error_message"] = "Esquema vacío"
-            query_log_id = log_query_attempt(query_log_data)
             raise HTTPException(
                 status_code=400,
                 detail="No se pudo extraer el esquema de la base de datos activa. Verifica que la conexión esté correctamente configurada."
             )
 
-        # 3. Llama al LLM para obtener el SQL y metadatos enriquecidos
-        sql_result, llm_json = call_openai_generate_sql(
-            question=request.question,
-            schema=schema,
-            data_dictionary=connection.get("data_dictionary"),
-            db_type=connection.get("db_type", ""),
-            dictionary_table=request.table or connection.get("dictionary_table"),
-            user_email=user_email,
-            return_metadata=True
-        )
-
-        # (1) Si es saludo/presentación
-        if llm_json and "info" in llm_json:
-            info_message = llm_json["info"]
-            query_log_data["llm_final_answer"] = info_message
-            query_log_data["llm_raw_request"] = llm_json.get("raw_prompt")
-            query_log_data["llm_raw_response"] = llm_json.get("raw_response")
-            query_log_data["prompt_template_version"] = llm_json.get("prompt_template_version")
-            query_log_id = log_query_attempt(query_log_data)
-            return HumanQueryResponse(
-                answer=info_message,
-                sql_query=None,
-                columns=None,
-                rows=None,
-                executionTime=None,
-                query_log_id=query_log_id,
-                chart=None,
-                list=None,
-                table=None,
-            )
-
-        # (2) Si LLM no generó SQL
-        if sql_result is None:
-            if isinstance(llm_json, dict) and "error" in llm_json:
-                error_msg = llm_json["error"]
-            else:
-                error_msg = "No se pudo generar consulta SQL (LLM falló)."
-            query_log_data["error_message"] = error_msg
-            query_log_data["llm_raw_request"] = llm_json.get("raw_prompt") if isinstance(llm_json, dict) else None
-            query_log_data["llm_raw_response"] = llm_json.get("raw_response") if isinstance(llm_json, dict) else None
-            query_log_data["prompt_template_version"] = llm_json.get("prompt_template_version") if isinstance(llm_json, dict) else None
-            query_log_id = log_query_attempt(query_log_data)
-            raise HTTPException(
-                status_code=400,
-                detail=error_msg
-            )
+        # 4. Llama al LLM para obtener el SQL y metadatos enriquecidos
+        #    (salvo que la misma pregunta, o una casi igual, ya tenga un SQL exitoso en cache)
+        schema_entry = peek_schema_entry(connection)
+        schema_fingerprint = schema_entry.get("fingerprint") if schema_entry else None
+        t0 = time.perf_counter()
+        if SQL_CACHE_ENABLED and connection.get("id"):
+            sql_cache_entry = sql_cache.get(connection["id"], schema_fingerprint, selected_table, request.question)
+        if sql_cache_entry is not None:
+            sql_result, llm_json = cached_llm_response(sql_cache_entry)
+            query_log_data["llm_model"] = llm_json["model"]
+            query_log_data["sql_cache_match"] = sql_cache_entry["match"]
+        else:
+            async with llm_slot or contextlib.nullcontext():
+                sql_result, llm_json = await await_unless_disconnected(call_openai_generate_sql(
+                    question=request.question,
+                    schema=schema,
+                    data_dictionary=connection.get("data_dictionary"),
+                    db_type=connection.get("db_type", ""),
+                    dictionary_table=selected_table,
+                    user_email=user_email,
+                    return_metadata=True,
+                    relevant_tables=relevant_tables,
+                ), fastapi_request)
+        timings["sql_cache" if sql_cache_entry is not None else "llm_sql"] = _elapsed_ms(t0)
 
-        if isinstance(sql_result, dict) and "error" in sql_result:
-            query_log_data["error_message"] = sql_result["error"]
-            query_log_id = log_query_attempt(query_log_data)
-            raise HTTPException(
-                status_code=400,
-                detail=sql_result["error"]
-            )
-
-        sql_query = sql_result if isinstance(sql_result, str) else None
-        if not sql_query:
-            query_log_data["error_message"] = "No se pudo generar consulta SQL válida."
-            query_log_id = log_query_attempt(query_log_data)
-            raise HTTPException(
-                status_code=400,
-                detail="No se pudo generar consulta SQL válida. Reformula tu pregunta."
-            )
+    ctx = {
+        "connection": connection,
+        "selected_table": selected_table,
+        "schema_fingerprint": schema_fingerprint,
+        "sql_cache_entry": sql_cache_entry,
+        "llm_json": llm_json,
+        "info": None,
+        "sql_query": None,
+        "timings": timings,
+    }
 
-        # (3) Guarda metadata LLM y SQL generado
-        query_log_data["sql_generated"] = sql_query
+    # (1) Si es saludo/presentación
+    if llm_json and "info" in llm_json:
+        query_log_data["llm_final_answer"] = llm_json["info"]
         query_log_data["llm_raw_request"] = llm_json.get("raw_prompt")
         query_log_data["llm_raw_response"] = llm_json.get("raw_response")
-        query_log_data["llm_tokens_prompt"] = llm_json.get("tokens_prompt")
-        query_log_data["llm_tokens_completion"] = llm_json.get("tokens_completion")
-        query_log_data["llm_tokens_total"] = llm_json.get("tokens_total")
-        query_log_data["llm_response_time_ms"] = llm_json.get("response_time_ms")
         query_log_data["prompt_template_version"] = llm_json.get("prompt_template_version")
+        ctx["info"] = llm_json["info"]
+        return ctx
 
-        # 4. Ejecuta el SQL y guarda resultados y métricas
-        import time
-        t0 = time.time()
-        columns, rows = execute_sql_query(connection, sql_query)
-        exec_time = (time.time() - t0) * 1000  # ms
-        query_log_data["sql_exec_time_ms"] = exec_time
-        query_log_data["sql_exec_success"] = True
-        query_log_data["columns"] = columns
-        query_log_data["row_count"] = len(rows)
-        query_log_data["sql_raw_result"] = rows
+    # (2) Si LLM no generó SQL
+    if sql_result is None:
+        if isinstance(llm_json, dict) and "error" in llm_json:
+            error_msg = llm_json["error"]
+        else:
+            error_msg = "No se pudo generar consulta SQL (LLM falló)."
+        query_log_data["error_message"] = error_msg
+        query_log_data["llm_raw_request"] = llm_json.get("raw_prompt") if isinstance(llm_json, dict) else None
+        query_log_data["llm_raw_response"] = llm_json.get("raw_response") if isinstance(llm_json, dict) else None
+        query_log_data["prompt_template_version"] = llm_json.get("prompt_template_version") if isinstance(llm_json, dict) else None
+        raise HTTPException(
+            status_code=400,
+            detail=error_msg
+        )
 
-    except HTTPException as http_exc:
-        query_log_id = log_query_attempt(query_log_data)
-        raise http_exc
+    if isinstance(sql_result, dict) and "error" in sql_result:
+        query_log_data["error_message"] = sql_result["error"]
+        raise HTTPException(
+            status_code=400,
+            detail=sql_result["error"]
+        )
 
-    except Exception as e:
-        query_log_data["error_message"] = str(e)
-        query_log_id = log_query_attempt(query_log_data)
+    sql_query = sql_result if isinstance(sql_result, str) else None
+    if not sql_query:
+        query_log_data["error_message"] = "No se pudo generar consulta SQL válida."
         raise HTTPException(
-            status_code=500,
-            detail=f"Error al procesar la consulta: {str(e)}"
+            status_code=400,
+            detail="No se pudo generar consulta SQL válida. Reformula tu pregunta."
+        )
+
+    # (3) Guarda metadata LLM y SQL generado
+    query_log_data["sql_generated"] = sql_query
+    query_log_data["llm_raw_request"] = llm_json.get("raw_prompt")
+    query_log_data["llm_raw_response"] = llm_json.get("raw_response")
+    query_log_data["llm_tokens_prompt"] = llm_json.get("tokens_prompt")
+    query_log_data["llm_tokens_completion"] = llm_json.get("tokens_completion")
+    query_log_data["llm_tokens_total"] = llm_json.get("tokens_total")
+    query_log_data["llm_tokens_cached"] = llm_json.get("tokens_cached")
+    query_log_data["llm_response_time_ms"] = llm_json.get("response_time_ms")
+    query_log_data["prompt_template_version"] = llm_json.get("prompt_template_version")
+    ctx["sql_query"] = sql_query
+    return ctx
+
+async def _execute_stage(
+    ctx: Dict[str, Any],
+    request: HumanQueryRequest,
+    fastapi_request: Request,
+    query_log_data: Dict[str, Any],
+) -> None:
+    """
+    Paso 5: ejecuta el SQL (o resuelve el conteo de registros) y deja columnas, filas y métricas en ctx.
+    """
+    connection = ctx["connection"]
+    llm_json = ctx["llm_json"]
+    sql_query = ctx["sql_query"]
+    t0 = time.time()
+    row_budget = resolve_row_budget(connection, request.max_rows)
+    query_timeout_ms = resolve_query_timeout(connection, request.timeout_ms)
+
+    async def run_query(sql: str):
+        cancel_handle = QueryCancelHandle()
+        return await await_unless_disconnected(
+            run_db(
+                execute_sql_query_cached,
+                connection, sql,
+                max_rows=row_budget,
+                timeout_ms=query_timeout_ms,
+                cancel_handle=cancel_handle,
+            ),
+            fastapi_request,
+            on_disconnect=cancel_handle.cancel,
         )
 
-    # 5. Genera respuesta amigable usando el LLM (solo muestra máximo 20 filas)
+    count_mode = llm_json.get("count_mode") if llm_json.get("force_count_rows_message") else None
+    count_table = llm_json.get("table_name")
+    cached_count = get_cached_exact_count(connection, count_table) if count_mode == "exact" else None
+    plan = None
+    if cached_count is not None:
+        # Conteo exacto ya calculado (en segundo plano o por una pregunta anterior)
+        columns, rows = ["count"], [[cached_count["count"]]]
+        exec_meta = {"truncated": False, "approx_total_rows": 1, "cache_hit": True}
+    elif count_mode is None and COST_GATE_ENABLED:
+        # Plan estimado antes de ejecutar: rechaza, limita o pide confirmación según la conexión.
+        # Se ejecuta la versión limitada, pero el SQL registrado sigue siendo el generado
+        t_plan = time.perf_counter()
+        run_sql, plan = await await_unless_disconnected(
+            run_db(check_query_cost, connection, sql_query, row_budget, bool(request.confirm_cost)),
+            fastapi_request,
+        )
+        ctx["timings"]["plan"] = _elapsed_ms(t_plan)
+        query_log_data["plan_summary"] = plan
+        columns, rows, exec_meta = await run_query(run_sql)
+        if plan["action"] == "limited" and exec_meta["truncated"]:
+            exec_meta = {**exec_meta, "approx_total_rows": plan["estimated_rows"]}
+    else:
+        columns, rows, exec_meta = await run_query(sql_query)
+    exact_sql = None
+    if count_mode == "approx" and (not rows or rows[0][0] is None):
+        # Sin estadísticas en el catálogo (tabla nueva, vista, etc.): se cuenta de verdad,
+        # solo si la tabla está en el catálogo (si no, se responde que no fue posible contar)
+        schema_entry = peek_schema_entry(connection)
+        exact_sql = build_exact_count_sql(count_table, connection.get("db_type", ""),
+                                          schema_entry.get("catalog") if schema_entry else None)
+    if exact_sql is not None:
+        count_mode = "exact"
+        sql_query = exact_sql
+        query_log_data["sql_generated"] = sql_query
+        columns, rows, exec_meta = await run_query(sql_query)
+    if count_mode == "exact" and cached_count is None and rows:
+        store_exact_count(connection, count_table, rows[0][0])
+    elif count_mode == "approx":
+        schedule_exact_count(connection, count_table)
+    exec_time = (time.time() - t0) * 1000  # ms
+    ctx["timings"]["db"] = exec_time
+    query_log_data["sql_exec_time_ms"] = exec_time
+    query_log_data["sql_exec_success"] = True
+    query_log_data["columns"] = columns
+    query_log_data["row_count"] = len(rows)
+    query_log_data["sql_raw_result"] = rows
+    query_log_data["truncated"] = exec_meta["truncated"]
+    query_log_data["approx_total_rows"] = exec_meta["approx_total_rows"]
+    query_log_data["result_cache_hit"] = exec_meta["cache_hit"]
+    query_log_data["count_mode"] = count_mode
+
+    ctx.update(
+        sql_query=sql_query,
+        columns=columns,
+        rows=rows,
+        exec_meta=exec_meta,
+        exec_time=exec_time,
+        count_mode=count_mode,
+        count_table=count_table,
+        cached_count=cached_count,
+        plan=plan,
+    )
+
+def _direct_answer(ctx: Dict[str, Any]) -> Optional[str]:
+    """
+    Respuesta que no necesita un segundo llamado al LLM (conteos y plantillas del motor de intenciones), o None.
+    """
+    if ctx["count_mode"]:
+        rows = ctx["rows"]
+        return _count_rows_answer(ctx["count_table"], rows[0][0] if rows else None, ctx["count_mode"], ctx["cached_count"])
+    if ctx["llm_json"].get("intent"):
+        return format_intent_answer(ctx["llm_json"], ctx["rows"])
+    return None
+
+def _used_llm(ctx: Dict[str, Any], explained: bool) -> bool:
+    return explained or ctx["llm_json"].get("model") not in ("backend-direct", "sql-cache")
+
+def _ready_answer(ctx: Dict[str, Any]) -> Optional[str]:
+    """
+    Respuesta disponible sin un segundo llamado al LLM: el conteo de registros o el "message"
+    que ya trajo la generación del SQL (que de todos modos tiene prioridad sobre la explicación).
+    """
+    answer_text = _direct_answer(ctx)
+    if answer_text is None and isinstance(ctx["llm_json"], dict):
+        answer_text = ctx["llm_json"].get("message") or None
+    return answer_text
+
+def _fallback_answer(rows: List[List[Any]], total_rows: Optional[int] = None) -> str:
+    return f"Consulta ejecutada correctamente. Registros: {len(rows) if total_rows is None else total_rows}."
+
+async def _explain_answer(
+    question: str,
+    sql_query: str,
+    columns: List[str],
+    rows: List[List[Any]],
+    user_email: str,
+    total_rows: Optional[int] = None,
+) -> str:
+    """
+    Paso 6: genera respuesta amigable usando el LLM (solo muestra máximo 20 filas).
+    total_rows: filas del resultado completo cuando rows es solo una vista previa (logs guardados).
+    """
     try:
         preview_rows = rows[:20]
-        answer_text, llm_explain_meta = call_openai_explain_answer(
-            question=request.question,
+        answer_text, llm_explain_meta = await call_openai_explain_answer(
+            question=question,
             sql=sql_query,
             columns=columns,
             rows=preview_rows,
             user_email=user_email,
-            return_metadata=True
+            return_metadata=True,
+            total_rows=total_rows,
         )
         if not answer_text or len(answer_text) < 5:
-            answer_text = f"Consulta ejecutada correctamente. Registros: {len(rows)}."
-        query_log_data["llm_final_answer"] = answer_text
+            answer_text = _fallback_answer(rows, total_rows)
     except Exception as e:
-        answer_text = f"Consulta ejecutada correctamente. Registros: {len(rows)}."
-        query_log_data["llm_final_answer"] = answer_text
+        logging.warning(f"[human_query] Falló la explicación, se usa la respuesta de respaldo: {e}")
+        answer_text = _fallback_answer(rows, total_rows)
+    return answer_text
+
+async def _log_and_cache_stage(ctx: Dict[str, Any], request: HumanQueryRequest, query_log_data: Dict[str, Any]) -> Optional[int]:
+    """
+    Registra la consulta y alimenta el cache pregunta->SQL. Retorna el id del log.
+    """
+    # Copia: el log se escribe en otro hilo mientras la petición sigue (ej. explicación en paralelo)
+    query_log_id = await run_io(log_query_attempt, dict(query_log_data))
 
-    query_log_id = log_query_attempt(query_log_data)
+    # Solo se cachean SQL generados por el LLM que se ejecutaron bien
+    connection = ctx["connection"]
+    if ctx["sql_cache_entry"] is not None:
+        sql_cache.link_log(ctx["sql_cache_entry"], query_log_id)
+    elif SQL_CACHE_ENABLED and connection.get("id") and ctx["llm_json"].get("prompt_template_version") != "backend-direct":
+        sql_cache.put(connection["id"], ctx["schema_fingerprint"], ctx["selected_table"], request.question,
+                      ctx["sql_query"], ctx["llm_json"], query_log_id)
+    return query_log_id
 
-    # 6. Prepara la respuesta enriquecida con todo lo relevante
-    def safe_data(val):
-        # Sanitiza cualquier valor potencialmente problemático
-        return sanitize_value(val) if 'sanitize_value' in globals() else val
+def _llm_extras(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    # Sanitiza cualquier valor potencialmente problemático
+    llm_json = ctx["llm_json"]
+    if not isinstance(llm_json, dict):
+        return {"chart": None, "list": None, "table": None}
+    return {
+        "chart": sanitize_value(llm_json.get("chart")),
+        "list": sanitize_value(llm_json.get("list")),
+        "table": sanitize_value(llm_json.get("table")),
+    }
+
+@router.post("/", response_model=HumanQueryResponse)
+async def human_query(
+    request: HumanQueryRequest,
+    fastapi_request: Request,
+    response: Response,
+    user=Depends(get_current_user)
+):
+    t_start = time.perf_counter()
+    query_log_data = _new_query_log(request, fastapi_request, user)
 
-    chart = safe_data(llm_json.get("chart")) if isinstance(llm_json, dict) else None
-    lista = safe_data(llm_json.get("list")) if isinstance(llm_json, dict) else None
-    tabla = safe_data(llm_json.get("table")) if isinstance(llm_json, dict) else None
+    ctx = await _guarded(_generate_sql_stage(request, fastapi_request, user, query_log_data), query_log_data)
+    timings = ctx["timings"]
+    if ctx["info"] is not None:
+        intent_stats.record_request(used_llm=True)
+        query_log_id = await run_io(log_query_attempt, query_log_data)
+        response.headers["Server-Timing"] = _server_timing({**timings, "total": _elapsed_ms(t_start)})
+        return HumanQueryResponse(
+            answer=ctx["info"],
+            sql_query=None,
+            columns=None,
+            rows=None,
+            executionTime=None,
+            query_log_id=query_log_id,
+            chart=None,
+            list=None,
+            table=None,
+        )
 
+    await _guarded(_execute_stage(ctx, request, fastapi_request, query_log_data), query_log_data)
+
+    # 6. Respuesta: solo se llama al LLM de explicación si no hay una respuesta ya resuelta
+    answer_text = _ready_answer(ctx)
+    answer_ready = answer_text is not None
+    explanation_pending = None
+    lazy_explain = request.lazy_explain if request.lazy_explain is not None else EXPLAIN_MODE == "lazy"
+    t0 = time.perf_counter()
+    if answer_text is not None:
+        query_log_data["llm_final_answer"] = answer_text
+        query_log_id = await _log_and_cache_stage(ctx, request, query_log_data)
+        timings["log"] = _elapsed_ms(t0)
+    elif lazy_explain:
+        # El frontend pide la explicación aparte: POST /human_query/logs/{id}/explain
+        answer_text = _fallback_answer(ctx["rows"])
+        explanation_pending = True
+        query_log_id = await _log_and_cache_stage(ctx, request, query_log_data)
+        timings["log"] = _elapsed_ms(t0)
+    else:
+        # La explicación corre en paralelo con el registro del log; luego se completa el log
+        explain_task = asyncio.ensure_future(_explain_answer(
+            request.question, ctx["sql_query"], ctx["columns"], ctx["rows"], query_log_data["user_email"]
+        ))
+        try:
+            query_log_id = await _log_and_cache_stage(ctx, request, query_log_data)
+            timings["log"] = _elapsed_ms(t0)
+        except Exception:
+            explain_task.cancel()
+            raise
+        answer_text = await explain_task
+        timings["explain"] = _elapsed_ms(t0)
+        query_log_data["llm_final_answer"] = answer_text
+        if query_log_id is not None:
+            io_executor.submit(update_query_log, query_log_id, {"llm_final_answer": answer_text})
+    intent_stats.record_request(_used_llm(ctx, explained=explanation_pending is None and not answer_ready))
+
+    # 7. Prepara la respuesta enriquecida con todo lo relevante
+    timings["total"] = _elapsed_ms(t_start)
+    response.headers["Server-Timing"] = _server_timing(timings)
+    exec_meta = ctx["exec_meta"]
+    count_mode = ctx["count_mode"]
     return HumanQueryResponse(
-        answer=llm_json.get("message", answer_text) if isinstance(llm_json, dict) and llm_json.get("message") else answer_text,
-        sql_query=sql_query,
-        columns=columns,
-        rows=rows,
-        executionTime=exec_time,
+        answer=answer_text,
+        sql_query=ctx["sql_query"],
+        columns=ctx["columns"],
+        rows=ctx["rows"],
+        executionTime=ctx["exec_time"],
         query_log_id=query_log_id,
-        chart=chart,
-        list=lista,
-        table=tabla,
+        truncated=exec_meta["truncated"],
+        approx_total_rows=exec_meta["approx_total_rows"],
+        cache_hit=exec_meta["cache_hit"],
+        approximate_count=(count_mode == "approx") if count_mode else None,
+        explanation_pending=explanation_pending,
+        plan=ctx["plan"],
+        **_llm_extras(ctx),
+    )
+
+# ---------- Variante en streaming (Server-Sent Events) ----------
+# Filas por evento "rows"
+SSE_ROWS_CHUNK = int(os.getenv("SSE_ROWS_CHUNK", "200"))
+
+def _sse(event: str, data: Any) -> str:
+    payload = json.dumps(sanitize_value(data), ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+@router.post("/stream")
+async def human_query_stream(
+    request: HumanQueryRequest,
+    fastapi_request: Request,
+    user=Depends(get_current_user)
+):
+    """
+    Igual que POST /human_query pero emite cada etapa apenas está lista (text/event-stream):
+      - stage: {"stage": "sql" | "executing" | "explaining"} (progreso)
+      - sql: SQL generado + chart/list/table sugeridos
+      - columns, luego rows en bloques de SSE_ROWS_CHUNK filas
+      - meta: tiempo de ejecución, truncado, cache, conteo aproximado
+      - answer_delta: la explicación token a token
+      - done: respuesta final completa + query_log_id
+      - info (saludo) o error {"status", "detail"} terminan el stream
+    """
+    query_log_data = _new_query_log(request, fastapi_request, user)
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            yield _sse("stage", {"stage": "sql"})
+            ctx = await _guarded(_generate_sql_stage(request, fastapi_request, user, query_log_data), query_log_data)
+            if ctx["info"] is not None:
+                intent_stats.record_request(used_llm=True)
+                query_log_id = await run_io(log_query_attempt, query_log_data)
+                yield _sse("info", {"answer": ctx["info"], "query_log_id": query_log_id})
+                return
+            yield _sse("sql", {"sql_query": ctx["sql_query"], "sql_cache_match": query_log_data["sql_cache_match"], **_llm_extras(ctx)})
+
+            yield _sse("stage", {"stage": "executing"})
+            await _guarded(_execute_stage(ctx, request, fastapi_request, query_log_data), query_log_data)
+            rows = ctx["rows"]
+            yield _sse("columns", {"columns": ctx["columns"], "sql_query": ctx["sql_query"]})
+            for start in range(0, len(rows), SSE_ROWS_CHUNK):
+                yield _sse("rows", {"offset": start, "rows": rows[start:start + SSE_ROWS_CHUNK]})
+            exec_meta = ctx["exec_meta"]
+            count_mode = ctx["count_mode"]
+            yield _sse("meta", {
+                "executionTime": ctx["exec_time"],
+                "row_count": len(rows),
+                "truncated": exec_meta["truncated"],
+                "approx_total_rows": exec_meta["approx_total_rows"],
+                "cache_hit": exec_meta["cache_hit"],
+                "approximate_count": (count_mode == "approx") if count_mode else None,
+                "plan": ctx["plan"],
+            })
+
+            # La explicación solo se pide al LLM si la respuesta no vino ya resuelta
+            answer_text = _ready_answer(ctx)
+            intent_stats.record_request(_used_llm(ctx, explained=not answer_text))
+            if answer_text:
+                yield _sse("answer_delta", {"text": answer_text})
+            else:
+                yield _sse("stage", {"stage": "explaining"})
+                parts = []
+                try:
+                    async for delta in stream_openai_explain_answer(
+                        question=request.question,
+                        sql=ctx["sql_query"],
+                        columns=ctx["columns"],
+                        rows=rows[:20],
+                        user_email=query_log_data["user_email"],
+                    ):
+                        parts.append(delta)
+                        yield _sse("answer_delta", {"text": delta})
+                except Exception as e:
+                    logging.warning(f"[human_query/stream] Falló la explicación en streaming: {e}")
+                answer_text = "".join(parts).strip()
+                if len(answer_text) < 5:
+                    answer_text = _fallback_answer(rows)
+                    if not parts:
+                        yield _sse("answer_delta", {"text": answer_text})
+            query_log_data["llm_final_answer"] = answer_text
+
+            query_log_id = await _log_and_cache_stage(ctx, request, query_log_data)
+            yield _sse("done", {"answer": answer_text, "query_log_id": query_log_id})
+        except HTTPException as e:
+            # La respuesta ya empezó (200): el error viaja como evento
+            yield _sse("error", {"status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            # Error fuera de las etapas (registro, serialización...): el cliente recibe igual el evento final
+            logging.error(f"[human_query/stream] Falló la consulta en streaming: {e}", exc_info=True)
+            yield _sse("error", {"status": 500, "detail": "Error interno al procesar la pregunta."})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# ---------- Lote de preguntas (reportes) ----------
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "50"))
+# Llamadas al LLM (SQL + explicación) y consultas a la base destino en curso por lote
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_DB_CONCURRENCY = int(os.getenv("BATCH_DB_CONCURRENCY", "4"))
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    table: Optional[str] = None
+    max_rows: Optional[int] = None
+    timeout_ms: Optional[int] = None
+    exact_count: Optional[bool] = None
+    lazy_explain: Optional[bool] = None
+    confirm_cost: Optional[bool] = None
+
+async def _batch_item(
+    index: int,
+    request: HumanQueryRequest,
+    fastapi_request: Request,
+    user: Dict[str, Any],
+    connection: Dict[str, Any],
+    llm_slot: asyncio.Semaphore,
+    db_slot: asyncio.Semaphore,
+) -> Dict[str, Any]:
+    """
+    Una pregunta del lote: mismo pipeline que /human_query (con su propio query_log),
+    pero con la conexión ya resuelta y los cupos de LLM y base compartidos por el lote.
+    """
+    t_start = time.perf_counter()
+    query_log_data = _new_query_log(request, fastapi_request, user)
+    item: Dict[str, Any] = {"index": index, "question": request.question}
+    try:
+        ctx = await _guarded(
+            _generate_sql_stage(request, fastapi_request, user, query_log_data, connection=connection, llm_slot=llm_slot),
+            query_log_data,
+        )
+        if ctx["info"] is not None:
+            intent_stats.record_request(used_llm=True)
+            query_log_id = await run_io(log_query_attempt, query_log_data)
+            item.update(status=200, answer=ctx["info"], query_log_id=query_log_id)
+            return item
+
+        async with db_slot:
+            await _guarded(_execute_stage(ctx, request, fastapi_request, query_log_data), query_log_data)
+
+        answer_text = _ready_answer(ctx)
+        answer_ready = answer_text is not None
+        explanation_pending = None
+        lazy_explain = request.lazy_explain if request.lazy_explain is not None else EXPLAIN_MODE == "lazy"
+        if answer_text is None and lazy_explain:
+            answer_text = _fallback_answer(ctx["rows"])
+            explanation_pending = True
+        elif answer_text is None:
+            t0 = time.perf_counter()
+            async with llm_slot:
+                answer_text = await _explain_answer(
+                    request.question, ctx["sql_query"], ctx["columns"], ctx["rows"], query_log_data["user_email"]
+                )
+            ctx["timings"]["explain"] = _elapsed_ms(t0)
+        query_log_data["llm_final_answer"] = answer_text
+        query_log_id = await _log_and_cache_stage(ctx, request, query_log_data)
+        intent_stats.record_request(_used_llm(ctx, explained=explanation_pending is None and not answer_ready))
+
+        exec_meta = ctx["exec_meta"]
+        count_mode = ctx["count_mode"]
+        item.update(
+            status=200,
+            answer=answer_text,
+            sql_query=ctx["sql_query"],
+            columns=ctx["columns"],
+            rows=ctx["rows"],
+            executionTime=ctx["exec_time"],
+            query_log_id=query_log_id,
+            truncated=exec_meta["truncated"],
+            approx_total_rows=exec_meta["approx_total_rows"],
+            cache_hit=exec_meta["cache_hit"],
+            approximate_count=(count_mode == "approx") if count_mode else None,
+            explanation_pending=explanation_pending,
+            plan=ctx["plan"],
+            timings=ctx["timings"],
+            **_llm_extras(ctx),
+        )
+    except HTTPException as e:
+        item.update(status=e.status_code, detail=e.detail)
+    except Exception as e:
+        # Un error fuera de las etapas (registro, armado de la respuesta...) no debe cortar el lote
+        logging.error(f"[human_query/batch] Falló la pregunta {index}: {e}", exc_info=True)
+        item = {"index": index, "question": request.question, "status": 500, "detail": "Error interno al procesar la pregunta."}
+    item["elapsed_ms"] = _elapsed_ms(t_start)
+    return item
+
+@router.post("/batch")
+async def human_query_batch(
+    request: BatchQueryRequest,
+    fastapi_request: Request,
+    user=Depends(get_current_user)
+):
+    """
+    Varias preguntas sobre la conexión activa en una sola petición (application/x-ndjson).
+    La conexión y el esquema se resuelven una vez; luego cada pregunta corre en paralelo con
+    BATCH_LLM_CONCURRENCY llamadas al LLM y BATCH_DB_CONCURRENCY consultas a la base como máximo.
+    Emite una línea por pregunta a medida que terminan (en cualquier orden, ver "index"):
+      {"index", "question", "status", "answer", "sql_query", "columns", "rows", "query_log_id",
+       "truncated", "approx_total_rows", "approximate_count", "plan", ...} (mismos campos que /human_query)
+    o {"index", "question", "status", "detail"} si falló; al final {"done": true, "ok", "failed", "elapsed_ms"}.
+    """
+    # "index" es la posición en request.questions (las preguntas vacías se omiten)
+    questions = [(i, q.strip()) for i, q in enumerate(request.questions) if q and q.strip()]
+    if not questions:
+        raise HTTPException(status_code=400, detail="El lote no trae preguntas.")
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"El lote admite como máximo {BATCH_MAX_QUESTIONS} preguntas.")
+
+    t_start = time.perf_counter()
+    connection = await run_io(get_active_connection_for_user, user["user_id"], user["jwt"])
+    if not connection:
+        raise HTTPException(
+            status_code=400,
+            detail="No hay conexión activa para el usuario. Por favor conecta tu base de datos primero."
+        )
+    # Un solo introspectado del esquema para todo el lote (las preguntas lo leen del cache)
+    await run_db(get_schema_entry, connection)
+
+    llm_slot = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    db_slot = asyncio.Semaphore(BATCH_DB_CONCURRENCY)
+    items = [
+        (index, HumanQueryRequest(
+            question=question,
+            table=request.table,
+            max_rows=request.max_rows,
+            timeout_ms=request.timeout_ms,
+            exact_count=request.exact_count,
+            lazy_explain=request.lazy_explain,
+            confirm_cost=request.confirm_cost,
+        ))
+        for index, question in questions
+    ]
+
+    async def lines() -> AsyncIterator[str]:
+        tasks = [
+            asyncio.ensure_future(_batch_item(index, item, fastapi_request, user, connection, llm_slot, db_slot))
+            for index, item in items
+        ]
+        ok = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                try:
+                    line = json.dumps(sanitize_value(item), ensure_ascii=False, default=str)
+                except Exception as e:
+                    logging.error(f"[human_query/batch] No se pudo serializar la pregunta {item['index']}: {e}")
+                    item = {"index": item["index"], "question": item["question"], "status": 500,
+                            "detail": "Error interno al procesar la pregunta."}
+                    line = json.dumps(item, ensure_ascii=False)
+                ok += item["status"] == 200
+                yield line + "\n"
+        finally:
+            # Cliente desconectado: no se siguen generando ni ejecutando las preguntas pendientes
+            for task in tasks:
+                task.cancel()
+        yield json.dumps({"done": True, "ok": ok, "failed": len(tasks) - ok, "elapsed_ms": _elapsed_ms(t_start)}) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/stats", response_model=dict)
+def human_query_stats(user=Depends(get_current_user)):
+    """
+    Estadísticas del worker actual (hit rate de caches, etc.).
+    """
+    return {
+        "result_cache": result_cache.stats(),
+        "sql_cache": sql_cache.stats(),
+        "llm": llm_client.stats(),
+        "intents": intent_stats.stats(),
+        "audit_log": audit_stats(),
+        "query_logs": query_log_writer.stats(),
+        "result_store": result_blob_store.stats(),
+    }
+
+# ---------- Descarga en streaming del resultado de una consulta registrada ----------
+
+def get_owned_query_log(log_id: int, user_id: str) -> Dict[str, Any]:
+    """
+    Recupera un log de query_logs verificando que pertenezca al usuario.
+    """
+    log = get_query_log(log_id)
+    if not log:
+        raise HTTPException(status_code=404, detail="Log no encontrado.")
+    if str(log.get("user_id")) != str(user_id):
+        raise HTTPException(status_code=403, detail="No puedes acceder a consultas de otro usuario.")
+    if not log.get("sql_generated"):
+        raise HTTPException(status_code=400, detail="La consulta registrada no tiene SQL generado.")
+    return log
+
+def _ndjson_lines(batches: Iterator[Any]) -> Iterator[str]:
+    # numeric llega como Decimal: default=str lo escribe como texto exacto ("1234.50"), no como float
+    columns = next(batches)
+    for batch in batches:
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + "\n"
+            for row in batch
+        )
+
+def _csv_chunks(batches: Iterator[Any]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(next(batches))
+    yield buffer.getvalue()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+def _rerun_target(log: Dict[str, Any], user: Dict[str, Any], confirm_cost: bool) -> Tuple[Dict[str, Any], int]:
+    """
+    Conexión y deadline para volver a ejecutar el SQL de un log, con los mismos controles que /human_query:
+      - solo sobre la conexión para la que se generó (409 si el usuario activó otra)
+      - deadline de la conexión (resolve_query_timeout) y control de costo (422 / 409 sin confirm_cost)
+    Los logs anteriores a query_logs.connection_id se ejecutan sobre la conexión activa.
+    """
+    connection = get_active_connection_for_user(user["user_id"], user["jwt"])
+    if not connection:
+        raise HTTPException(status_code=400, detail="No hay conexión activa para el usuario.")
+    logged_connection = log.get("connection_id")
+    if logged_connection is not None and str(logged_connection) != str(connection.get("id")):
+        raise HTTPException(
+            status_code=409,
+            detail="La consulta se generó para otra conexión. Activa esa conexión para volver a ejecutarla.",
+        )
+    if COST_GATE_ENABLED:
+        # Sin presupuesto de filas: se re-ejecuta para obtener el resultado completo
+        try:
+            check_query_cost(connection, log["sql_generated"], 0, confirm_cost)
+        except QueryCostRejectedError as e:
+            raise HTTPException(status_code=422, detail={"message": str(e), "plan": e.plan})
+        except QueryNeedsConfirmationError as e:
+            raise HTTPException(status_code=409, detail={"message": str(e), "plan": e.plan, "sql_query": log["sql_generated"]})
+    return connection, resolve_query_timeout(connection)
+
+_RERUN_TIMEOUT_DETAIL = "La consulta tardó demasiado y fue cancelada. Intenta acotar la pregunta."
+
+@router.get("/logs/{log_id}/stream")
+def stream_query_result(
+    log_id: int,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    confirm_cost: bool = Query(False),
+    user=Depends(get_current_user)
+):
+    """
+    Re-ejecuta el SQL de una consulta registrada sobre su conexión y devuelve
+    el resultado completo en streaming (NDJSON o CSV), con memoria constante en el servidor.
+    """
+    log = get_owned_query_log(log_id, user["user_id"])
+    connection, timeout_ms = _rerun_target(log, user, confirm_cost)
+
+    batches = iter_sql_query(connection, log["sql_generated"], timeout_ms=timeout_ms)
+    try:
+        # Se ejecuta la consulta antes de responder para poder devolver errores con status HTTP
+        first = next(batches)
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail=_RERUN_TIMEOUT_DETAIL)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al ejecutar la consulta: {str(e)}")
+
+    def _with_columns():
+        yield first
+        yield from batches
+
+    if format == "csv":
+        body, media_type = _csv_chunks(_with_columns()), "text/csv; charset=utf-8"
+    else:
+        body, media_type = _ndjson_lines(_with_columns()), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="consulta_{log_id}.{format}"'},
+    )
+
+@router.get("/logs/{log_id}/export")
+def export_query_result_file(
+    log_id: int,
+    format: str = Query("parquet", pattern="^(arrow|parquet)$"),
+    confirm_cost: bool = Query(False),
+    user=Depends(get_current_user)
+):
+    """
+    Re-ejecuta el SQL de una consulta registrada (sobre su conexión) y lo entrega en formato
+    columnar (Arrow IPC stream o Parquet), construido lote a lote desde el cursor.
+    En Postgres usa COPY ... TO STDOUT como vía rápida.
+    """
+    if not is_export_available():
+        raise HTTPException(status_code=501, detail="Exportación no disponible: falta instalar pyarrow en el servidor.")
+    log = get_owned_query_log(log_id, user["user_id"])
+    connection, timeout_ms = _rerun_target(log, user, confirm_cost)
+    try:
+        path = export_query_result(connection, log["sql_generated"], format, timeout_ms=timeout_ms)
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail=_RERUN_TIMEOUT_DETAIL)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al exportar la consulta: {str(e)}")
+    media_type, extension = EXPORT_FORMATS[format]
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=f"consulta_{log_id}.{extension}",
+        background=BackgroundTask(os.remove, path),
+    )
+
+# ---------- Explicación bajo demanda (EXPLAIN_MODE=lazy / lazy_explain) ----------
+
+def _logged_rows(log: Dict[str, Any]) -> List[List[Any]]:
+    raw = log.get("sql_raw_result")
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return []
+    return raw if isinstance(raw, list) else []
+
+@router.get("/logs/{log_id}/result")
+async def get_logged_result(log_id: int, user=Depends(get_current_user)):
+    """
+    Resultado completo de una consulta registrada, sin volver a ejecutarla:
+    query_logs guarda solo una vista previa (RESULT_RETENTION) y el resultado completo
+    se rehidrata desde el almacén de resultados por su sha256.
+    Responde {"columns", "rows"}; si no se conservó, 404 (usar /logs/{id}/stream para re-ejecutar).
+    """
+    log = await run_io(get_owned_query_log, log_id, user["user_id"])
+    digest = log.get("result_sha256")
+    if digest:
+        payload = await run_io(result_blob_store.get, digest)
+        if payload is not None:
+            return Response(content=payload, media_type="application/json", headers={"X-Result-Sha256": digest})
+
+    # Logs anteriores a la retención (o con la vista previa completa): el resultado está en el log
+    rows = _logged_rows(log)
+    if log.get("row_count") is not None and len(rows) >= log["row_count"]:
+        return {"columns": list(log.get("columns") or []), "rows": rows}
+    raise HTTPException(
+        status_code=404,
+        detail="El resultado completo de esta consulta no se conservó. Puedes volver a ejecutarla con /logs/{id}/stream.",
+    )
+
+@router.post("/logs/{log_id}/explain", response_model=dict)
+async def explain_query_log(log_id: int, user=Depends(get_current_user)):
+    """
+    Genera (una sola vez) la explicación amigable de una consulta ya respondida y la guarda en el log.
+    """
+    log = await run_io(get_owned_query_log, log_id, user["user_id"])
+    if log.get("llm_final_answer"):
+        return {"query_log_id": log_id, "answer": log["llm_final_answer"]}
+
+    # sql_raw_result guarda solo la vista previa (RESULT_RETENTION): el total sale de row_count
+    rows = _logged_rows(log)
+    answer_text = await _explain_answer(
+        log.get("question") or "",
+        log["sql_generated"],
+        list(log.get("columns") or []),
+        rows,
+        log.get("user_email") or str(user["user_id"]),
+        total_rows=log.get("row_count"),
     )
+    await run_io(update_query_log, log_id, {"llm_final_answer": answer_text})
+    return {"query_log_id": log_id, "answer": answer_text}
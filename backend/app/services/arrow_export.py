@@ -0,0 +1,208 @@
+# app/services/arrow_export.py
+
+import os
+import tempfile
+from decimal import Decimal
+from typing import Dict, Any, List, Optional
+
+from app.services.db_connector import iter_sql_query, copy_query_to_csv
+
+# pyarrow es opcional: sin él, los endpoints de exportación responden 501
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+
+EXPORT_FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+EXPORT_USE_COPY = os.getenv("EXPORT_USE_COPY", "true").lower() in ("1", "true", "yes")
+
+
+def is_export_available() -> bool:
+    return pa is not None
+
+
+class _BatchWriter:
+    """
+    Escribe record batches en Arrow IPC (stream) o Parquet, abriendo el writer con el primer schema.
+    """
+
+    def __init__(self, path: str, fmt: str):
+        self.path = path
+        self.fmt = fmt
+        self.schema = None
+        self._writer = None
+
+    def write(self, batch) -> None:
+        if self._writer is None:
+            self.schema = batch.schema
+            if self.fmt == "parquet":
+                self._writer = pa_parquet.ParquetWriter(self.path, self.schema, compression=PARQUET_COMPRESSION)
+            else:
+                self._writer = pa_ipc.new_stream(self.path, self.schema)
+        elif batch.schema != self.schema:
+            batch = batch.cast(self.schema)
+        self._writer.write_batch(batch)
+
+    def close(self, columns: Optional[List[str]] = None) -> None:
+        if self._writer is None:
+            # Resultado vacío: archivo válido con columnas tipo string
+            self.write(pa.RecordBatch.from_arrays(
+                [pa.array([], type=pa.string()) for _ in columns or []],
+                names=list(columns or []),
+            ))
+        self._writer.close()
+
+    def abort(self) -> None:
+        """
+        Cierra el writer sin completar el archivo (error a mitad de la exportación), para poder borrarlo.
+        """
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+
+def _rows_to_batch(columns: List[str], rows: List[List[Any]], schema=None, fixed_types: Optional[List[Any]] = None):
+    """
+    Convierte un lote fila-a-fila del cursor en un RecordBatch columnar.
+    fixed_types: tipo Arrow por columna según cursor.description (None = se infiere del primer lote).
+    Con schema se fuerzan los tipos del primer lote; columnas que venían todas nulas, o con valores
+    de tipos mezclados que Arrow no puede unificar, quedan como string.
+    """
+    column_values = list(zip(*rows)) if rows else [() for _ in columns]
+    arrays = []
+    for idx, values in enumerate(column_values):
+        if schema is not None:
+            field_type = schema.field(idx).type
+        else:
+            field_type = fixed_types[idx] if fixed_types else None
+        if field_type is not None and pa.types.is_string(field_type):
+            values = [None if v is None else str(v) for v in values]
+        if field_type is None:
+            try:
+                array = pa.array(list(values))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                array = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+            if pa.types.is_null(array.type):
+                array = array.cast(pa.string())
+        else:
+            array = pa.array(list(values), type=field_type)
+        arrays.append(array)
+    return pa.RecordBatch.from_arrays(arrays, names=list(columns))
+
+
+# Tipo Arrow según cursor.description, igual para COPY y para el camino por cursor:
+# OID de Postgres o tipo Python de pyodbc (SQL Server).
+_PG_ARROW_TYPES = {
+    16: "bool_",
+    20: "int64", 21: "int64", 23: "int64", 26: "int64",   # int8, int2, int4, oid
+    700: "float64", 701: "float64",                      # float4, float8
+}
+_PY_ARROW_TYPES = {bool: "bool_", int: "int64", float: "float64", str: "string"}
+_PG_NUMERIC = 1700
+_MAX_DECIMAL128_PRECISION = 38
+
+
+def _arrow_type(desc: Any):
+    """
+    Tipo Arrow de una columna, o None si no se conoce.
+    numeric/decimal nunca pasa por float: decimal128(p, s) si la columna declara precisión y escala,
+    si no (ej. SUM(numeric), numeric sin typmod) texto con el valor exacto.
+    """
+    type_code = desc[1]
+    if type_code == _PG_NUMERIC or type_code is Decimal:
+        precision, scale = desc[4], desc[5]
+        if precision and 0 < precision <= _MAX_DECIMAL128_PRECISION and scale is not None and 0 <= scale <= precision:
+            return pa.decimal128(precision, scale)
+        return pa.string()
+    if isinstance(type_code, type):
+        name = _PY_ARROW_TYPES.get(type_code)
+    elif isinstance(type_code, int):
+        name = _PG_ARROW_TYPES.get(type_code)
+    else:
+        name = None
+    return getattr(pa, name)() if name else None
+
+
+def _export_from_cursor(connection: Dict[str, Any], sql_query: str, writer: _BatchWriter, timeout_ms: Optional[int] = None) -> None:
+    batches = iter_sql_query(connection, sql_query, timeout_ms=timeout_ms, describe=True)
+    description = next(batches)
+    columns = [desc[0] for desc in description]
+    fixed_types = [_arrow_type(desc) for desc in description]
+    for rows in batches:
+        writer.write(_rows_to_batch(columns, rows, writer.schema, fixed_types))
+    writer.close(columns)
+
+
+def _copy_csv_options(description: List[Any]):
+    """
+    Opciones de pyarrow.csv para el CSV de COPY con tipos fijos por columna según cursor.description.
+    Lo que no tiene tipo conocido se lee como texto tal cual: nada de inferir tipos por muestra
+    (un código "00123" no debe volverse 123, ni un "ABC" tardío romper la exportación).
+    Las columnas se leen con nombres posicionales (c0, c1, ...) por si el resultado repite nombres.
+    """
+    names = [f"c{idx}" for idx in range(len(description))]
+    column_types = {name: _arrow_type(desc) or pa.string() for name, desc in zip(names, description)}
+    read_options = pa_csv.ReadOptions(column_names=names, skip_rows=1)
+    convert_options = pa_csv.ConvertOptions(
+        column_types=column_types,
+        # COPY escribe NULL como campo vacío sin comillas y '' como "": solo lo primero es nulo
+        null_values=[""],
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=False,
+        true_values=["t"],
+        false_values=["f"],
+    )
+    return read_options, convert_options
+
+
+def _write_copy_csv(path: str, description: List[Any], writer: _BatchWriter) -> None:
+    columns = [desc[0] for desc in description]
+    read_options, convert_options = _copy_csv_options(description)
+    reader = pa_csv.open_csv(path, read_options=read_options, convert_options=convert_options)
+    for batch in reader:
+        writer.write(pa.RecordBatch.from_arrays(batch.columns, names=columns))
+    writer.close(columns)
+
+
+def _export_from_copy(connection: Dict[str, Any], sql_query: str, writer: _BatchWriter, timeout_ms: Optional[int] = None) -> None:
+    # COPY vuelca a un CSV temporal en disco y pyarrow lo relee en streaming por bloques
+    with tempfile.NamedTemporaryFile(suffix=".csv") as csv_file:
+        description = copy_query_to_csv(connection, sql_query, csv_file, timeout_ms=timeout_ms)
+        csv_file.flush()
+        _write_copy_csv(csv_file.name, description, writer)
+
+
+def export_query_result(connection: Dict[str, Any], sql_query: str, fmt: str, timeout_ms: Optional[int] = None) -> str:
+    """
+    Ejecuta la consulta y escribe el resultado en un archivo temporal Arrow IPC o Parquet,
+    lote a lote (memoria acotada). Retorna la ruta; quien llama debe borrarla.
+    timeout_ms: deadline de la consulta (QueryTimeoutError si se supera).
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow no está instalado")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}")
+    fd, path = tempfile.mkstemp(suffix=f".{EXPORT_FORMATS[fmt][1]}")
+    os.close(fd)
+    writer = _BatchWriter(path, fmt)
+    try:
+        if EXPORT_USE_COPY and connection.get("db_type") in ("postgres", "postgresql"):
+            _export_from_copy(connection, sql_query, writer, timeout_ms)
+        else:
+            _export_from_cursor(connection, sql_query, writer, timeout_ms)
+    except Exception:
+        # El writer (ParquetWriter / stream IPC) tiene el archivo abierto: se cierra antes de borrarlo
+        writer.abort()
+        os.remove(path)
+        raise
+    return path
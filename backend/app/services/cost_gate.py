@@ -0,0 +1,163 @@
+# app/services/cost_gate.py
+#
+# Control de costo antes de ejecutar SQL generado: se pide el plan estimado al motor
+# (EXPLAIN en Postgres, SHOWPLAN_XML en SQL Server) y, según umbrales por conexión,
+# la consulta se ejecuta tal cual, se limita a presupuesto de filas, pide confirmación o se rechaza.
+
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from app.services.db_connector import get_query_plan_summary
+from app.services.result_cache import normalize_sql
+
+# --- Configuración ---
+COST_GATE_ENABLED = os.getenv("COST_GATE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Si el planner estima más filas que el presupuesto, se agrega LIMIT/TOP (la base no calcula de más)
+COST_GATE_AUTO_LIMIT = os.getenv("COST_GATE_AUTO_LIMIT", "true").lower() in ("1", "true", "yes")
+# Umbrales de costo (unidades del planner de cada motor; 0 = sin umbral).
+# Se pueden sobreescribir por conexión con plan_confirm_cost / plan_max_cost.
+_DEFAULT_THRESHOLDS = {
+    "postgres": (
+        float(os.getenv("COST_GATE_PG_CONFIRM_COST", "1000000")),
+        float(os.getenv("COST_GATE_PG_MAX_COST", "100000000")),
+    ),
+    "sqlserver": (
+        float(os.getenv("COST_GATE_MSSQL_CONFIRM_COST", "500")),
+        float(os.getenv("COST_GATE_MSSQL_MAX_COST", "50000")),
+    ),
+}
+_DEFAULT_THRESHOLDS["postgresql"] = _DEFAULT_THRESHOLDS["postgres"]
+# Planes recientes por (conexión, SQL normalizado): una pregunta repetida no paga otro EXPLAIN
+COST_GATE_PLAN_TTL = float(os.getenv("COST_GATE_PLAN_TTL", "600"))   # segundos
+COST_GATE_PLAN_CACHE_SIZE = int(os.getenv("COST_GATE_PLAN_CACHE_SIZE", "2000"))
+
+_plans: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+class QueryCostRejectedError(Exception):
+    """El costo estimado de la consulta supera el máximo permitido para la conexión."""
+
+    def __init__(self, message: str, plan: Dict[str, Any]):
+        super().__init__(message)
+        self.plan = plan
+
+
+class QueryNeedsConfirmationError(Exception):
+    """El costo estimado es alto: la consulta solo se ejecuta si el usuario la confirma."""
+
+    def __init__(self, message: str, plan: Dict[str, Any]):
+        super().__init__(message)
+        self.plan = plan
+
+
+def resolve_cost_thresholds(connection: Dict[str, Any]) -> Tuple[float, float]:
+    """
+    (costo que pide confirmación, costo máximo): los de la conexión o los por defecto de su motor.
+    """
+    default_confirm, default_max = _DEFAULT_THRESHOLDS.get((connection.get("db_type") or "").lower(), (0.0, 0.0))
+    confirm = connection.get("plan_confirm_cost")
+    maximum = connection.get("plan_max_cost")
+    return (
+        default_confirm if confirm is None else float(confirm),
+        default_max if maximum is None else float(maximum),
+    )
+
+
+_SQLSERVER_SELECT_RE = re.compile(r"^\s*select\s+(distinct\s+)?", re.IGNORECASE)
+_SQLSERVER_TOP_RE = re.compile(r"^\s*select\s+(distinct\s+)?top\b", re.IGNORECASE)
+
+
+def limit_sql(sql_query: str, limit: int, db_type: str) -> Optional[str]:
+    """
+    Versión de la consulta que devuelve como máximo `limit` filas, o None si no se puede limitar:
+      - Postgres: se envuelve como subconsulta (admite CTEs y ORDER BY adentro)
+      - SQL Server: TOP (n) en el SELECT principal (no aplica a CTEs ni a SELECT que ya tienen TOP)
+    """
+    sql_query = sql_query.strip().rstrip(";").rstrip()
+    if db_type.lower() in ("postgres", "postgresql"):
+        # Salto de línea antes del paréntesis: un comentario "--" al final no se come el cierre
+        return f"SELECT * FROM (\n{sql_query}\n) AS uq_limited LIMIT {int(limit)}"
+    if db_type.lower() == "sqlserver":
+        if _SQLSERVER_TOP_RE.match(sql_query):
+            return None
+        match = _SQLSERVER_SELECT_RE.match(sql_query)
+        if not match:
+            return None
+        return f"{sql_query[:match.end()]}TOP ({int(limit)}) {sql_query[match.end():]}"
+    return None
+
+
+def _plan_summary(connection: Dict[str, Any], sql_query: str) -> Optional[Dict[str, Any]]:
+    conn_id = connection.get("id")
+    key = (str(conn_id), normalize_sql(sql_query)) if conn_id else None
+    if key is not None:
+        with _lock:
+            entry = _plans.get(key)
+            if entry is not None and time.time() - entry[0] <= COST_GATE_PLAN_TTL:
+                _plans.move_to_end(key)
+                return entry[1]
+    plan = get_query_plan_summary(connection, sql_query)
+    if key is not None and plan is not None:
+        with _lock:
+            _plans[key] = (time.time(), plan)
+            _plans.move_to_end(key)
+            while len(_plans) > COST_GATE_PLAN_CACHE_SIZE:
+                _plans.popitem(last=False)
+    return plan
+
+
+def check_query_cost(
+    connection: Dict[str, Any],
+    sql_query: str,
+    row_budget: int,
+    confirmed: bool = False,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Revisa el plan estimado antes de ejecutar. Retorna (SQL a ejecutar, resumen del plan):
+      {"estimated_rows", "estimated_cost", "action", "limited_to", "limited_cost"}
+    action: "ok" | "limited" (se agregó LIMIT/TOP) | "confirmed" | "unavailable" (sin plan: se ejecuta igual).
+    Lanza QueryCostRejectedError o QueryNeedsConfirmationError según los umbrales de la conexión.
+    """
+    plan = _plan_summary(connection, sql_query)
+    if plan is None:
+        return sql_query, {"estimated_rows": None, "estimated_cost": None, "action": "unavailable"}
+
+    summary = {
+        "estimated_rows": plan.get("estimated_rows"),
+        "estimated_cost": plan.get("estimated_cost"),
+        "action": "ok",
+    }
+    cost = summary["estimated_cost"]
+    estimated_rows = summary["estimated_rows"]
+    if COST_GATE_AUTO_LIMIT and row_budget and estimated_rows is not None and estimated_rows > row_budget:
+        # +1: así la ejecución sigue detectando que el resultado quedó truncado
+        limited = limit_sql(sql_query, row_budget + 1, connection.get("db_type", ""))
+        limited_plan = _plan_summary(connection, limited) if limited else None
+        if limited_plan is not None:
+            sql_query = limited
+            cost = limited_plan.get("estimated_cost")
+            summary.update(action="limited", limited_to=row_budget, limited_cost=cost)
+
+    confirm_cost, max_cost = resolve_cost_thresholds(connection)
+    if cost is not None and max_cost and cost > max_cost:
+        summary["action"] = "rejected"
+        raise QueryCostRejectedError(
+            f"La consulta es demasiado costosa para esta base (costo estimado {cost:,.0f}, máximo {max_cost:,.0f}). "
+            "Intenta acotarla con filtros o menos tablas.",
+            summary,
+        )
+    if cost is not None and confirm_cost and cost > confirm_cost:
+        if not confirmed:
+            summary["action"] = "needs_confirmation"
+            raise QueryNeedsConfirmationError(
+                f"La consulta tiene un costo estimado alto ({cost:,.0f}). Confírmala para ejecutarla.",
+                summary,
+            )
+        if summary["action"] == "ok":
+            summary["action"] = "confirmed"
+    return sql_query, summary
@@ -1,101 +1,254 @@
 # app/services/db_connector.py
 
-from typing import Dict, Tuple, List, Any
+import os
+import re
+import json
+import uuid
+import threading
+from itertools import groupby
+from typing import Dict, Tuple, List, Any, Optional, Iterator
 import psycopg2
-import pyodbc
-from decimal import Decimal
-from datetime import datetime, date
+try:
+    import pyodbc
+except ImportError:  # Driver opcional: solo hace falta para conexiones SQL Server
+    pyodbc = None
 
 from app.utils.crypto import decrypt_password
-
-# --- Serializador seguro para cualquier valor raro ---
-def sanitize_value(value):
-    """
-    Convierte a tipos seguros para JSON/log/llm:
-      - Decimal -> float
-      - datetime/date -> str (ISO)
-      - list/tuple/dict -> recursivo
-    """
-    if isinstance(value, Decimal):
-        return float(value)
-    if isinstance(value, (datetime, date)):
-        return value.isoformat()
-    if isinstance(value, dict):
-        return {k: sanitize_value(v) for k, v in value.items()}
-    if isinstance(value, (list, tuple)):
-        return [sanitize_value(v) for v in value]
-    return value
+from app.utils.credential_cache import get_cached_credentials, store_credentials
+from app.utils.row_converters import build_row_converter, convert_rows
+from app.services.db_pool import pool_manager
 
 def ensure_password_decrypted(connection: Dict[str, Any]) -> Dict[str, Any]:
     """
     Devuelve una copia del dict de conexión con la password desencriptada si corresponde.
+    La password desencriptada (y el string ODBC de SQL Server) se cachean en memoria por
+    un tiempo corto para no pagar Fernet en cada llamada.
     """
     password = connection.get("password", "")
     # Heurística simple: Fernet (gAAAA...) y suficientemente largo
     if isinstance(password, str) and password.startswith("gAAAA") and len(password) > 50:
-        try:
-            decrypted = decrypt_password(password)
-        except Exception as e:
-            print(f"[ERROR] No se pudo desencriptar la password: {e}")
-            raise Exception("Password no válida o clave Fernet incorrecta")
+        cached = get_cached_credentials(connection) if connection.get("id") else None
+        if cached is None:
+            try:
+                decrypted = decrypt_password(password)
+            except Exception as e:
+                print(f"[ERROR] No se pudo desencriptar la password: {e}")
+                raise Exception("Password no válida o clave Fernet incorrecta")
+            odbc_conn_str = None
+            if connection.get("db_type") == "sqlserver":
+                odbc_conn_str = _build_sqlserver_conn_str({**connection, "password": decrypted})
+            if connection.get("id"):
+                store_credentials(connection, decrypted, odbc_conn_str)
+        else:
+            decrypted, odbc_conn_str = cached["password"], cached["odbc_conn_str"]
         new_conn = connection.copy()
         new_conn["password"] = decrypted
+        if odbc_conn_str:
+            new_conn["_odbc_conn_str"] = odbc_conn_str
         return new_conn
     return connection
 
-def get_database_schema(connection: Dict[str, Any]) -> str:
+# --- Opciones de introspección (se pueden sobreescribir por conexión) ---
+SCHEMA_INCLUDE_VIEWS = os.getenv("SCHEMA_INCLUDE_VIEWS", "false").lower() in ("1", "true", "yes")
+SCHEMA_ALL_SCHEMAS = os.getenv("SCHEMA_ALL_SCHEMAS", "false").lower() in ("1", "true", "yes")
+
+DEFAULT_SCHEMAS = {"postgres": "public", "postgresql": "public", "sqlserver": "dbo"}
+
+def quote_identifier(name: str, db_type: str) -> str:
     """
-    Devuelve el esquema de la base de datos (tablas y columnas) como string, para prompting del LLM.
+    Cita un identificador según el dialecto: "nombre" (Postgres) o [nombre] (SQL Server).
+    """
+    if (db_type or "").lower() == "sqlserver":
+        return "[" + name.replace("]", "]]") + "]"
+    return '"' + name.replace('"', '""') + '"'
+
+def sql_literal(value: str) -> str:
+    """
+    Texto como literal SQL entre comillas simples (comillas internas duplicadas).
+    """
+    return "'" + str(value).replace("'", "''") + "'"
+
+def table_reference(table: Dict[str, Any], db_type: str, qualified: bool = False) -> str:
+    """
+    Referencia citada a una tabla del catálogo; el esquema se omite si es el por defecto (salvo qualified).
+    """
+    if not qualified and table["schema"] == DEFAULT_SCHEMAS.get((db_type or "").lower()):
+        return quote_identifier(table["name"], db_type)
+    return f"{quote_identifier(table['schema'], db_type)}.{quote_identifier(table['name'], db_type)}"
+
+def resolve_schema_options(connection: Dict[str, Any], include_views: Optional[bool], all_schemas: Optional[bool]) -> Tuple[bool, bool]:
+    if include_views is None:
+        include_views = connection.get("schema_include_views")
+    if all_schemas is None:
+        all_schemas = connection.get("schema_all_schemas")
+    return (
+        SCHEMA_INCLUDE_VIEWS if include_views is None else bool(include_views),
+        SCHEMA_ALL_SCHEMAS if all_schemas is None else bool(all_schemas),
+    )
+
+def _group_catalog_rows(rows: List[Tuple]) -> List[Dict[str, Any]]:
+    """
+    Agrupa filas (schema, tabla, tipo, columna, tipo_dato) ya ordenadas en una lista de tablas.
+    """
+    catalog = []
+    for (schema_name, table_name, kind), cols in groupby(rows, key=lambda r: (r[0], r[1], r[2])):
+        catalog.append({
+            "schema": schema_name,
+            "name": table_name,
+            "kind": kind,
+            "columns": [{"name": c[3], "type": c[4]} for c in cols],
+        })
+    return catalog
+
+def _attach_foreign_keys(catalog: List[Dict[str, Any]], fk_rows: List[Tuple]) -> List[Dict[str, Any]]:
+    """
+    Agrega a cada tabla "references": tablas a las que apunta con FKs, como [schema, nombre].
+    fk_rows: (schema, tabla, schema_referenciado, tabla_referenciada)
+    """
+    by_name = {(t["schema"], t["name"]): t for t in catalog}
+    for table in catalog:
+        table.setdefault("references", [])
+    for schema_name, table_name, ref_schema, ref_name in fk_rows:
+        table = by_name.get((schema_name, table_name))
+        if table is not None and [ref_schema, ref_name] not in table["references"]:
+            table["references"].append([ref_schema, ref_name])
+    return catalog
+
+def render_schema(catalog: List[Dict[str, Any]], db_type: str = "") -> str:
+    """
+    Convierte el catálogo estructurado al formato de texto usado en el prompt del LLM.
+    Las tablas fuera del esquema por defecto (public/dbo) se muestran calificadas: esquema.tabla
+    """
+    default_schema = DEFAULT_SCHEMAS.get((db_type or "").lower())
+    schema_info = []
+    for table in catalog:
+        name = table["name"] if table["schema"] == default_schema else f"{table['schema']}.{table['name']}"
+        label = "Vista" if table["kind"] == "view" else "Tabla"
+        schema_info.append(f"{label}: {name}")
+        for column in table["columns"]:
+            schema_info.append(f"  - {column['name']} ({column['type']})")
+    return "\n".join(schema_info)
+
+def get_database_catalog(
+    connection: Dict[str, Any],
+    include_views: Optional[bool] = None,
+    all_schemas: Optional[bool] = None,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Devuelve el catálogo estructurado (tablas, vistas opcionales y columnas) en un solo round trip.
+    Retorna None si hubo error.
     """
     connection = ensure_password_decrypted(connection)
     db_type = connection.get("db_type")
     if db_type in ("postgres", "postgresql"):
-        return get_postgres_schema(connection)
+        return get_postgres_catalog(connection, include_views, all_schemas)
     elif db_type == "sqlserver":
-        return get_sqlserver_schema(connection)
-    else:
+        return get_sqlserver_catalog(connection, include_views, all_schemas)
+    return None
+
+def get_database_schema(
+    connection: Dict[str, Any],
+    include_views: Optional[bool] = None,
+    all_schemas: Optional[bool] = None,
+) -> str:
+    """
+    Devuelve el esquema de la base de datos (tablas y columnas) como string, para prompting del LLM.
+    """
+    db_type = connection.get("db_type")
+    if db_type not in ("postgres", "postgresql", "sqlserver"):
         return "Tipo de base de datos no soportado."
+    catalog = get_database_catalog(connection, include_views, all_schemas)
+    return render_schema(catalog, db_type) if catalog else ""
+
+_PG_CATALOG_FROM = """
+    FROM pg_catalog.pg_class c
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid
+    WHERE c.relkind::text = ANY(%s)
+      AND a.attnum > 0
+      AND NOT a.attisdropped
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+      AND n.nspname !~ '^pg_(toast|temp)'
+      AND (%s OR n.nspname = 'public')
+      AND pg_catalog.has_table_privilege(c.oid, 'SELECT')
+"""
 
-def get_postgres_schema(connection: Dict[str, Any]) -> str:
+_PG_FOREIGN_KEYS_SQL = """
+    SELECT DISTINCT n.nspname, c.relname, rn.nspname, rc.relname
+    FROM pg_catalog.pg_constraint k
+    JOIN pg_catalog.pg_class c ON c.oid = k.conrelid
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_catalog.pg_class rc ON rc.oid = k.confrelid
+    JOIN pg_catalog.pg_namespace rn ON rn.oid = rc.relnamespace
+    WHERE k.contype = 'f';
+"""
+
+_SQLSERVER_FOREIGN_KEYS_SQL = """
+    SELECT DISTINCT SCHEMA_NAME(p.schema_id), p.name, SCHEMA_NAME(r.schema_id), r.name
+    FROM sys.foreign_keys fk
+    JOIN sys.tables p ON p.object_id = fk.parent_object_id
+    JOIN sys.tables r ON r.object_id = fk.referenced_object_id;
+"""
+
+def _fetch_foreign_keys(conn: Any, sql: str, label: str) -> List[Tuple]:
+    """
+    Relaciones FK entre tablas. Si falla (permisos, etc.) el catálogo se entrega igual, sin relaciones.
+    """
+    cursor = conn.cursor()
     try:
-        conn = psycopg2.connect(
-            host=connection["host"],
-            port=connection.get("port", 5432),
-            database=connection["database"],
-            user=connection["username"],
-            password=connection["password"]
-        )
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT table_name
-            FROM information_schema.tables
-            WHERE table_schema='public'
-            ORDER BY table_name;
-        """)
-        tables = cursor.fetchall()
-        schema_info = []
-        for (table_name,) in tables:
-            cursor.execute("""
-                SELECT column_name, data_type
-                FROM information_schema.columns
-                WHERE table_name = %s
-                ORDER BY ordinal_position;
-            """, (table_name,))
-            columns = cursor.fetchall()
-            schema_info.append(f"Tabla: {table_name}")
-            for column_name, data_type in columns:
-                schema_info.append(f"  - {column_name} ({data_type})")
+        cursor.execute(sql)
+        return [tuple(r) for r in cursor.fetchall()]
+    except Exception as e:
+        print(f"[DB][{label}] No se pudieron leer las foreign keys: {e}")
+        if label == "Postgres":
+            conn.rollback()
+        return []
+    finally:
         cursor.close()
-        conn.close()
-        return "\n".join(schema_info)
+
+def get_postgres_catalog(
+    connection: Dict[str, Any],
+    include_views: Optional[bool] = None,
+    all_schemas: Optional[bool] = None,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Una sola consulta a pg_catalog para todas las tablas y columnas (en vez de una por tabla).
+    Por defecto solo tablas del esquema public; vistas y demás esquemas son opcionales.
+    """
+    include_views, all_schemas = resolve_schema_options(connection, include_views, all_schemas)
+    relkinds = ["r", "p"] + (["v", "m"] if include_views else [])
+    try:
+        with get_pooled_connection(connection) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT n.nspname,
+                       c.relname,
+                       CASE WHEN c.relkind IN ('v', 'm') THEN 'view' ELSE 'table' END,
+                       a.attname,
+                       pg_catalog.format_type(a.atttypid, a.atttypmod)
+                {_PG_CATALOG_FROM}
+                ORDER BY n.nspname, c.relname, a.attnum;
+            """, (relkinds, all_schemas))
+            rows = cursor.fetchall()
+            fk_rows = _fetch_foreign_keys(conn, _PG_FOREIGN_KEYS_SQL, "Postgres")
+            cursor.close()
+        return _attach_foreign_keys(_group_catalog_rows(rows), fk_rows)
     except Exception as e:
         print(f"[DB][Postgres] Error extrayendo schema: {e}")
-        return ""
+        return None
+
+def get_postgres_schema(connection: Dict[str, Any], include_views: Optional[bool] = None, all_schemas: Optional[bool] = None) -> str:
+    catalog = get_postgres_catalog(connection, include_views, all_schemas)
+    return render_schema(catalog, "postgres") if catalog else ""
 
 def get_sqlserver_conn_str(connection: Dict[str, Any]) -> str:
     """
     Construye el string de conexión para SQL Server (ODBC).
+    Si ensure_password_decrypted ya lo dejó precalculado (cache de credenciales), se reutiliza.
     """
+    return connection.get("_odbc_conn_str") or _build_sqlserver_conn_str(connection)
+
+def _build_sqlserver_conn_str(connection: Dict[str, Any]) -> str:
     host = connection["host"]
     port = str(connection.get("port", 1433))
     if "\\" in host:
@@ -110,89 +263,481 @@ def get_sqlserver_conn_str(connection: Dict[str, Any]) -> str:
         f"PWD={connection['password']};"
     )
 
-def get_sqlserver_schema(connection: Dict[str, Any]) -> str:
+# --- Pool de conexiones a las bases de datos de los usuarios ---
+# numeric llega como Decimal (exacto): la conversión a float es solo para la respuesta JSON
+# (row_converters); exportaciones y streaming conservan el valor exacto
+def _connect_postgres(connection: Dict[str, Any]):
+    conn = psycopg2.connect(
+        host=connection["host"],
+        port=connection.get("port", 5432),
+        database=connection["database"],
+        user=connection["username"],
+        password=connection["password"]
+    )
+    return conn
+
+def _connect_sqlserver(connection: Dict[str, Any]):
+    if pyodbc is None:
+        raise RuntimeError("pyodbc no está instalado: no se puede conectar a SQL Server")
+    return pyodbc.connect(get_sqlserver_conn_str(connection))
+
+def get_pooled_connection(connection: Dict[str, Any]):
+    """
+    Context manager que entrega una conexión reutilizable desde el pool de la conexión
+    (clave: id + huella de credenciales). Espera el dict con la password ya desencriptada.
+    """
+    db_type = connection.get("db_type")
+    if db_type in ("postgres", "postgresql"):
+        connect = lambda: _connect_postgres(connection)
+    elif db_type == "sqlserver":
+        connect = lambda: _connect_sqlserver(connection)
+    else:
+        raise Exception("Tipo de base de datos no soportado.")
+    return pool_manager.connection(connection, connect)
+
+_SQLSERVER_VIEWS_SQL = "UNION ALL SELECT object_id, schema_id, name, 'view' FROM sys.views WHERE is_ms_shipped = 0"
+
+def get_sqlserver_catalog(
+    connection: Dict[str, Any],
+    include_views: Optional[bool] = None,
+    all_schemas: Optional[bool] = None,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Una sola consulta a sys.tables/sys.columns (y sys.views si se piden) para todo el catálogo.
+    En SQL Server siempre se incluyen todos los esquemas de usuario (comportamiento histórico);
+    all_schemas solo restringe Postgres.
+    """
+    include_views, _ = resolve_schema_options(connection, include_views, all_schemas)
+    views_sql = _SQLSERVER_VIEWS_SQL if include_views else ""
     try:
-        conn_str = get_sqlserver_conn_str(connection)
-        conn = pyodbc.connect(conn_str)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT TABLE_NAME
-            FROM INFORMATION_SCHEMA.TABLES
-            WHERE TABLE_TYPE='BASE TABLE'
-            ORDER BY TABLE_NAME;
-        """)
-        tables = cursor.fetchall()
-        schema_info = []
-        for (table_name,) in tables:
-            cursor.execute("""
-                SELECT COLUMN_NAME, DATA_TYPE
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_NAME = ?
-                ORDER BY ORDINAL_POSITION;
-            """, (table_name,))
-            columns = cursor.fetchall()
-            schema_info.append(f"Tabla: {table_name}")
-            for column_name, data_type in columns:
-                schema_info.append(f"  - {column_name} ({data_type})")
-        cursor.close()
-        conn.close()
-        return "\n".join(schema_info)
+        with get_pooled_connection(connection) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT s.name, o.name, o.kind, c.name, TYPE_NAME(c.user_type_id)
+                FROM (
+                    SELECT object_id, schema_id, name, 'table' AS kind FROM sys.tables WHERE is_ms_shipped = 0
+                    {views_sql}
+                ) o
+                JOIN sys.schemas s ON s.schema_id = o.schema_id
+                JOIN sys.columns c ON c.object_id = o.object_id
+                ORDER BY s.name, o.name, c.column_id;
+            """)
+            rows = [tuple(r) for r in cursor.fetchall()]
+            cursor.close()
+            fk_rows = _fetch_foreign_keys(conn, _SQLSERVER_FOREIGN_KEYS_SQL, "SQLServer")
+        return _attach_foreign_keys(_group_catalog_rows(rows), fk_rows)
     except Exception as e:
         print(f"[DB][SQLServer] Error extrayendo schema: {e}")
-        return ""
+        return None
+
+def get_sqlserver_schema(connection: Dict[str, Any], include_views: Optional[bool] = None, all_schemas: Optional[bool] = None) -> str:
+    catalog = get_sqlserver_catalog(connection, include_views, all_schemas)
+    return render_schema(catalog, "sqlserver") if catalog else ""
+
+# --- Huella barata del esquema: permite saber si hay que volver a introspectar ---
+def get_schema_fingerprint(
+    connection: Dict[str, Any],
+    include_views: Optional[bool] = None,
+    all_schemas: Optional[bool] = None,
+) -> Optional[str]:
+    """
+    Devuelve un hash que cambia cuando cambia el esquema visible (tablas, columnas, tipos).
+    Se calcula en el servidor y devuelve una sola fila. Retorna None si hubo error.
+    """
+    connection = ensure_password_decrypted(connection)
+    db_type = connection.get("db_type")
+    include_views, all_schemas = resolve_schema_options(connection, include_views, all_schemas)
+    try:
+        if db_type in ("postgres", "postgresql"):
+            relkinds = ["r", "p"] + (["v", "m"] if include_views else [])
+            with get_pooled_connection(connection) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT md5(coalesce(string_agg(
+                               c.oid::text || '.' || c.relfilenode::text || '.' || a.attnum::text || '.'
+                               || a.attname || '.' || a.atttypid::text || '.' || a.atttypmod::text,
+                               ',' ORDER BY c.oid, a.attnum), ''))
+                    {_PG_CATALOG_FROM};
+                """, (relkinds, all_schemas))
+                row = cursor.fetchone()
+                cursor.close()
+            return f"pg:{row[0]}"
+        elif db_type == "sqlserver":
+            object_types = "('U', 'V')" if include_views else "('U')"
+            with get_pooled_connection(connection) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT COUNT(*), MAX(o.modify_date),
+                           (SELECT COUNT(*) FROM sys.columns c
+                            JOIN sys.objects oc ON oc.object_id = c.object_id
+                            WHERE oc.is_ms_shipped = 0 AND oc.type IN {object_types})
+                    FROM sys.objects o
+                    WHERE o.is_ms_shipped = 0 AND o.type IN {object_types};
+                """)
+                row = cursor.fetchone()
+                cursor.close()
+            modify_date = row[1].isoformat() if row[1] else ""
+            return f"mssql:{row[0]}:{row[2]}:{modify_date}"
+    except Exception as e:
+        print(f"[DB] Error calculando huella del esquema: {e}")
+    return None
+
+# --- Presupuesto de filas: se deja de leer al alcanzarlo ---
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "10000"))
+
+def resolve_row_budget(connection: Dict[str, Any], requested: Optional[int] = None) -> int:
+    """
+    Presupuesto efectivo: el de la conexión (o QUERY_MAX_ROWS); la petición solo puede reducirlo.
+    """
+    budget = int(connection.get("max_rows") or QUERY_MAX_ROWS)
+    if requested and requested > 0:
+        budget = min(budget, int(requested))
+    return budget
 
-def execute_sql_query(connection: Dict[str, Any], sql_query: str) -> Tuple[List[str], List[List[Any]]]:
+# --- Límites de tiempo y cancelación ---
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", "30000"))
+
+class QueryTimeoutError(Exception):
+    """La consulta superó su tiempo máximo de ejecución."""
+
+class QueryCancelledError(Exception):
+    """La consulta fue cancelada (ej. el cliente se desconectó)."""
+
+def resolve_query_timeout(connection: Dict[str, Any], requested_ms: Optional[int] = None) -> int:
+    """
+    Deadline efectivo en ms: el de la conexión (o QUERY_TIMEOUT_MS); la petición solo puede reducirlo.
+    """
+    timeout_ms = int(connection.get("statement_timeout_ms") or QUERY_TIMEOUT_MS)
+    if requested_ms and requested_ms > 0:
+        timeout_ms = min(timeout_ms, int(requested_ms))
+    return timeout_ms
+
+class QueryCancelHandle:
+    """
+    Permite cancelar desde otro hilo una consulta en curso:
+      - Postgres: conn.cancel()
+      - SQL Server: cursor.cancel()
+    Si se cancela antes de empezar, la consulta ni siquiera se envía.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._target = None
+        self.cancelled = False
+
+    def attach(self, target: Any) -> None:
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelledError("Consulta cancelada antes de ejecutarse")
+            self._target = target
+
+    def detach(self) -> None:
+        with self._lock:
+            self._target = None
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            target = self._target
+        if target is not None:
+            try:
+                target.cancel()
+            except Exception as e:
+                print(f"[DB] No se pudo cancelar la consulta: {e}")
+
+def _classify_execution_error(e: Exception, label: str, cancel_handle: Optional[QueryCancelHandle], timeout_ms: Optional[int]) -> Exception:
+    if cancel_handle is not None and cancel_handle.cancelled:
+        return QueryCancelledError("Consulta cancelada")
+    if label == "Postgres" and isinstance(e, psycopg2.extensions.QueryCanceledError):
+        return QueryTimeoutError(f"La consulta superó el tiempo máximo de {timeout_ms} ms")
+    # pyodbc: HYT00 = timeout, HY008 = operación cancelada
+    sqlstate = e.args[0] if label == "SQLServer" and getattr(e, "args", None) else None
+    if sqlstate == "HYT00":
+        return QueryTimeoutError(f"La consulta superó el tiempo máximo de {timeout_ms} ms")
+    if sqlstate == "HY008":
+        return QueryCancelledError("Consulta cancelada")
+    return e
+
+def _close_cursor_quietly(cursor: Any) -> None:
+    # Tras un error/cancelación la transacción puede quedar abortada; el rollback del pool la limpia
+    try:
+        cursor.close()
+    except Exception:
+        pass
+
+def _set_statement_timeout(conn: Any, label: str, timeout_ms: Optional[int]) -> None:
+    if not timeout_ms:
+        return
+    if label == "Postgres":
+        # SET LOCAL: vale solo para esta transacción; el rollback al devolverla al pool lo limpia
+        setup = conn.cursor()
+        setup.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+        setup.close()
+    else:
+        conn.timeout = max(1, -(-int(timeout_ms) // 1000))  # segundos, redondeo hacia arriba
+
+def execute_sql_query(
+    connection: Dict[str, Any],
+    sql_query: str,
+    max_rows: Optional[int] = None,
+    return_metadata: bool = False,
+    timeout_ms: Optional[int] = None,
+    cancel_handle: Optional[QueryCancelHandle] = None,
+):
     """
     Ejecuta una consulta SQL y retorna ([column_names], [rows]), todos los valores ya saneados.
+    Con max_rows se leen como máximo max_rows filas (en Postgres con cursor server-side, así
+    el resto ni siquiera viaja por la red). Con return_metadata retorna además
+    {"truncated": bool, "approx_total_rows": int|None}; el total aproximado sale del planner.
+    timeout_ms aplica statement_timeout (Postgres) o el query timeout de ODBC (SQL Server);
+    cancel_handle permite cancelarla desde otro hilo. Lanza QueryTimeoutError / QueryCancelledError.
     """
     connection = ensure_password_decrypted(connection)
     db_type = connection.get("db_type")
     if db_type in ("postgres", "postgresql"):
-        conn, cursor = None, None
-        try:
-            conn = psycopg2.connect(
-                host=connection["host"],
-                port=connection.get("port", 5432),
-                database=connection["database"],
-                user=connection["username"],
-                password=connection["password"]
-            )
-            cursor = conn.cursor()
-            cursor.execute(sql_query)
-            columns = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
-            # Sanear filas para Decimals, fechas, etc.
-            sanitized_rows = [ [sanitize_value(v) for v in row] for row in rows ]
-            return columns, sanitized_rows
-        except Exception as e:
-            print(f"[DB][Postgres] Error ejecutando SQL: {e}")
-            raise
-        finally:
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
+        label = "Postgres"
     elif db_type == "sqlserver":
-        conn, cursor = None, None
-        try:
-            conn_str = get_sqlserver_conn_str(connection)
-            conn = pyodbc.connect(conn_str)
-            cursor = conn.cursor()
-            cursor.execute(sql_query)
-            columns = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
-            sanitized_rows = [ [sanitize_value(v) for v in row] for row in rows ]
-            return columns, sanitized_rows
-        except Exception as e:
-            print(f"[DB][SQLServer] Error ejecutando SQL: {e}")
+        label = "SQLServer"
+    else:
+        raise Exception("Tipo de base de datos no soportado para ejecución SQL.")
+    truncated = False
+    try:
+        with get_pooled_connection(connection) as conn:
+            _set_statement_timeout(conn, label, timeout_ms)
+            if max_rows and label == "Postgres":
+                cursor = conn.cursor(name=f"uq_budget_{uuid.uuid4().hex}")
+                cursor.itersize = min(max_rows + 1, STREAM_BATCH_SIZE)
+            else:
+                cursor = conn.cursor()
+            if cancel_handle is not None:
+                cancel_handle.attach(conn if label == "Postgres" else cursor)
+            try:
+                cursor.execute(sql_query)
+                if max_rows:
+                    rows = cursor.fetchmany(max_rows + 1)
+                    truncated = len(rows) > max_rows
+                    rows = rows[:max_rows]
+                else:
+                    rows = cursor.fetchall()
+                columns = [desc[0] for desc in cursor.description]
+                # Conversión por columna (Decimals, fechas, bytes) decidida una sola vez
+                sanitized_rows = convert_rows(cursor.description, rows)
+            finally:
+                if cancel_handle is not None:
+                    cancel_handle.detach()
+                _close_cursor_quietly(cursor)
+                if label == "SQLServer" and timeout_ms:
+                    conn.timeout = 0
+    except (QueryTimeoutError, QueryCancelledError):
+        raise
+    except Exception as e:
+        print(f"[DB][{label}] Error ejecutando SQL: {e}")
+        error = _classify_execution_error(e, label, cancel_handle, timeout_ms)
+        if error is e:
             raise
-        finally:
-            if cursor:
+        raise error from e
+
+    if not return_metadata:
+        return columns, sanitized_rows
+    approx_total = len(sanitized_rows)
+    if truncated:
+        plan = get_query_plan_summary(connection, sql_query)
+        approx_total = plan["estimated_rows"] if plan and plan.get("estimated_rows") is not None else None
+    return columns, sanitized_rows, {"truncated": truncated, "approx_total_rows": approx_total}
+
+# --- Estimaciones del planner (sin ejecutar la consulta) ---
+_SHOWPLAN_ROWS_RE = re.compile(r'StatementEstRows="([0-9.eE+\-]+)"')
+_SHOWPLAN_COST_RE = re.compile(r'StatementSubTreeCost="([0-9.eE+\-]+)"')
+
+def get_query_plan_summary(connection: Dict[str, Any], sql_query: str) -> Optional[Dict[str, Any]]:
+    """
+    Pide el plan estimado al motor y devuelve {"estimated_rows", "estimated_cost"}.
+      - Postgres: EXPLAIN (FORMAT JSON)
+      - SQL Server: SET SHOWPLAN_XML ON (la consulta no se ejecuta)
+    Retorna None si no se pudo obtener.
+    """
+    connection = ensure_password_decrypted(connection)
+    db_type = connection.get("db_type")
+    sql_query = sql_query.strip().rstrip(";")
+    try:
+        if db_type in ("postgres", "postgresql"):
+            with get_pooled_connection(connection) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql_query}")
+                plan = cursor.fetchone()[0]
                 cursor.close()
-            if conn:
-                conn.close()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            root = plan[0]["Plan"]
+            return {
+                "estimated_rows": int(root.get("Plan Rows", 0)),
+                "estimated_cost": float(root.get("Total Cost", 0)),
+            }
+        elif db_type == "sqlserver":
+            with get_pooled_connection(connection) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SET SHOWPLAN_XML ON")
+                try:
+                    cursor.execute(sql_query)
+                    plan_xml = cursor.fetchone()[0]
+                finally:
+                    cursor.execute("SET SHOWPLAN_XML OFF")
+                    cursor.close()
+            rows_match = _SHOWPLAN_ROWS_RE.search(plan_xml or "")
+            cost_match = _SHOWPLAN_COST_RE.search(plan_xml or "")
+            return {
+                "estimated_rows": int(float(rows_match.group(1))) if rows_match else None,
+                "estimated_cost": float(cost_match.group(1)) if cost_match else None,
+            }
+    except Exception as e:
+        print(f"[DB] No se pudo obtener el plan estimado: {e}")
+    return None
+
+# --- Señales de cambio de datos (para invalidar resultados cacheados) ---
+_TABLE_REF_RE = re.compile(r'\b(?:from|join)\s+((?:[\w"\[\]]+\.)?[\w"\[\]]+)', re.IGNORECASE)
+
+def extract_table_names(sql_query: str) -> List[str]:
+    """
+    Extrae (heurísticamente) los nombres de tablas referenciadas en FROM/JOIN, sin esquema.
+    """
+    names = set()
+    for ref in _TABLE_REF_RE.findall(sql_query or ""):
+        name = ref.split(".")[-1].strip('"[]')
+        if name and name.lower() not in ("select", "lateral", "unnest"):
+            names.add(name)
+    return sorted(names)
+
+def get_table_change_signal(connection: Dict[str, Any], sql_query: str) -> Optional[str]:
+    """
+    Valor que cambia cuando se modifican las tablas que usa la consulta:
+      - Postgres: contadores de pg_stat_user_tables (inserts/updates/deletes y tuplas vivas/muertas)
+      - SQL Server: último last_user_update en sys.dm_db_index_usage_stats
+    Retorna None si no está disponible (sin permisos, etc.); en ese caso solo aplica el TTL.
+    """
+    connection = ensure_password_decrypted(connection)
+    db_type = connection.get("db_type")
+    tables = extract_table_names(sql_query)
+    try:
+        if db_type in ("postgres", "postgresql"):
+            with get_pooled_connection(connection) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT count(*),
+                           coalesce(sum(n_tup_ins + n_tup_upd + n_tup_del), 0),
+                           coalesce(sum(n_live_tup + n_dead_tup), 0)
+                    FROM pg_stat_user_tables
+                    WHERE cardinality(%s::text[]) = 0 OR relname = ANY(%s::text[]);
+                """, (tables, tables))
+                row = cursor.fetchone()
+                cursor.close()
+            return f"pg:{row[0]}:{row[1]}:{row[2]}"
+        elif db_type == "sqlserver":
+            with get_pooled_connection(connection) as conn:
+                cursor = conn.cursor()
+                if tables:
+                    placeholders = ", ".join("?" for _ in tables)
+                    table_filter = f"AND s.object_id IN (SELECT object_id FROM sys.tables WHERE name IN ({placeholders}))"
+                else:
+                    table_filter = ""
+                cursor.execute(f"""
+                    SELECT COUNT(*), MAX(s.last_user_update)
+                    FROM sys.dm_db_index_usage_stats s
+                    WHERE s.database_id = DB_ID() {table_filter};
+                """, *tables)
+                row = cursor.fetchone()
+                cursor.close()
+            return f"mssql:{row[0]}:{row[1].isoformat() if row[1] else ''}"
+    except Exception as e:
+        print(f"[DB] Señal de cambios no disponible: {e}")
+    return None
+
+# --- Ejecución en streaming: memoria constante sin importar el tamaño del resultado ---
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "2000"))
+SQLSERVER_ARRAYSIZE = int(os.getenv("SQLSERVER_ARRAYSIZE", str(STREAM_BATCH_SIZE)))
+
+def iter_sql_query(
+    connection: Dict[str, Any],
+    sql_query: str,
+    batch_size: Optional[int] = None,
+    timeout_ms: Optional[int] = None,
+    describe: bool = False,
+) -> Iterator[Any]:
+    """
+    Generador: primero entrega la lista de columnas (con describe, el cursor.description completo)
+    y luego lotes de filas ya saneadas; numeric/decimal se entregan como Decimal (sin pérdida).
+      - Postgres: cursor con nombre (server-side) + fetchmany, el servidor retiene el resultado.
+      - SQL Server: fetchmany por lotes con cursor.arraysize configurable.
+    La conexión vuelve al pool cuando el generador termina o se cierra (ej. cliente desconectado).
+    timeout_ms: deadline por sentencia (cada FETCH en Postgres); lanza QueryTimeoutError.
+    """
+    connection = ensure_password_decrypted(connection)
+    db_type = connection.get("db_type")
+    batch_size = batch_size or STREAM_BATCH_SIZE
+    if db_type in ("postgres", "postgresql"):
+        label = "Postgres"
+    elif db_type == "sqlserver":
+        label = "SQLServer"
     else:
         raise Exception("Tipo de base de datos no soportado para ejecución SQL.")
+    try:
+        with get_pooled_connection(connection) as conn:
+            _set_statement_timeout(conn, label, timeout_ms)
+            if label == "Postgres":
+                cursor = conn.cursor(name=f"uq_stream_{uuid.uuid4().hex}")
+                cursor.itersize = batch_size
+            else:
+                cursor = conn.cursor()
+                cursor.arraysize = SQLSERVER_ARRAYSIZE
+            try:
+                cursor.execute(sql_query)
+                # En cursores server-side la descripción está disponible recién tras el primer fetch
+                rows = cursor.fetchmany(batch_size)
+                yield list(cursor.description) if describe else [desc[0] for desc in cursor.description]
+                convert = build_row_converter(cursor.description, rows[0] if rows else None, exact_decimals=True)
+                while rows:
+                    yield convert(rows)
+                    rows = cursor.fetchmany(batch_size)
+            finally:
+                _close_cursor_quietly(cursor)
+                if label == "SQLServer" and timeout_ms:
+                    conn.timeout = 0
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        print(f"[DB][{label}] Error ejecutando SQL en streaming: {e}")
+        error = _classify_execution_error(e, label, None, timeout_ms)
+        if error is e:
+            raise
+        raise error from e
+
+def copy_query_to_csv(connection: Dict[str, Any], sql_query: str, fileobj: Any, timeout_ms: Optional[int] = None) -> List[Any]:
+    """
+    Solo Postgres: vuelca el resultado con COPY (...) TO STDOUT en CSV (con encabezado)
+    directamente a un archivo, sin pasar fila por fila por Python.
+    Retorna el cursor.description de la consulta (nombres y OIDs de tipo), obtenido con
+    LIMIT 0 antes del COPY: el CSV no trae tipos y adivinarlos daña los datos.
+    timeout_ms: deadline del COPY; lanza QueryTimeoutError.
+    """
+    connection = ensure_password_decrypted(connection)
+    if connection.get("db_type") not in ("postgres", "postgresql"):
+        raise Exception("COPY solo está disponible para Postgres.")
+    sql_query = sql_query.strip().rstrip(";").rstrip()
+    try:
+        with get_pooled_connection(connection) as conn:
+            _set_statement_timeout(conn, "Postgres", timeout_ms)
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"SELECT * FROM (\n{sql_query}\n) AS uq_describe LIMIT 0")
+                description = list(cursor.description)
+                cursor.copy_expert(f"COPY (\n{sql_query}\n) TO STDOUT WITH (FORMAT csv, HEADER true)", fileobj)
+            finally:
+                _close_cursor_quietly(cursor)
+    except Exception as e:
+        error = _classify_execution_error(e, "Postgres", None, timeout_ms)
+        if error is e:
+            raise
+        raise error from e
+    return description
 
 def get_table_names(connection: Dict[str, Any]) -> List[str]:
     """
@@ -202,41 +747,32 @@ def get_table_names(connection: Dict[str, Any]) -> List[str]:
     db_type = connection.get("db_type")
     if db_type in ("postgres", "postgresql"):
         try:
-            conn = psycopg2.connect(
-                host=connection["host"],
-                port=connection.get("port", 5432),
-                database=connection["database"],
-                user=connection["username"],
-                password=connection["password"]
-            )
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT table_name
-                FROM information_schema.tables
-                WHERE table_schema='public'
-                ORDER BY table_name;
-            """)
-            tables = [row[0] for row in cursor.fetchall()]
-            cursor.close()
-            conn.close()
+            with get_pooled_connection(connection) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT table_name
+                    FROM information_schema.tables
+                    WHERE table_schema='public'
+                    ORDER BY table_name;
+                """)
+                tables = [row[0] for row in cursor.fetchall()]
+                cursor.close()
             return tables
         except Exception as e:
             print(f"[DB][Postgres] Error obteniendo tablas: {e}")
             return []
     elif db_type == "sqlserver":
         try:
-            conn_str = get_sqlserver_conn_str(connection)
-            conn = pyodbc.connect(conn_str)
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT TABLE_NAME
-                FROM INFORMATION_SCHEMA.TABLES
-                WHERE TABLE_TYPE='BASE TABLE'
-                ORDER BY TABLE_NAME;
-            """)
-            tables = [row[0] for row in cursor.fetchall()]
-            cursor.close()
-            conn.close()
+            with get_pooled_connection(connection) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT TABLE_NAME
+                    FROM INFORMATION_SCHEMA.TABLES
+                    WHERE TABLE_TYPE='BASE TABLE'
+                    ORDER BY TABLE_NAME;
+                """)
+                tables = [row[0] for row in cursor.fetchall()]
+                cursor.close()
             return tables
         except Exception as e:
             print(f"[DB][SQLServer] Error obteniendo tablas: {e}")
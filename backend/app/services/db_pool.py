@@ -0,0 +1,322 @@
+# app/services/db_pool.py
+
+import os
+import time
+import hashlib
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+# --- Configuración por defecto (se puede sobreescribir por conexión) ---
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "0"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))          # segundos sin uso antes de cerrar
+# Ping (SELECT 1) al entregar una conexión reutilizada que estuvo inactiva al menos estos segundos.
+# 0 = en cada checkout: una desconexión del lado del servidor nunca llega a la consulta del usuario.
+DB_POOL_HEALTHCHECK_AFTER = float(os.getenv("DB_POOL_HEALTHCHECK_AFTER", "0"))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "30"))    # espera máxima por una conexión libre
+DB_POOL_REAPER_INTERVAL = float(os.getenv("DB_POOL_REAPER_INTERVAL", "60"))
+
+
+def credential_fingerprint(connection: Dict[str, Any]) -> str:
+    """
+    Huella de la identidad de la conexión (motor, host, base, usuario y password).
+    Si el usuario edita la conexión, la huella cambia y el pool anterior se descarta.
+    """
+    parts = [
+        str(connection.get("db_type", "")).lower(),
+        str(connection.get("host", "")),
+        str(connection.get("port", "")),
+        str(connection.get("database", "")),
+        str(connection.get("username", "")),
+        str(connection.get("password", "")),
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class PoolClosedError(Exception):
+    pass
+
+
+class _PooledEntry:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn: Any):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _is_healthy(conn: Any) -> bool:
+    """
+    Ping liviano (SELECT 1). Sirve tanto para psycopg2 como para pyodbc.
+    """
+    if getattr(conn, "closed", 0):
+        return False
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+    finally:
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+
+class ConnectionPool:
+    """
+    Pool thread-safe de conexiones DB-API para una conexión de usuario.
+      - min_size conexiones se mantienen abiertas aunque estén inactivas
+      - max_size limita las conexiones simultáneas (el resto espera)
+      - health check (SELECT 1) al entregar una conexión reutilizada; si falla se descarta
+        y se reintenta una vez con una conexión nueva
+      - cierre de conexiones inactivas por más de idle_timeout
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        idle_timeout: float = DB_POOL_IDLE_TIMEOUT,
+        healthcheck_after: float = DB_POOL_HEALTHCHECK_AFTER,
+    ):
+        self._connect = connect
+        self.max_size = max(1, int(max_size))
+        self.min_size = max(0, min(int(min_size), self.max_size))
+        self.idle_timeout = idle_timeout
+        self.healthcheck_after = healthcheck_after
+        self._idle: List[_PooledEntry] = []
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def size(self) -> int:
+        with self._cond:
+            return len(self._idle) + self._in_use
+
+    def acquire(self, timeout: float = DB_POOL_CHECKOUT_TIMEOUT) -> _PooledEntry:
+        deadline = time.monotonic() + timeout
+        entry = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolClosedError("Pool de conexiones cerrado")
+                if self._idle:
+                    # LIFO: la conexión usada más recientemente es la que tiene menos chance de estar muerta
+                    entry = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception("Tiempo de espera agotado esperando una conexión libre del pool")
+                self._cond.wait(remaining)
+
+        if entry is not None:
+            if time.monotonic() - entry.last_used < self.healthcheck_after or _is_healthy(entry.conn):
+                return entry
+            # Muerta (ej. el servidor cerró la sesión): se descarta y se reintenta una vez con una
+            # conexión nueva en el mismo cupo, sin pasarle el error a quien la pidió
+            print("[DB][Pool] Conexión inactiva rota; se reemplaza por una nueva")
+            _close_quietly(entry.conn)
+        try:
+            return _PooledEntry(self._connect())
+        except Exception:
+            self._release_slot()
+            raise
+
+    def release(self, entry: _PooledEntry, discard: bool = False) -> None:
+        if not discard:
+            try:
+                # Termina cualquier transacción abierta (y los SET LOCAL) antes de devolverla
+                entry.conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                _close_quietly(entry.conn)
+            else:
+                entry.last_used = time.monotonic()
+                self._idle.append(entry)
+            self._cond.notify()
+
+    def evict_idle(self) -> int:
+        """
+        Cierra conexiones inactivas por más de idle_timeout, respetando min_size.
+        """
+        now = time.monotonic()
+        evicted: List[_PooledEntry] = []
+        with self._cond:
+            total = len(self._idle) + self._in_use
+            keep: List[_PooledEntry] = []
+            # _idle está ordenado de la menos a la más recientemente usada
+            for entry in self._idle:
+                if now - entry.last_used > self.idle_timeout and total > self.min_size:
+                    evicted.append(entry)
+                    total -= 1
+                else:
+                    keep.append(entry)
+            self._idle = keep
+        for entry in evicted:
+            _close_quietly(entry.conn)
+        return len(evicted)
+
+    def fill_min(self) -> None:
+        while True:
+            with self._cond:
+                if self._closed or len(self._idle) + self._in_use >= self.min_size:
+                    return
+                self._in_use += 1
+            try:
+                entry = _PooledEntry(self._connect())
+            except Exception as e:
+                self._release_slot()
+                print(f"[DB][Pool] No se pudo precalentar conexión: {e}")
+                return
+            self.release(entry)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for entry in idle:
+            _close_quietly(entry.conn)
+
+    def _release_slot(self) -> None:
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+
+class PoolManager:
+    """
+    Administra un pool por identidad de conexión: (id de conexión, huella de credenciales).
+    """
+
+    def __init__(self):
+        self._pools: Dict[Tuple[str, str], ConnectionPool] = {}
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+
+    def _get_pool(self, connection: Dict[str, Any], connect: Callable[[], Any]) -> ConnectionPool:
+        conn_id = str(connection.get("id") or "adhoc")
+        key = (conn_id, credential_fingerprint(connection))
+        stale: List[ConnectionPool] = []
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                # Si la conexión fue editada, la huella cambió: descarta los pools anteriores del mismo id
+                for other_key in [k for k in self._pools if k[0] == conn_id]:
+                    stale.append(self._pools.pop(other_key))
+                pool = ConnectionPool(
+                    connect,
+                    min_size=connection.get("pool_min_size") or DB_POOL_MIN_SIZE,
+                    max_size=connection.get("pool_max_size") or DB_POOL_MAX_SIZE,
+                )
+                self._pools[key] = pool
+                created = True
+            else:
+                created = False
+            self._ensure_reaper()
+        for old in stale:
+            old.close()
+        if created and pool.min_size:
+            pool.fill_min()
+        return pool
+
+    @contextmanager
+    def connection(self, connection: Dict[str, Any], connect: Callable[[], Any]):
+        """
+        Context manager: entrega una conexión del pool y la devuelve al salir.
+        Si la conexión queda rota (error de conexión o rollback fallido), se descarta en vez de reutilizarla.
+        """
+        pool = self._get_pool(connection, connect)
+        try:
+            entry = pool.acquire()
+        except PoolClosedError:
+            # El pool fue invalidado/limpiado justo ahora: se pide uno nuevo
+            pool = self._get_pool(connection, connect)
+            entry = pool.acquire()
+        discard = False
+        try:
+            yield entry.conn
+        except Exception as e:
+            # Error de conexión (DB-API OperationalError/InterfaceError): no se devuelve al pool
+            discard = type(e).__name__ in ("OperationalError", "InterfaceError")
+            raise
+        finally:
+            pool.release(entry, discard=discard)
+
+    def invalidate(self, connection_id: Any) -> None:
+        """
+        Cierra todos los pools de una conexión (al eliminarla o editarla).
+        """
+        conn_id = str(connection_id)
+        with self._lock:
+            pools = [self._pools.pop(k) for k in list(self._pools) if k[0] == conn_id]
+        for pool in pools:
+            pool.close()
+        if pools:
+            logging.info(f"[DB][Pool] Pools invalidados para conexión {conn_id}")
+
+    def evict_idle(self) -> None:
+        with self._lock:
+            pools = list(self._pools.items())
+        for key, pool in pools:
+            pool.evict_idle()
+            # Pools vacíos sin mínimo se eliminan para no acumular conexiones ad-hoc
+            if pool.size == 0 and pool.min_size == 0:
+                with self._lock:
+                    if self._pools.get(key) is pool:
+                        self._pools.pop(key)
+                        pool.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+    def _ensure_reaper(self) -> None:
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+
+        def _reap():
+            while True:
+                time.sleep(DB_POOL_REAPER_INTERVAL)
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    print(f"[DB][Pool] Error en limpieza de conexiones inactivas: {e}")
+
+        self._reaper = threading.Thread(target=_reap, name="db-pool-reaper", daemon=True)
+        self._reaper.start()
+
+
+pool_manager = PoolManager()
+
+
+def invalidate_connection_pools(connection_id: Any) -> None:
+    pool_manager.invalidate(connection_id)
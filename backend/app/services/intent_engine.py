@@ -0,0 +1,508 @@
+# app/services/intent_engine.py
+
+import re
+import threading
+import unicodedata
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.services.db_connector import quote_identifier as _quote, sql_literal, table_reference as _table_ref
+from app.services.row_count import resolve_count_mode, build_exact_count_sql, build_approx_count_sql, format_count
+
+# Filas por defecto para "muestra la tabla X" (mismo criterio que el prompt del LLM)
+SHOW_TABLE_LIMIT = 100
+MAX_TEMPLATE_LIMIT = 1000
+
+# --- Patrones precompilados (se evalúan sobre la pregunta en minúsculas y sin acentos) ---
+_TABLE_NAME_RE = re.compile(r"tabla\s*'?([a-zA-Z0-9_]+)'?", re.IGNORECASE)
+
+_LIST_COLUMNS_RES = [re.compile(p) for p in (
+    r"(?:cu[aá]les|c[uú]ales|n[oó]mbra|lista|detalla|d[aá]me|m[uú]estrame|menciona|nómbrame|puedes|quiero|me puedes)\s*(?:son)?\s*(?:las)?\s*columnas",
+    r"qué columnas (?:hay|existen)",
+    r"detalle de las columnas",
+    r"lista las columnas",
+    r"me puedes listar las columnas",
+    r"puedes listar las columnas",
+    r"muestrame las columnas",
+    r"detalla las columnas",
+    r"nombrame las columnas",
+    r"menciona las columnas",
+)]
+_COUNT_COLUMNS_RES = [re.compile(p) for p in (
+    r"cu[aá]ntas columnas",
+    r"cuantas columnas",
+    r"n[uú]mero de columnas",
+    r"columnas tiene",
+    r"columnas hay",
+)]
+_COUNT_ROWS_RES = [re.compile(p) for p in (
+    r"cu[aá]ntos registros",
+    r"cuantos registros",
+    r"cu[aá]ntas filas",
+    r"cuantas filas",
+    r"n[uú]mero de registros",
+    r"registros hay",
+    r"filas hay",
+)]
+
+_SHOW_TABLE_RE = re.compile(r"\b(?:muestra(?:me)?|mostrar|ver|ensename|despliega|show)\b.*\btabla\b")
+_FIRST_ROWS_RE = re.compile(r"\b(?:primer[oa]s\s+)?(\d{1,4})\s+(?:registros|filas)\b")
+_TOP_N_RE = re.compile(r"\btop\s*(\d{1,4})\b|\b(?:los|las)\s+(\d{1,4})\b")
+_DESC_RE = re.compile(r"\b(?:top|mayor(?:es)?|mas\s+alt[oa]s?|mas\s+grandes?|maxim[oa]s?|highest)\b")
+_ASC_RE = re.compile(r"\b(?:menor(?:es)?|mas\s+baj[oa]s?|mas\s+pequen[oa]s?|minim[oa]s?|lowest)\b")
+_DISTINCT_RE = re.compile(r"\b(?:distint[oa]s|unic[oa]s|diferentes)\b")
+_COUNT_WORD_RE = re.compile(r"\bcuant[oa]s\b")
+_AGG_RES = [
+    ("max", re.compile(r"\b(?:maximo|max|valor\s+mas\s+alto|mayor\s+valor)\b")),
+    ("min", re.compile(r"\b(?:minimo|min|valor\s+mas\s+bajo|menor\s+valor)\b")),
+    ("avg", re.compile(r"\b(?:promedio|media|average|avg)\b")),
+    ("sum", re.compile(r"\b(?:suma|sumatoria|sum)\b")),
+]
+_DATE_RE = re.compile(r"\b(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{4})\b")
+_RANGE_RE = re.compile(r"\b(?:entre|desde)\b.*\b(?:y|hasta|al)\b")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_CAMEL_RE = re.compile(r"([a-z0-9])([A-Z])")
+
+# Palabras que una plantilla puede "consumir" sin cambiar su significado. Si la pregunta tiene
+# cualquier otra palabra que no sea la tabla o la columna (ej. "por región", "del 2023"),
+# la plantilla no aplica y la pregunta va al LLM.
+_FILLER = {
+    "a", "al", "de", "del", "el", "la", "las", "lo", "los", "un", "una", "en", "con", "que", "cual", "cuales",
+    "es", "son", "hay", "me", "mi", "dame", "dime", "muestra", "muestrame", "mostrar", "ver", "ensename",
+    "despliega", "show", "quiero", "saber", "puedes", "podrias", "por", "favor", "tabla", "columna", "campo",
+    "registro", "fila", "dato", "todo", "toda", "valor", "segun", "para", "se", "existen", "tiene", "tienen",
+    "of", "the", "table", "column", "in",
+}
+_TEMPLATE_WORDS = {
+    "show_table": {"primer", "primeros", "primeras"},
+    "top_n": {"top", "mayor", "menor", "mas", "alto", "alta", "bajo", "baja", "grande", "pequeno", "pequena",
+              "maximo", "maxima", "minimo", "minima", "highest", "lowest", "ordenado", "ordenada"},
+    "distinct": {"distinto", "distinta", "unico", "unica", "diferente", "opcion", "opciones", "categoria", "tipo",
+                 "cuanto", "cuanta"},
+    "aggregate": {"maximo", "max", "minimo", "min", "promedio", "media", "average", "avg", "suma", "sumatoria", "sum",
+                  "mas", "alto", "bajo", "mayor", "menor", "total"},
+    "date_range": {"entre", "desde", "hasta", "y", "cuanto", "cuanta", "fecha", "rango", "periodo"},
+}
+
+_NUMERIC_TYPES = ("int", "numeric", "decimal", "float", "double", "real", "money", "number", "serial")
+_DATE_TYPES = ("date", "time")
+
+_AGG_SQL = {"max": "MAX", "min": "MIN", "avg": "AVG", "sum": "SUM"}
+_AGG_LABEL = {"max": "máximo", "min": "mínimo", "avg": "promedio", "sum": "suma"}
+
+
+# ----------- Normalización -----------
+def _strip_accents(text: str) -> str:
+    return unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii")
+
+
+def _normalize(text: str) -> str:
+    return _strip_accents(text).lower().strip()
+
+
+def _stem(word: str) -> str:
+    # Singular aproximado, igual para preguntas e identificadores: "regiones" ~ "region", "clientes" ~ "cliente"
+    if len(word) > 4 and word.endswith("es"):
+        word = word[:-2]
+    elif len(word) > 3 and word.endswith("s"):
+        word = word[:-1]
+    if len(word) > 4 and word.endswith("e"):
+        word = word[:-1]
+    return word
+
+
+def _tokens(text: str) -> List[str]:
+    """
+    Términos comparables entre preguntas e identificadores (snake_case, camelCase, plurales).
+    """
+    text = _CAMEL_RE.sub(r"\1 \2", _strip_accents(str(text))).lower().replace("_", " ")
+    return [_stem(w) for w in _WORD_RE.findall(text)]
+
+
+# Mismo stemming que los tokens de la pregunta
+_FILLER = {_stem(w) for w in _FILLER}
+_TEMPLATE_WORDS = {name: {_stem(w) for w in words} for name, words in _TEMPLATE_WORDS.items()}
+
+
+def _find_sequence(haystack: List[str], needle: List[str]) -> int:
+    n = len(needle)
+    for i in range(len(haystack) - n + 1):
+        if haystack[i:i + n] == needle:
+            return i
+    return -1
+
+
+# ----------- Intenciones clásicas (no requieren catálogo) -----------
+def extract_table_name_from_question(question: str) -> Optional[str]:
+    match = _TABLE_NAME_RE.search(question)
+    if match:
+        nombre = match.group(1).lower()
+        if nombre not in ["la", "tabla", "columna", "columnas"]:
+            return nombre
+    return None
+
+
+def is_list_columns_question(question: str) -> bool:
+    q = question.lower().strip()
+    return any(p.search(q) for p in _LIST_COLUMNS_RES)
+
+
+def is_count_columns_question(question: str) -> bool:
+    q = question.lower().strip()
+    return any(p.search(q) for p in _COUNT_COLUMNS_RES)
+
+
+def is_count_rows_question(question: str) -> bool:
+    q = question.lower().strip()
+    return any(p.search(q) for p in _COUNT_ROWS_RES)
+
+
+# ----------- SQL por dialecto -----------
+def _is_sqlserver(db_type: str) -> bool:
+    return (db_type or "").lower() == "sqlserver"
+
+
+def _select_limited(columns_sql: str, from_sql: str, limit: int, db_type: str, tail: str = "") -> str:
+    if _is_sqlserver(db_type):
+        return f"SELECT TOP {limit} {columns_sql} FROM {from_sql}{tail};"
+    return f"SELECT {columns_sql} FROM {from_sql}{tail} LIMIT {limit};"
+
+
+def _date_literal(value: date, db_type: str) -> str:
+    # SQL Server: 'YYYYMMDD' no depende de DATEFORMAT/idioma de la sesión
+    return f"'{value.strftime('%Y%m%d')}'" if _is_sqlserver(db_type) else f"'{value.isoformat()}'"
+
+
+def _parse_date(text: str) -> Optional[date]:
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+# ----------- Resolución de nombres contra el catálogo cacheado -----------
+def _resolve_table(question: str, q_tokens: List[str], catalog: List[Dict[str, Any]], selected_table: Optional[str]) -> Optional[Dict[str, Any]]:
+    explicit = extract_table_name_from_question(question)
+    by_name = {}
+    for table in catalog:
+        by_name.setdefault(table["name"].lower(), table)
+        by_name.setdefault(f"{table['schema']}.{table['name']}".lower(), table)
+    if explicit:
+        return by_name.get(explicit)
+
+    # Tabla mencionada en la pregunta (la coincidencia más larga gana)
+    best, best_len = None, 0
+    for table in catalog:
+        name_tokens = _tokens(table["name"])
+        if name_tokens and len(name_tokens) > best_len and _find_sequence(q_tokens, name_tokens) >= 0:
+            best, best_len = table, len(name_tokens)
+    if best is not None:
+        return best
+    return by_name.get((selected_table or "").lower())
+
+
+def _resolve_column(q_tokens: List[str], table: Dict[str, Any], types: Optional[Tuple[str, ...]] = None) -> Optional[Dict[str, Any]]:
+    best, best_len = None, 0
+    for column in table["columns"]:
+        if types and not any(t in str(column["type"]).lower() for t in types):
+            continue
+        col_tokens = _tokens(column["name"])
+        if col_tokens and len(col_tokens) > best_len and _find_sequence(q_tokens, col_tokens) >= 0:
+            best, best_len = column, len(col_tokens)
+    return best
+
+
+def _only_known_words(q_tokens: List[str], template: str, *identifiers: str, extra: Tuple[str, ...] = ()) -> bool:
+    """
+    True si todas las palabras de la pregunta son de relleno, de la plantilla o de la tabla/columna.
+    """
+    allowed = _FILLER | _TEMPLATE_WORDS.get(template, set()) | set(extra)
+    for identifier in identifiers:
+        allowed.update(_tokens(identifier))
+    return all(token in allowed or token.isdigit() for token in q_tokens)
+
+
+# ----------- Metadata común (misma forma que la respuesta del LLM) -----------
+def _meta(sql_query: str, intent: str, table_name: str, label: str, **extra) -> Dict[str, Any]:
+    meta = {
+        "sql_query": sql_query,
+        "intent": intent,
+        "table_name": table_name,
+        "raw_prompt": f"NO LLM - Respuesta generada por backend para {label}",
+        "raw_response": None,
+        "response_time_ms": 0,
+        "model": "backend-direct",
+        "tokens_prompt": None,
+        "tokens_completion": None,
+        "tokens_total": None,
+        "prompt_template_version": "backend-direct",
+    }
+    meta.update(extra)
+    return meta
+
+
+def _match_classic(question: str, db_type: str, selected_table: Optional[str], exact_count: Optional[bool],
+                   catalog: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+    dialect = (db_type or "").lower()
+    # ----------- LISTAR COLUMNAS (preferencia si la intención es ambigua) -----------
+    if is_list_columns_question(question):
+        table_name = extract_table_name_from_question(question) or selected_table
+        if table_name:
+            if dialect == "sqlserver":
+                sql_query = f"SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = {sql_literal(table_name)} ORDER BY ORDINAL_POSITION;"
+            else:
+                sql_query = f"SELECT column_name FROM information_schema.columns WHERE table_name = {sql_literal(table_name)} ORDER BY ordinal_position;"
+            return _meta(sql_query, "list_columns", table_name, "listar columnas", force_list_columns_message=True)
+
+    # ----------- CONTEO DE COLUMNAS -----------
+    if is_count_columns_question(question):
+        table_name = extract_table_name_from_question(question) or selected_table
+        if table_name:
+            if dialect == "sqlserver":
+                sql_query = f"SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = {sql_literal(table_name)};"
+            else:
+                sql_query = f"SELECT COUNT(*) FROM information_schema.columns WHERE table_name = {sql_literal(table_name)};"
+            return _meta(sql_query, "count_columns", table_name, "conteo de columnas", force_count_columns_message=True)
+
+    # ----------- CONTEO DE REGISTROS (filas) -----------
+    # Con fechas en la pregunta es un conteo filtrado (plantilla de rango o LLM), no el total de la tabla
+    if is_count_rows_question(question) and not _DATE_RE.search(_normalize(question)):
+        table_name = extract_table_name_from_question(question) or selected_table
+        if table_name:
+            # Por defecto se responde desde las estadísticas del catálogo (evita un full scan);
+            # el COUNT(*) exacto solo si se pide explícitamente
+            count_mode = resolve_count_mode(question, exact_count)
+            if count_mode == "exact":
+                # Solo tablas del catálogo: el nombre puede venir del usuario (request.table)
+                sql_query = build_exact_count_sql(table_name, db_type, catalog)
+                if sql_query is None:
+                    return None
+            else:
+                sql_query = build_approx_count_sql(table_name, db_type)
+            return _meta(sql_query, "count_rows", table_name, "conteo de registros",
+                         force_count_rows_message=True, count_mode=count_mode)
+    return None
+
+
+# ----------- Plantillas que requieren el catálogo -----------
+def _match_date_range(q: str, q_tokens: List[str], table: Dict[str, Any], db_type: str) -> Optional[Dict[str, Any]]:
+    dates = _DATE_RE.findall(q)
+    if len(dates) != 2 or not _RANGE_RE.search(q):
+        return None
+    start, end = _parse_date(dates[0]), _parse_date(dates[1])
+    if not start or not end:
+        return None
+    if start > end:
+        start, end = end, start
+    column = _resolve_column(q_tokens, table, _DATE_TYPES)
+    if column is None:
+        date_columns = [c for c in table["columns"] if any(t in str(c["type"]).lower() for t in _DATE_TYPES)]
+        if len(date_columns) != 1:
+            return None
+        column = date_columns[0]
+    date_tokens = tuple(t for d in dates for t in _tokens(d))
+    if not _only_known_words(q_tokens, "date_range", table["name"], column["name"], extra=date_tokens):
+        return None
+
+    col = _quote(column["name"], db_type)
+    # Fin inclusivo: < día siguiente (sirve también para columnas timestamp)
+    where = f" WHERE {col} >= {_date_literal(start, db_type)} AND {col} < {_date_literal(end + timedelta(days=1), db_type)}"
+    if _COUNT_WORD_RE.search(q):
+        sql_query = f"SELECT COUNT(*) AS registros FROM {_table_ref(table, db_type)}{where};"
+        kind = "count"
+    else:
+        sql_query = f"SELECT * FROM {_table_ref(table, db_type)}{where} ORDER BY {col};"
+        kind = "rows"
+    return _meta(sql_query, "date_range", table["name"], "registros en un rango de fechas",
+                 column_name=column["name"], range_kind=kind,
+                 range_start=start.isoformat(), range_end=end.isoformat())
+
+
+def _match_top_n(q: str, q_tokens: List[str], table: Dict[str, Any], db_type: str) -> Optional[Dict[str, Any]]:
+    match = _TOP_N_RE.search(q)
+    if not match:
+        return None
+    descending = bool(_DESC_RE.search(q))
+    ascending = bool(_ASC_RE.search(q))
+    if descending == ascending:
+        return None
+    limit = int(match.group(1) or match.group(2))
+    if not 0 < limit <= MAX_TEMPLATE_LIMIT:
+        return None
+    column = _resolve_column(q_tokens, table)
+    if column is None or not _only_known_words(q_tokens, "top_n", table["name"], column["name"]):
+        return None
+    col = _quote(column["name"], db_type)
+    order = "DESC" if descending else "ASC"
+    sql_query = _select_limited("*", _table_ref(table, db_type), limit, db_type,
+                                tail=f" WHERE {col} IS NOT NULL ORDER BY {col} {order}")
+    return _meta(sql_query, "top_n", table["name"], "top-N por columna",
+                 column_name=column["name"], order=order, limit=limit)
+
+
+def _match_distinct(q: str, q_tokens: List[str], table: Dict[str, Any], db_type: str) -> Optional[Dict[str, Any]]:
+    if not _DISTINCT_RE.search(q):
+        return None
+    column = _resolve_column(q_tokens, table)
+    if column is None or not _only_known_words(q_tokens, "distinct", table["name"], column["name"]):
+        return None
+    col = _quote(column["name"], db_type)
+    if _COUNT_WORD_RE.search(q):
+        sql_query = f"SELECT COUNT(DISTINCT {col}) AS valores_distintos FROM {_table_ref(table, db_type)};"
+        kind = "count"
+    else:
+        sql_query = f"SELECT DISTINCT {col} FROM {_table_ref(table, db_type)} ORDER BY {col};"
+        kind = "values"
+    return _meta(sql_query, "distinct", table["name"], "valores distintos de una columna",
+                 column_name=column["name"], distinct_kind=kind)
+
+
+def _match_aggregate(q: str, q_tokens: List[str], table: Dict[str, Any], db_type: str) -> Optional[Dict[str, Any]]:
+    functions = [name for name, pattern in _AGG_RES if pattern.search(q)]
+    if len(functions) != 1:
+        return None
+    function = functions[0]
+    types = _NUMERIC_TYPES if function in ("avg", "sum") else None
+    column = _resolve_column(q_tokens, table, types)
+    if column is None or not _only_known_words(q_tokens, "aggregate", table["name"], column["name"]):
+        return None
+    col = _quote(column["name"], db_type)
+    if function == "avg" and _is_sqlserver(db_type):
+        # En SQL Server AVG sobre enteros trunca el resultado
+        col = f"CAST({col} AS FLOAT)"
+    alias = _quote(_AGG_LABEL[function].replace("á", "a").replace("í", "i"), db_type)
+    sql_query = f"SELECT {_AGG_SQL[function]}({col}) AS {alias} FROM {_table_ref(table, db_type)};"
+    return _meta(sql_query, "aggregate", table["name"], f"{_AGG_LABEL[function]} de una columna",
+                 column_name=column["name"], aggregate=function)
+
+
+def _match_show_table(q: str, q_tokens: List[str], table: Dict[str, Any], db_type: str) -> Optional[Dict[str, Any]]:
+    first_rows = _FIRST_ROWS_RE.search(q)
+    if not first_rows and not _SHOW_TABLE_RE.search(q):
+        return None
+    limit = int(first_rows.group(1)) if first_rows else SHOW_TABLE_LIMIT
+    if not 0 < limit <= MAX_TEMPLATE_LIMIT:
+        return None
+    if not _only_known_words(q_tokens, "show_table", table["name"]):
+        return None
+    sql_query = _select_limited("*", _table_ref(table, db_type), limit, db_type)
+    return _meta(sql_query, "show_table", table["name"], "mostrar una tabla", limit=limit)
+
+
+_TEMPLATES = (_match_date_range, _match_top_n, _match_distinct, _match_aggregate, _match_show_table)
+
+
+# ----------- API -----------
+class IntentStats:
+    """
+    Cuántas preguntas resolvió el motor y cuántos pedidos completos se respondieron sin llamar al LLM
+    (ni para generar el SQL ni para explicar el resultado).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.by_intent: Counter = Counter()
+        self.requests = 0
+        self.requests_without_llm = 0
+
+    def record(self, intent: Optional[str]) -> None:
+        with self._lock:
+            self.lookups += 1
+            if intent:
+                self.by_intent[intent] += 1
+
+    def record_request(self, used_llm: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            if not used_llm:
+                self.requests_without_llm += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            matched = sum(self.by_intent.values())
+            return {
+                "lookups": self.lookups,
+                "matched": matched,
+                "match_rate": round(matched / self.lookups, 4) if self.lookups else None,
+                "by_intent": dict(self.by_intent),
+                "requests": self.requests,
+                "requests_without_llm": self.requests_without_llm,
+                "without_llm_rate": round(self.requests_without_llm / self.requests, 4) if self.requests else None,
+            }
+
+
+intent_stats = IntentStats()
+
+
+def match_intent(
+    question: str,
+    db_type: str,
+    selected_table: Optional[str] = None,
+    catalog: Optional[List[Dict[str, Any]]] = None,
+    exact_count: Optional[bool] = None,
+    track: bool = True,
+) -> Optional[Dict[str, Any]]:
+    """
+    Resuelve sin LLM las preguntas que calzan con una plantilla conocida.
+    Retorna la metadata (con "sql_query" e "intent") o None si la pregunta debe ir al LLM.
+    Las plantillas nuevas (y el conteo exacto) solo se usan si hay catálogo (cacheado) para resolver
+    tabla y columnas.
+    track=False no cuenta la consulta en las estadísticas (ej. si ya se evaluó antes en el pipeline).
+    """
+    meta = _match_classic(question, db_type, selected_table, exact_count, catalog)
+    if meta is None and catalog:
+        q = _normalize(question)
+        q_tokens = _tokens(question)
+        table = _resolve_table(question, q_tokens, catalog, selected_table)
+        if table is not None:
+            for template in _TEMPLATES:
+                meta = template(q, q_tokens, table, db_type)
+                if meta is not None:
+                    break
+    if track:
+        intent_stats.record(meta["intent"] if meta else None)
+    return meta
+
+
+def format_intent_answer(meta: Dict[str, Any], rows: List[List[Any]]) -> Optional[str]:
+    """
+    Respuesta en lenguaje natural para una plantilla, armada con el resultado (sin LLM).
+    Retorna None si la intención no tiene respuesta propia (ej. conteo de registros).
+    """
+    intent = meta.get("intent")
+    table = meta.get("table_name")
+    column = meta.get("column_name")
+    first = rows[0][0] if rows and rows[0] else None
+    if intent == "list_columns":
+        names = [str(r[0]) for r in rows]
+        return f"La tabla **{table}** tiene {len(names)} columnas: {', '.join(names)}."
+    if intent == "count_columns" and first is not None:
+        return f"La tabla **{table}** tiene **{format_count(first)}** columnas."
+    if intent == "show_table":
+        return f"Se muestran los primeros {len(rows)} registros de la tabla **{table}** (máximo {meta.get('limit')})."
+    if intent == "top_n":
+        criterion = "mayor" if meta.get("order") == "DESC" else "menor"
+        return f"Estos son los {len(rows)} registros de **{table}** con {criterion} **{column}**."
+    if intent == "distinct":
+        if meta.get("distinct_kind") == "count":
+            return f"La columna **{column}** de **{table}** tiene **{format_count(first or 0)}** valores distintos."
+        preview = ", ".join(str(r[0]) for r in rows[:20])
+        more = "…" if len(rows) > 20 else ""
+        return f"La columna **{column}** de **{table}** tiene {len(rows)} valores distintos: {preview}{more}."
+    if intent == "aggregate":
+        label = _AGG_LABEL.get(meta.get("aggregate"), "valor")
+        article = "la" if meta.get("aggregate") == "sum" else "el"
+        if first is None:
+            return f"No hay valores en **{column}** de **{table}** para calcular {article} {label}."
+        value = round(first, 4) if isinstance(first, float) else first
+        return f"{article.capitalize()} {label} de **{column}** en **{table}** es **{value}**."
+    if intent == "date_range":
+        period = f"entre {meta.get('range_start')} y {meta.get('range_end')}"
+        if meta.get("range_kind") == "count":
+            return f"La tabla **{table}** tiene **{format_count(first or 0)}** registros con **{column}** {period}."
+        return f"Se encontraron {len(rows)} registros de **{table}** con **{column}** {period}."
+    return None
@@ -0,0 +1,192 @@
+# app/services/llm_client.py
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, AsyncIterator
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+# --- Configuración (por worker) ---
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))        # completions simultáneas en vuelo
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))                  # esperando turno; más allá se rechaza
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))        # segundos máximos esperando turno
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.5"))             # segundos
+LLM_RETRY_MAX = float(os.getenv("LLM_RETRY_MAX", "8"))
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_KEEPALIVE_CONNECTIONS", str(LLM_MAX_CONCURRENCY)))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+
+class LLMOverloadedError(Exception):
+    """
+    La cola de llamadas al LLM está llena (o se esperó demasiado): el pedido se rechaza en vez de apilarse.
+    """
+    pass
+
+
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,  # incluye APITimeoutError
+)
+
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    """
+    Backoff exponencial con full jitter; si el servidor manda Retry-After, se respeta.
+    """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_RETRY_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_RETRY_MAX, LLM_RETRY_BASE * (2 ** attempt)))
+
+
+class LLMClient:
+    """
+    Cliente OpenAI asíncrono compartido por el worker:
+      - un solo httpx.AsyncClient con keep-alive (reutiliza conexiones TLS)
+      - semáforo que limita las completions en vuelo; el resto espera en cola (acotada)
+      - reintentos con backoff + jitter ante 429 / 5xx / errores de conexión
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self._client: Optional[AsyncOpenAI] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        # Métricas
+        self.in_flight = 0
+        self.queued = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self._waits_ms = deque(maxlen=1000)
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._client is not None and self._loop is loop:
+                return
+            # Semáforo y cliente httpx quedan ligados al event loop del worker
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=OPENAI_BASE_URL,
+                max_retries=0,  # los reintentos los maneja este cliente (con jitter y dentro del semáforo)
+                timeout=LLM_REQUEST_TIMEOUT,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.max_concurrency,
+                        max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                    ),
+                    timeout=LLM_REQUEST_TIMEOUT,
+                ),
+            )
+
+    async def _acquire(self) -> None:
+        self._ensure_started()
+        if self.queued >= self.max_queue and self._semaphore.locked():
+            self.rejected += 1
+            raise LLMOverloadedError("Demasiadas consultas al modelo en cola. Intenta nuevamente en unos segundos.")
+
+        t0 = time.monotonic()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=LLM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise LLMOverloadedError("Tiempo de espera agotado en la cola del modelo de lenguaje.")
+        finally:
+            self.queued -= 1
+        self._waits_ms.append((time.monotonic() - t0) * 1000)
+        self.in_flight += 1
+        self.requests += 1
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def _create_with_retries(self, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            try:
+                return await self._client.chat.completions.create(**kwargs)
+            except _RETRYABLE_ERRORS as e:
+                if attempt >= LLM_MAX_RETRIES:
+                    self.failures += 1
+                    raise
+                delay = _retry_delay(attempt, e)
+                attempt += 1
+                self.retries += 1
+                logging.warning(f"[LLM] Reintento {attempt}/{LLM_MAX_RETRIES} en {delay:.2f}s: {type(e).__name__}")
+                await asyncio.sleep(delay)
+            except Exception:
+                self.failures += 1
+                raise
+
+    async def chat_completion(self, **kwargs) -> Any:
+        """
+        Equivalente a client.chat.completions.create(**kwargs) con cola, límite y reintentos.
+        Lanza LLMOverloadedError si no consigue turno.
+        """
+        await self._acquire()
+        try:
+            return await self._create_with_retries(**kwargs)
+        finally:
+            self._release()
+
+    async def chat_completion_stream(self, **kwargs) -> AsyncIterator[Any]:
+        """
+        Igual que chat_completion pero con stream=True: entrega los chunks a medida que llegan.
+        El turno del semáforo se mantiene hasta terminar de consumir el stream; solo se
+        reintenta la apertura (antes del primer chunk).
+        """
+        await self._acquire()
+        try:
+            stream = await self._create_with_retries(stream=True, **kwargs)
+            async for chunk in stream:
+                yield chunk
+        finally:
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits_ms)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "queue_wait_ms_avg": round(sum(waits) / len(waits), 2) if waits else None,
+            "queue_wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 2) if waits else None,
+            "queue_wait_ms_max": round(waits[-1], 2) if waits else None,
+        }
+
+    async def close(self) -> None:
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            await client.close()
+
+
+llm_client = LLMClient()
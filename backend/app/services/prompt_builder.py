@@ -0,0 +1,150 @@
+# app/services/prompt_builder.py
+
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+
+# Versión del prompt de generación de SQL (se registra en query_logs.prompt_template_version)
+SQL_PROMPT_VERSION = "v3.1-cache-layout"
+
+# Las entradas memorizadas son chicas salvo el esquema; el tope evita crecer sin límite con muchas conexiones
+_SCHEMA_BLOCKS_MAX = 128
+_CONTEXT_BLOCKS_MAX = 512
+
+# --- Prefijo estático ---
+# El proveedor cachea el prefijo común más largo entre llamadas: todo lo que cambia por día, tabla
+# o pregunta va DESPUÉS del esquema, en un mensaje aparte. Este texto no debe interpolar nada.
+_STATIC_INSTRUCTIONS = """
+Eres un asistente experto en transformar preguntas en lenguaje natural a consultas SQL SEGURAS y en sugerir la mejor visualización posible según los resultados.
+
+Siempre debes responder SOLO con un JSON estructurado, nunca con texto fuera del JSON.
+Estructura estándar de tu respuesta (incluir solo lo que aplica):
+
+{
+  "sql_query": "Consulta SQL generada",
+  "table": [["Col1", "Col2"], ["valor1", "valor2"], ...],
+  "list": ["valor1", "valor2", ...],
+  "chart": {
+    "type": "bar|pie|line|doughnut|scatter",
+    "labels": ["etiqueta1", "etiqueta2", ...],
+    "values": [10, 20, ...]
+  },
+  "message": "Explicación corta y clara en español"
+}
+
+- Usa solo estos tipos de gráficos en "chart.type": "bar", "pie", "line", "doughnut", "scatter"
+- Si la pregunta es de series de tiempo, usa preferentemente "line".
+- Si es agrupación/categoría, sugiere "bar", "pie" o "doughnut" según convenga.
+- Si es de correlación o pares de valores, sugiere "scatter".
+- El campo "chart" es opcional, solo inclúyelo si la consulta lo permite.
+- El campo "list" es opcional, solo si es relevante.
+- El campo "table" es opcional, pero siempre incluye si la respuesta es tabular.
+- El campo "message" SIEMPRE debe estar cuando haya datos, como explicación para un usuario no técnico.
+- Si la pregunta es solo un saludo, responde SOLO con un JSON con el campo "info" (sin ningún otro campo), con el saludo indicado en el contexto de la consulta.
+
+IMPORTANTE:
+- Nunca inventes valores, nunca muestres ejemplos, nunca inventes números ni filas: siempre ejecuta la consulta SQL propuesta y muestra los resultados REALES de la base de datos, sin modificar, resumir o simular.
+- Si el usuario solicita **listar las columnas de una tabla**, genera una consulta que retorne los nombres de las columnas (NO el conteo, sino la lista).
+- Para preguntas como "¿cuántos registros hay en la tabla X?", debes devolver la consulta SQL correspondiente y mostrar el resultado real.
+- Si el usuario pide "muestra la tabla X", limita a 100 filas usando LIMIT 100, y aclara en el message que se está mostrando solo una parte de los datos si la tabla es muy grande.
+- Usa nombres de tablas y campos EXACTAMENTE como aparecen en el esquema.
+- Si la pregunta requiere información sobre la estructura de la tabla (como cantidad o nombres de columnas/tablas), puedes usar tablas del sistema como information_schema.columns, information_schema.tables, sys.tables, pg_catalog.pg_tables, etc.
+- Si el usuario **no menciona una tabla**, asume que debe usarse la tabla seleccionada indicada en el contexto de la consulta.
+- Prohíbe consultas peligrosas (DELETE, DROP, ALTER, TRUNCATE, UPDATE, INSERT, CREATE, REPLACE, GRANT, REVOKE, EXEC, COMMIT, ROLLBACK).
+- Usa la fecha de hoy y el diccionario de datos del contexto de la consulta cuando la pregunta los necesite.
+""".strip()
+
+
+# ----------- Fragmentos memorizados -----------
+@lru_cache(maxsize=_SCHEMA_BLOCKS_MAX)
+def _system_prefix(schema: str) -> str:
+    """
+    Instrucciones estáticas + esquema de la conexión: idéntico entre preguntas sobre el mismo esquema.
+    """
+    return f"{_STATIC_INSTRUCTIONS}\n\n<schema>\n{schema}\n</schema>"
+
+
+@lru_cache(maxsize=_CONTEXT_BLOCKS_MAX)
+def _table_block(dictionary_table: Optional[str]) -> str:
+    if dictionary_table:
+        return (
+            f"Tabla seleccionada: '{dictionary_table}'.\n"
+            f"- Si el usuario te saluda o pregunta '¿quién eres?', responde: "
+            f'"¡Hola! Soy un asistente que te ayudará a responder preguntas sobre la tabla **{dictionary_table}** que tienes seleccionada. '
+            "Puedes consultarme por columnas, tipos de datos, resúmenes, valores, conteos y todo lo que necesites saber de esa tabla.\"\n"
+            f"- Si el usuario hace una pregunta sobre columnas, registros, estructura o datos sin especificar una tabla, responde SIEMPRE usando la tabla seleccionada '{dictionary_table}' y deja esto explícito en la respuesta."
+        )
+    return (
+        "No hay una tabla seleccionada.\n"
+        "- Si el usuario te saluda o pregunta '¿quién eres?', responde: "
+        '"¡Hola! Soy un asistente que te ayudará a responder preguntas sobre la base de datos que estás trabajando. '
+        'Dime sobre qué tabla te gustaría preguntar, y te ayudo con gusto."'
+    )
+
+
+@lru_cache(maxsize=_CONTEXT_BLOCKS_MAX)
+def _dictionary_block(dictionary_table: Optional[str], items: Tuple[Tuple[str, str], ...]) -> str:
+    if not items:
+        return ""
+    dict_lines = "\n".join(f"{col}: {desc}" for col, desc in items)
+    if dictionary_table:
+        return f"<diccionario_de_datos_tabla nombre='{dictionary_table}'>\n{dict_lines}\n</diccionario_de_datos_tabla>"
+    return f"<diccionario_de_datos>\n{dict_lines}\n</diccionario_de_datos>"
+
+
+def _relevant_tables_block(relevant_tables: Optional[List[str]]) -> str:
+    if not relevant_tables:
+        return ""
+    return (
+        "<tablas_relevantes>\n" + "\n".join(relevant_tables) + "\n</tablas_relevantes>\n"
+        "- Para esta pregunta usa preferentemente estas tablas del esquema."
+    )
+
+
+def _dictionary_items(data_dictionary: Optional[dict]) -> Tuple[Tuple[str, str], ...]:
+    if not data_dictionary or not isinstance(data_dictionary, dict):
+        return ()
+    return tuple((str(col), str(desc)) for col, desc in data_dictionary.items())
+
+
+# ----------- Armado del prompt -----------
+def build_sql_messages(
+    question: str,
+    schema: str,
+    data_dictionary: Optional[dict] = None,
+    dictionary_table: Optional[str] = None,
+    today: Optional[str] = None,
+    relevant_tables: Optional[List[str]] = None,
+) -> List[Dict[str, str]]:
+    """
+    Mensajes para la generación de SQL, de lo más estable a lo más volátil:
+      1. system: instrucciones estáticas + <schema> (prefijo cacheable por el proveedor)
+      2. system: contexto de la consulta (fecha, tabla seleccionada, diccionario de datos,
+         tablas relevantes para la pregunta)
+      3. user: la pregunta
+    relevant_tables: recorte del esquema por pregunta (schema_index); va en el contexto y no en
+    <schema> para que el prefijo no cambie entre preguntas.
+    """
+    today = today or datetime.now().strftime("%d/%m/%Y")
+    context_parts = [
+        f"Hoy es {today}.",
+        _table_block(dictionary_table),
+        _dictionary_block(dictionary_table, _dictionary_items(data_dictionary)),
+        _relevant_tables_block(relevant_tables),
+    ]
+    context = "<contexto_consulta>\n" + "\n\n".join(p for p in context_parts if p) + "\n</contexto_consulta>"
+    return [
+        {"role": "system", "content": _system_prefix(schema)},
+        {"role": "system", "content": context},
+        {"role": "user", "content": question},
+    ]
+
+
+def cached_prompt_tokens(usage: Any) -> Optional[int]:
+    """
+    Tokens del prompt que el proveedor sirvió desde su cache (usage.prompt_tokens_details.cached_tokens).
+    """
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    cached = getattr(details, "cached_tokens", None) if details else None
+    return int(cached) if cached is not None else None
+
@@ -2,14 +2,21 @@
 
 import os
 import json
+import time
+import queue
+import atexit
 import logging
+import threading
+from collections import deque
 from datetime import datetime
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List, Tuple
 from decimal import Decimal
 
-from sqlalchemy import create_engine, Table, MetaData
+from sqlalchemy import create_engine, Table, MetaData, select, update, text
 from sqlalchemy.dialects.postgresql import insert as pg_insert
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+
+from app.services.result_store import retain_result
 
 # --- Serializador seguro para JSON ---
 def default_serializer(obj):
@@ -29,16 +36,28 @@ else:
     print("URL de conexión a base de datos cargada:", SUPABASE_DB_URL)
 
 # --- Inicializa SQLAlchemy ---
+# create_engine no abre conexiones: importar el módulo no requiere que la base esté arriba
 engine = create_engine(SUPABASE_DB_URL)
 metadata = MetaData()
-query_logs = Table("query_logs", metadata, autoload_with=engine, schema="public")
+_query_logs: Optional[Table] = None
+_query_logs_lock = threading.Lock()
 
-def log_query_attempt(data: Dict[str, Any]) -> Optional[int]:
+def get_query_logs_table() -> Table:
     """
-    Registra un intento de consulta (éxito o fallo) en la tabla query_logs.
-    Devuelve el ID del log creado, o None si falló.
+    Tabla query_logs reflejada desde la base (la primera vez que se usa).
+    """
+    global _query_logs
+    if _query_logs is None:
+        with _query_logs_lock:
+            if _query_logs is None:
+                _query_logs = Table("query_logs", metadata, autoload_with=engine, schema="public")
+    return _query_logs
+
+def _serialize_record(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Filtra las claves que no son columnas de query_logs y serializa los valores según su tipo.
     """
-    allowed_fields = {col.name for col in query_logs.columns}
+    allowed_fields = {col.name for col in get_query_logs_table().columns}
     record = {}
 
     # Serializa objetos complejos (dict, list) y convierte campos según tipo
@@ -47,7 +66,7 @@ def log_query_attempt(data: Dict[str, Any]) -> Optional[int]:
             continue
 
         # --- Manejo especial para campos JSONB ---
-        if k in ["llm_raw_request", "llm_raw_response", "sql_raw_result"]:
+        if k in ["llm_raw_request", "llm_raw_response", "sql_raw_result", "plan_summary"]:
             if v is None:
                 record[k] = None
             elif isinstance(v, (dict, list)):
@@ -86,15 +105,33 @@ def log_query_attempt(data: Dict[str, Any]) -> Optional[int]:
                 record[k] = float(v)
             else:
                 record[k] = v
+    return record
+
+def _apply_result_retention(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    sql_raw_result -> vista previa + sha256 (+ blob comprimido) según RESULT_RETENTION.
+    """
+    if data.get("sql_raw_result") is None:
+        return data
+    return {**data, **retain_result(data.get("columns"), data["sql_raw_result"])}
 
+def _with_timestamps(record: Dict[str, Any]) -> Dict[str, Any]:
     # --- Asigna timestamps obligatorios si faltan ---
     now_utc = datetime.utcnow()
     if "created_at" not in record or not record["created_at"]:
         record["created_at"] = now_utc
     if "updated_at" not in record or not record["updated_at"]:
         record["updated_at"] = now_utc
+    return record
 
+def _insert_now(data: Dict[str, Any]) -> Optional[int]:
+    """
+    INSERT síncrono de un log (QUERY_LOG_WRITE_BEHIND=false). Devuelve el ID, o None si falló.
+    """
     try:
+        query_logs = get_query_logs_table()
+        record = _with_timestamps(_serialize_record(_apply_result_retention(data)))
+
         with engine.begin() as conn:
             result = conn.execute(
                 pg_insert(query_logs).values(**record).returning(query_logs.c.id)
@@ -105,3 +142,399 @@ def log_query_attempt(data: Dict[str, Any]) -> Optional[int]:
     except SQLAlchemyError as e:
         logging.error(f"[QUERY_LOGGER] Error registrando log: {e}\nData: {data}")
         return None
+
+def _update_now(log_id: int, data: Dict[str, Any]) -> bool:
+    """
+    UPDATE síncrono de un log ya insertado (QUERY_LOG_WRITE_BEHIND=false).
+    """
+    try:
+        query_logs = get_query_logs_table()
+        record = _serialize_record(data)
+        if not record:
+            return False
+        record["updated_at"] = datetime.utcnow()
+        with engine.begin() as conn:
+            conn.execute(update(query_logs).where(query_logs.c.id == log_id).values(**record))
+        return True
+    except SQLAlchemyError as e:
+        logging.error(f"[QUERY_LOGGER] Error actualizando log {log_id}: {e}")
+        return False
+
+# --- Escritura diferida (write-behind) ---
+# Los logs se encolan en memoria y un hilo los inserta en lotes (INSERT multi-fila).
+# El ID se asigna antes de encolar (bloques prefetcheados de la secuencia), así la respuesta
+# sigue trayendo query_log_id sin esperar el INSERT.
+QUERY_LOG_WRITE_BEHIND = os.getenv("QUERY_LOG_WRITE_BEHIND", "true").lower() in ("1", "true", "yes")
+QUERY_LOG_QUEUE_SIZE = int(os.getenv("QUERY_LOG_QUEUE_SIZE", "5000"))
+QUERY_LOG_BATCH_SIZE = int(os.getenv("QUERY_LOG_BATCH_SIZE", "200"))
+QUERY_LOG_FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", "0.2"))   # segundos que espera a llenar un lote
+QUERY_LOG_ID_BLOCK = int(os.getenv("QUERY_LOG_ID_BLOCK", "100"))
+# Con menos IDs libres que esto se pide otro bloque en segundo plano (las peticiones nunca esperan a la base)
+QUERY_LOG_ID_LOW_WATER = int(os.getenv("QUERY_LOG_ID_LOW_WATER", str(max(1, QUERY_LOG_ID_BLOCK // 4))))
+QUERY_LOG_RETRY_INTERVAL = float(os.getenv("QUERY_LOG_RETRY_INTERVAL", "5"))     # espera tras un error de conexión
+QUERY_LOG_SHUTDOWN_TIMEOUT = float(os.getenv("QUERY_LOG_SHUTDOWN_TIMEOUT", "10"))
+# Cola llena o base de logs caída: los registros van a disco (JSON lines) y se reintentan después
+QUERY_LOG_SPILL_DIR = os.getenv("QUERY_LOG_SPILL_DIR", os.path.join(os.path.dirname(__file__), "../../.query_log_spill"))
+
+_NEXT_IDS_SQL = text(
+    "SELECT nextval(pg_get_serial_sequence('public.query_logs', 'id')) FROM generate_series(1, :n)"
+)
+
+class QueryLogWriter:
+    """
+    Escritor en segundo plano de query_logs:
+      - submit_insert / submit_update solo encolan (y asignan el ID desde el bloque prefetcheado)
+      - otro hilo repone los IDs cuando quedan menos de QUERY_LOG_ID_LOW_WATER; si se agotan,
+        el log se encola sin ID (la base lo asigna al insertarlo) en vez de esperar la reserva
+      - un hilo junta hasta QUERY_LOG_BATCH_SIZE operaciones y las escribe en una transacción;
+        los UPDATE de un log que viaja en el mismo lote se funden en su INSERT
+      - los logs aún no escritos se pueden leer (pending) para no romper /logs/{id}/...
+      - cola llena o error de conexión: las operaciones se guardan en disco y se reintentan;
+        los UPDATE de un log cuyo INSERT está en disco también van a disco, detrás de él
+      - stop() vacía la cola al apagar (lo que no alcance a escribirse queda en disco)
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue(maxsize=QUERY_LOG_QUEUE_SIZE)
+        self._ids: deque = deque()
+        self._ids_lock = threading.Lock()
+        self._ids_retry_at = 0.0
+        self._ids_wanted = threading.Event()
+        self._ids_thread: Optional[threading.Thread] = None
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._pending_lock = threading.Lock()
+        # IDs cuyo INSERT está en el respaldo en disco y todavía no llega a la base
+        self._spilled_ids: set = set()
+        self._spill_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._retry_at = 0.0
+        self.spill_path = os.path.join(os.path.abspath(QUERY_LOG_SPILL_DIR), "query_logs.jsonl")
+        self.inserted = 0
+        self.updated = 0
+        self.spilled = 0
+        self.failed = 0
+
+    # --- Hilos de las peticiones ---
+    def submit_insert(self, data: Dict[str, Any]) -> Optional[int]:
+        record = dict(data)
+        log_id = self._next_id()
+        if log_id is not None:
+            record["id"] = log_id
+            with self._pending_lock:
+                self._pending[log_id] = dict(record)
+        self._enqueue("insert", record)
+        return log_id
+
+    def submit_update(self, log_id: int, data: Dict[str, Any]) -> bool:
+        with self._pending_lock:
+            if log_id in self._pending:
+                self._pending[log_id].update(data)
+        if self._is_spilled(log_id):
+            # El INSERT está en disco: el UPDATE va detrás de él (en la base no actualizaría nada)
+            self._spill([("update", {**data, "id": log_id})])
+        else:
+            self._enqueue("update", {**data, "id": log_id})
+        return True
+
+    def pending(self, log_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Log encolado que todavía no llega a la base (o None).
+        """
+        with self._pending_lock:
+            record = self._pending.get(log_id)
+            return dict(record) if record is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "pending": len(self._pending),
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "spilled": self.spilled,
+            "failed": self.failed,
+            "ids_available": len(self._ids),
+            "spill_file": os.path.exists(self.spill_path),
+        }
+
+    def _enqueue(self, kind: str, data: Dict[str, Any]) -> None:
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((kind, data))
+        except queue.Full:
+            self._spill([(kind, data)])
+
+    def _next_id(self) -> Optional[int]:
+        # Sin I/O: solo toma un ID ya reservado. La reposición la hace el hilo de IDs
+        with self._ids_lock:
+            log_id = self._ids.popleft() if self._ids else None
+            low = len(self._ids) < QUERY_LOG_ID_LOW_WATER
+        if low:
+            self._ids_wanted.set()
+        return log_id
+
+    def _refill_ids(self) -> None:
+        # En el hilo de IDs; _ids_lock solo se toma para agregar el bloque, no durante la consulta
+        try:
+            with engine.connect() as conn:
+                ids = [row[0] for row in conn.execute(_NEXT_IDS_SQL, {"n": QUERY_LOG_ID_BLOCK})]
+        except SQLAlchemyError as e:
+            logging.error(f"[QUERY_LOGGER] No se pudieron reservar IDs de query_logs: {e}")
+            self._ids_retry_at = time.monotonic() + QUERY_LOG_RETRY_INTERVAL
+            return
+        with self._ids_lock:
+            self._ids.extend(ids)
+
+    def _run_ids(self) -> None:
+        while not self._stopping.is_set():
+            self._ids_wanted.wait(QUERY_LOG_RETRY_INTERVAL or 1.0)
+            self._ids_wanted.clear()
+            if self._stopping.is_set():
+                break
+            # Si la base no responde, no se reintenta antes de QUERY_LOG_RETRY_INTERVAL
+            if len(self._ids) < QUERY_LOG_ID_LOW_WATER and time.monotonic() >= self._ids_retry_at:
+                self._refill_ids()
+
+    # --- Ciclo de vida ---
+    def start(self) -> None:
+        """
+        Arranca los hilos y reserva el primer bloque de IDs (al iniciar la app, antes de la primera petición).
+        """
+        self._ensure_started()
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._stopping.clear()
+                    thread = threading.Thread(target=self._run, name="uq-query-logs", daemon=True)
+                    thread.start()
+                    self._thread = thread
+                    ids_thread = threading.Thread(target=self._run_ids, name="uq-query-log-ids", daemon=True)
+                    ids_thread.start()
+                    self._ids_thread = ids_thread
+                    self._ids_wanted.set()
+
+    def flush(self, timeout: float = QUERY_LOG_SHUTDOWN_TIMEOUT) -> bool:
+        """
+        Espera a que la cola se vacíe. Retorna False si no alcanzó en el tiempo dado.
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout: float = QUERY_LOG_SHUTDOWN_TIMEOUT) -> None:
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+            ids_thread, self._ids_thread = self._ids_thread, None
+        if thread is None:
+            return
+        self._stopping.set()
+        self._ids_wanted.set()
+        thread.join(timeout)
+        if ids_thread is not None:
+            ids_thread.join(timeout)
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+                self._queue.task_done()
+            except queue.Empty:
+                break
+        if leftover:
+            self._spill(leftover)
+
+    # --- Hilo escritor ---
+    def _run(self) -> None:
+        self._replay_spill()
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                written = self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+                if not written:
+                    self._spill(batch)
+            elif os.path.exists(self.spill_path) and time.monotonic() >= self._retry_at:
+                self._replay_spill()
+
+    def _next_batch(self) -> List[Tuple[str, Dict[str, Any]]]:
+        try:
+            batch = [self._queue.get(timeout=QUERY_LOG_FLUSH_INTERVAL if not self._stopping.is_set() else 0.05)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + (0 if self._stopping.is_set() else QUERY_LOG_FLUSH_INTERVAL)
+        while len(batch) < QUERY_LOG_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]) -> bool:
+        """
+        Escribe un lote en una transacción. Retorna False si la base no está disponible
+        (el lote se guarda en disco); si el lote tiene un registro inválido, se escriben de a uno.
+        """
+        if time.monotonic() < self._retry_at:
+            return False
+        inserts: List[Dict[str, Any]] = []
+        updates: List[Dict[str, Any]] = []
+        by_id: Dict[int, Dict[str, Any]] = {}
+        # UPDATE de un log cuyo INSERT quedó en disco (se encoló antes de que el INSERT fallara)
+        deferred: List[Tuple[str, Dict[str, Any]]] = []
+        for kind, data in batch:
+            if kind == "insert":
+                record = dict(data)
+                inserts.append(record)
+                if record.get("id") is not None:
+                    by_id[record["id"]] = record
+            elif data["id"] in by_id:
+                by_id[data["id"]].update(data)
+            elif self._is_spilled(data["id"]):
+                deferred.append((kind, data))
+            else:
+                updates.append(data)
+        try:
+            if inserts or updates:
+                self._execute(inserts, updates)
+        except OperationalError as e:
+            logging.error(f"[QUERY_LOGGER] Base de logs no disponible, {len(batch)} operaciones a disco: {e}")
+            self._retry_at = time.monotonic() + QUERY_LOG_RETRY_INTERVAL
+            return False
+        except SQLAlchemyError as e:
+            if len(batch) == 1:
+                self.failed += 1
+                with self._pending_lock:
+                    self._spilled_ids.difference_update(by_id)
+                self._forget(batch)
+                logging.error(f"[QUERY_LOGGER] Error registrando log: {e}\nData: {batch[0][1]}")
+                return True
+            for op in batch:
+                if not self._write([op]):
+                    self._spill([op])
+            return True
+        self.inserted += len(inserts)
+        self.updated += len(updates)
+        with self._pending_lock:
+            self._spilled_ids.difference_update(by_id)
+        if deferred:
+            self._spill(deferred)
+        self._forget(batch)
+        return True
+
+    def _execute(self, inserts: List[Dict[str, Any]], updates: List[Dict[str, Any]]) -> None:
+        query_logs = get_query_logs_table()
+        # executemany necesita las mismas columnas en todas las filas: se agrupan por columnas
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for record in inserts:
+            row = _with_timestamps(_serialize_record(_apply_result_retention(record)))
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        with engine.begin() as conn:
+            for rows in groups.values():
+                # SQLAlchemy agrupa las filas en INSERT ... VALUES (...), (...) multi-fila
+                conn.execute(pg_insert(query_logs), rows)
+            for data in updates:
+                record = _serialize_record({k: v for k, v in data.items() if k != "id"})
+                if not record:
+                    continue
+                record["updated_at"] = datetime.utcnow()
+                conn.execute(update(query_logs).where(query_logs.c.id == data["id"]).values(**record))
+
+    def _forget(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        with self._pending_lock:
+            for kind, data in batch:
+                if kind == "insert" and data.get("id") is not None:
+                    self._pending.pop(data["id"], None)
+
+    # --- Respaldo en disco ---
+    def _is_spilled(self, log_id: int) -> bool:
+        with self._pending_lock:
+            return log_id in self._spilled_ids
+
+    def _spill(self, ops: List[Tuple[str, Dict[str, Any]]]) -> None:
+        try:
+            with self._spill_lock:
+                os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    for kind, data in ops:
+                        f.write(json.dumps({"op": kind, "data": data}, ensure_ascii=False, default=default_serializer) + "\n")
+            with self._pending_lock:
+                self._spilled_ids.update(
+                    data["id"] for kind, data in ops if kind == "insert" and data.get("id") is not None
+                )
+            self.spilled += len(ops)
+        except OSError as e:
+            self.failed += len(ops)
+            logging.error(f"[QUERY_LOGGER] No se pudieron respaldar {len(ops)} logs en disco: {e}")
+        # Ya están en disco: la lectura vuelve a la base cuando se reintenten
+        self._forget(ops)
+
+    def _replay_spill(self) -> None:
+        replay_path = f"{self.spill_path}.replay"
+        with self._spill_lock:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+        try:
+            with open(replay_path, encoding="utf-8") as f:
+                ops = [(entry["op"], entry["data"]) for entry in map(json.loads, filter(str.strip, f))]
+        except (OSError, ValueError) as e:
+            logging.error(f"[QUERY_LOGGER] Respaldo de logs ilegible ({replay_path}): {e}")
+            return
+        for start in range(0, len(ops), QUERY_LOG_BATCH_SIZE):
+            chunk = ops[start:start + QUERY_LOG_BATCH_SIZE]
+            if not self._write(chunk):
+                # La base sigue caída: lo que falta vuelve al respaldo
+                self._spill(ops[start:])
+                self.spilled -= len(ops) - start
+                break
+        else:
+            logging.info(f"[QUERY_LOGGER] {len(ops)} logs respaldados en disco escritos en query_logs")
+        os.remove(replay_path)
+
+query_log_writer = QueryLogWriter()
+atexit.register(query_log_writer.stop)
+
+def log_query_attempt(data: Dict[str, Any]) -> Optional[int]:
+    """
+    Registra un intento de consulta (éxito o fallo) en la tabla query_logs.
+    Devuelve el ID del log, o None si no se pudo asignar. Con QUERY_LOG_WRITE_BEHIND
+    el INSERT ocurre después, en lote, en el hilo del escritor.
+    """
+    if QUERY_LOG_WRITE_BEHIND:
+        return query_log_writer.submit_insert(data)
+    return _insert_now(data)
+
+def get_query_log(log_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Devuelve un registro de query_logs como dict, o None si no existe.
+    Incluye los logs encolados que todavía no se escriben.
+    """
+    pending = query_log_writer.pending(log_id)
+    if pending is not None:
+        return pending
+    try:
+        query_logs = get_query_logs_table()
+        with engine.connect() as conn:
+            row = conn.execute(
+                select(query_logs).where(query_logs.c.id == log_id)
+            ).mappings().first()
+            return dict(row) if row else None
+    except SQLAlchemyError as e:
+        logging.error(f"[QUERY_LOGGER] Error leyendo log {log_id}: {e}")
+        return None
+
+def update_query_log(log_id: int, data: Dict[str, Any]) -> bool:
+    """
+    Actualiza columnas de un log (ej. la explicación generada después de responder).
+    Con QUERY_LOG_WRITE_BEHIND se encola detrás del INSERT del mismo log.
+    """
+    if QUERY_LOG_WRITE_BEHIND:
+        return query_log_writer.submit_update(log_id, data)
+    return _update_now(log_id, data)
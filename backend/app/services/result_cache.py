@@ -0,0 +1,145 @@
+# app/services/result_cache.py
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from app.services.db_connector import execute_sql_query, get_table_change_signal
+
+# --- Configuración ---
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))                              # segundos
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))     # total en memoria
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(8 * 1024 * 1024)))
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    Normaliza el SQL para usarlo como clave: colapsa espacios fuera de literales y quita el ';' final.
+    """
+    parts = (sql_query or "").strip().rstrip(";").strip().split("'")
+    # Los segmentos pares están fuera de comillas simples
+    for i in range(0, len(parts), 2):
+        parts[i] = " ".join(parts[i].split())
+    return "'".join(parts)
+
+
+class ResultCache:
+    """
+    LRU acotado por memoria (tamaño estimado del JSON) con expiración por TTL.
+    Cada entrada guarda la señal de cambios de las tablas al momento de ejecutar;
+    si la señal actual es distinta, la entrada se descarta.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl: float = RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Tuple, signal: Optional[str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expired = time.monotonic() - entry["stored_at"] > self.ttl
+                changed = signal is not None and entry["signal"] is not None and signal != entry["signal"]
+                if expired or changed:
+                    self._remove(key)
+                    self.invalidations += 1
+                    entry = None
+                else:
+                    self._entries.move_to_end(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple, columns, rows, meta: Dict[str, Any], signal: Optional[str]) -> None:
+        size = len(json.dumps(rows, default=str)) + len(json.dumps(columns, default=str))
+        if size > RESULT_CACHE_MAX_ENTRY_BYTES or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "columns": columns,
+                "rows": rows,
+                "meta": dict(meta),
+                "signal": signal,
+                "size": size,
+                "stored_at": time.monotonic(),
+            }
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_connection(self, connection_id: Any) -> None:
+        conn_id = str(connection_id)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == conn_id]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key: Tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+
+result_cache = ResultCache()
+
+
+def execute_sql_query_cached(
+    connection: Dict[str, Any],
+    sql_query: str,
+    max_rows: Optional[int] = None,
+    **kwargs,
+):
+    """
+    Igual que execute_sql_query(..., return_metadata=True) pero consultando primero el cache.
+    La señal de cambios se toma ANTES de ejecutar, así un cambio concurrente invalida la entrada.
+    meta incluye "cache_hit".
+    """
+    conn_id = connection.get("id")
+    if not RESULT_CACHE_ENABLED or not conn_id:
+        columns, rows, meta = execute_sql_query(connection, sql_query, max_rows=max_rows, return_metadata=True, **kwargs)
+        meta["cache_hit"] = False
+        return columns, rows, meta
+
+    key = (str(conn_id), normalize_sql(sql_query), max_rows)
+    signal = get_table_change_signal(connection, sql_query)
+    entry = result_cache.get(key, signal)
+    if entry is not None:
+        meta = dict(entry["meta"])
+        meta["cache_hit"] = True
+        return entry["columns"], entry["rows"], meta
+
+    columns, rows, meta = execute_sql_query(connection, sql_query, max_rows=max_rows, return_metadata=True, **kwargs)
+    result_cache.put(key, columns, rows, meta, signal)
+    meta["cache_hit"] = False
+    return columns, rows, meta
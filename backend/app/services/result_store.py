@@ -0,0 +1,247 @@
+# app/services/result_store.py
+#
+# Retención de resultados en query_logs: en vez del resultado completo en sql_raw_result (JSONB)
+# se guarda una vista previa acotada más el sha256 del resultado. El resultado completo va
+# (opcionalmente) a un almacén local direccionado por contenido y comprimido con zstd (gzip si
+# zstandard no está instalado): resultados idénticos se guardan una sola vez.
+# El almacén es un caché acotado: los blobs sin uso por más de RESULT_BLOB_TTL_DAYS se borran y,
+# si el directorio supera RESULT_BLOB_DIR_MAX_BYTES, se borran los menos usados. Un log cuyo blob
+# ya no está responde 404 en /logs/{id}/result y se puede re-ejecutar.
+
+import os
+import gzip
+import json
+import uuid
+import hashlib
+import time
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+# zstandard es opcional: sin él los blobs se comprimen con gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- Configuración ---
+# preview: vista previa + hash (y blob si RESULT_BLOB_STORE); full: resultado completo en el log (histórico); none: solo hash
+RESULT_RETENTION = os.getenv("RESULT_RETENTION", "preview").lower()
+RESULT_PREVIEW_ROWS = int(os.getenv("RESULT_PREVIEW_ROWS", "50"))
+RESULT_BLOB_STORE = os.getenv("RESULT_BLOB_STORE", "true").lower() in ("1", "true", "yes")
+RESULT_BLOB_DIR = os.getenv("RESULT_BLOB_DIR", os.path.join(os.path.dirname(__file__), "../../.result_blobs"))
+RESULT_BLOB_ZSTD_LEVEL = int(os.getenv("RESULT_BLOB_ZSTD_LEVEL", "3"))
+# Resultados más grandes que esto (sin comprimir) no se guardan en el almacén
+RESULT_BLOB_MAX_BYTES = int(os.getenv("RESULT_BLOB_MAX_BYTES", str(256 * 1024 * 1024)))
+# Límites del directorio completo (comprimido); 0 = sin límite
+RESULT_BLOB_DIR_MAX_BYTES = int(os.getenv("RESULT_BLOB_DIR_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+RESULT_BLOB_TTL_DAYS = float(os.getenv("RESULT_BLOB_TTL_DAYS", "30"))
+RESULT_BLOB_SWEEP_INTERVAL = float(os.getenv("RESULT_BLOB_SWEEP_INTERVAL", "600"))   # segundos entre barridos
+
+_CODECS = {"zstd": ".zst", "gzip": ".gz"}
+
+
+def result_payload(columns: Optional[List[str]], rows: List[List[Any]]) -> Tuple[bytes, str]:
+    """
+    Serialización canónica del resultado y su sha256 (mismo resultado -> mismo hash).
+    """
+    payload = json.dumps(
+        {"columns": list(columns or []), "rows": rows},
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    ).encode("utf-8")
+    return payload, hashlib.sha256(payload).hexdigest()
+
+
+class ResultBlobStore:
+    """
+    Almacén en disco direccionado por contenido: <dir>/<2 primeros del hash>/<hash>.zst|.gz
+    Escritura atómica (archivo temporal + rename); si el blob ya existe no se vuelve a escribir.
+    El mtime del blob marca su último uso (se renueva al deduplicar o leer) y es lo que usa sweep().
+    """
+
+    def __init__(self, root: str = RESULT_BLOB_DIR):
+        self.root = os.path.abspath(root)
+        self.codec = "zstd" if zstandard is not None else "gzip"
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.dedup_hits = 0
+        self.bytes_written = 0
+        self.evicted = 0
+        self._last_sweep = time.monotonic()
+        # Bytes escritos desde el último barrido: si el directorio puede pasar el límite se barre antes
+        self._bytes_since_sweep = 0
+
+    def _path(self, digest: str, codec: str) -> str:
+        return os.path.join(self.root, digest[:2], digest + _CODECS[codec])
+
+    def find(self, digest: str) -> Optional[Tuple[str, str]]:
+        """
+        (ruta, códec) del blob, o None si no está.
+        """
+        for codec in _CODECS:
+            path = self._path(digest, codec)
+            if os.path.exists(path):
+                return path, codec
+        return None
+
+    def put(self, digest: str, payload: bytes) -> Optional[str]:
+        """
+        Guarda el payload bajo su hash. Retorna el códec usado, o None si no se pudo guardar.
+        """
+        if len(payload) > RESULT_BLOB_MAX_BYTES:
+            return None
+        found = self.find(digest)
+        if found is not None:
+            self._touch(found[0])
+            with self._lock:
+                self.dedup_hits += 1
+            return found[1]
+        if self.codec == "zstd":
+            data = zstandard.ZstdCompressor(level=RESULT_BLOB_ZSTD_LEVEL).compress(payload)
+        else:
+            data = gzip.compress(payload, compresslevel=6)
+        path = self._path(digest, self.codec)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[RESULT_STORE] No se pudo guardar el resultado {digest}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+        with self._lock:
+            self.writes += 1
+            self.bytes_written += len(data)
+            self._bytes_since_sweep += len(data)
+        self._maybe_sweep()
+        return self.codec
+
+    def get(self, digest: str) -> Optional[bytes]:
+        """
+        JSON {"columns", "rows"} del resultado guardado, o None si no está (o no coincide con su hash).
+        """
+        found = self.find(digest)
+        if found is None:
+            return None
+        path, codec = found
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # Barrido justo entre find() y open()
+            return None
+        self._touch(path)
+        if codec == "zstd":
+            if zstandard is None:
+                print(f"[RESULT_STORE] El resultado {digest} está en zstd y zstandard no está instalado")
+                return None
+            payload = zstandard.ZstdDecompressor().decompress(data)
+        else:
+            payload = gzip.decompress(data)
+        if hashlib.sha256(payload).hexdigest() != digest:
+            print(f"[RESULT_STORE] El resultado {digest} no coincide con su hash; se ignora")
+            return None
+        return payload
+
+    def sweep(self) -> int:
+        """
+        Borra los blobs sin uso por más de RESULT_BLOB_TTL_DAYS y, si el directorio sigue sobre
+        RESULT_BLOB_DIR_MAX_BYTES, los menos usados hasta quedar bajo el límite.
+        También limpia temporales huérfanos de escrituras interrumpidas. Retorna cuántos borró.
+        """
+        now = time.time()
+        ttl = RESULT_BLOB_TTL_DAYS * 86400
+        blobs: List[Tuple[float, int, str]] = []
+        expired: List[str] = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(".tmp"):
+                    if now - st.st_mtime > RESULT_BLOB_SWEEP_INTERVAL:
+                        expired.append(path)
+                elif ttl > 0 and now - st.st_mtime > ttl:
+                    expired.append(path)
+                else:
+                    blobs.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in blobs)
+        if RESULT_BLOB_DIR_MAX_BYTES > 0 and total > RESULT_BLOB_DIR_MAX_BYTES:
+            # Del uso más antiguo al más reciente
+            for _, size, path in sorted(blobs):
+                if total <= RESULT_BLOB_DIR_MAX_BYTES:
+                    break
+                expired.append(path)
+                total -= size
+        removed = 0
+        for path in expired:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self.evicted += removed
+            self._last_sweep = time.monotonic()
+            self._bytes_since_sweep = 0
+        if removed:
+            print(f"[RESULT_STORE] {removed} resultados borrados del almacén (TTL / tamaño máximo)")
+        return removed
+
+    def _maybe_sweep(self) -> None:
+        # Corre en el hilo del escritor de query_logs, nunca en la petición
+        with self._lock:
+            due = time.monotonic() - self._last_sweep >= RESULT_BLOB_SWEEP_INTERVAL
+            over = RESULT_BLOB_DIR_MAX_BYTES > 0 and self._bytes_since_sweep > RESULT_BLOB_DIR_MAX_BYTES // 10
+        if due or over:
+            try:
+                self.sweep()
+            except OSError as e:
+                print(f"[RESULT_STORE] Error limpiando el almacén de resultados: {e}")
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "codec": self.codec,
+            "writes": self.writes,
+            "dedup_hits": self.dedup_hits,
+            "bytes_written": self.bytes_written,
+            "evicted": self.evicted,
+        }
+
+
+result_blob_store = ResultBlobStore()
+
+
+def retain_result(columns: Optional[List[str]], rows: Any) -> Dict[str, Any]:
+    """
+    Columnas de query_logs a guardar para un resultado según RESULT_RETENTION:
+      {"sql_raw_result": vista previa (o completo / None), "result_sha256", "result_blob_codec"}
+    Corre en el hilo del escritor de query_logs (hash y compresión fuera de la petición).
+    """
+    if RESULT_RETENTION == "full" or not isinstance(rows, list):
+        return {"sql_raw_result": rows}
+    payload, digest = result_payload(columns, rows)
+    codec = None
+    # Si la vista previa ya es el resultado completo no hace falta el blob
+    if RESULT_BLOB_STORE and (RESULT_RETENTION == "none" or len(rows) > RESULT_PREVIEW_ROWS):
+        codec = result_blob_store.put(digest, payload)
+    return {
+        "sql_raw_result": rows[:RESULT_PREVIEW_ROWS] if RESULT_RETENTION == "preview" else None,
+        "result_sha256": digest,
+        "result_blob_codec": codec,
+    }
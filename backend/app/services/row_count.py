@@ -0,0 +1,183 @@
+# app/services/row_count.py
+
+import os
+import re
+import time
+import threading
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.services.db_connector import execute_sql_query, sql_literal, table_reference
+from app.services.schema_cache import peek_schema_entry
+from app.utils.concurrency import db_executor
+
+# --- Configuración ---
+# approx: responde "¿cuántos registros...?" desde las estadísticas del catálogo (sin full scan)
+# exact: siempre COUNT(*)
+COUNT_ROWS_MODE = os.getenv("COUNT_ROWS_MODE", "approx").lower()
+# Opt-in: al responder un aproximado, calcular también el exacto en segundo plano para la próxima vez.
+# Apagado por defecto: el aproximado existe justamente para no hacer ese full scan en la base del usuario.
+# Se puede activar por conexión con exact_count_background; el exacto a pedido es exact_count / "conteo exacto".
+EXACT_COUNT_BACKGROUND = os.getenv("EXACT_COUNT_BACKGROUND", "false").lower() in ("1", "true", "yes")
+EXACT_COUNT_CACHE_TTL = float(os.getenv("EXACT_COUNT_CACHE_TTL", "900"))       # segundos
+EXACT_COUNT_TIMEOUT_MS = int(os.getenv("EXACT_COUNT_TIMEOUT_MS", "600000"))    # deadline del conteo en segundo plano
+
+_EXACT_PATTERN = re.compile(
+    r"\b(?:exact[oa]s?|exactamente|precis[oa]s?|precisamente|real(?:es)?)\b|count\s*\(\s*\*\s*\)",
+    re.IGNORECASE,
+)
+
+_exact_counts: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_in_flight: set = set()
+_lock = threading.Lock()
+
+
+def wants_exact_count(question: str) -> bool:
+    """
+    True si el usuario pide explícitamente el número exacto ("conteo exacto", "cuántos registros exactamente").
+    """
+    return bool(_EXACT_PATTERN.search(question or ""))
+
+
+def resolve_count_mode(question: str, exact_count: Optional[bool] = None) -> str:
+    if exact_count or COUNT_ROWS_MODE == "exact" or wants_exact_count(question):
+        return "exact"
+    return "approx"
+
+
+def find_catalog_table(catalog: Optional[List[Dict[str, Any]]], table_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Busca "tabla" o "esquema.tabla" (sin distinguir mayúsculas) en el catálogo cacheado.
+    """
+    name = (table_name or "").strip().lower()
+    for table in catalog or []:
+        if name in (table["name"].lower(), f"{table['schema']}.{table['name']}".lower()):
+            return table
+    return None
+
+
+def build_exact_count_sql(table_name: str, db_type: str, catalog: Optional[List[Dict[str, Any]]]) -> Optional[str]:
+    """
+    COUNT(*) de una tabla del catálogo, con esquema y tabla citados por separado.
+    El nombre puede venir del usuario: si no está en el catálogo retorna None y no se arma SQL.
+    """
+    table = find_catalog_table(catalog, table_name)
+    if table is None:
+        return None
+    return f"SELECT COUNT(*) FROM {table_reference(table, db_type, qualified=True)};"
+
+
+def build_approx_count_sql(table_name: str, db_type: str) -> str:
+    """
+    Conteo aproximado desde el catálogo (no lee la tabla):
+      - Postgres: n_live_tup (estadísticas de actividad) o, si no hay, reltuples (último ANALYZE).
+        Las tablas particionadas suman sus particiones hoja.
+      - SQL Server: sys.dm_db_partition_stats del heap / índice clustered.
+    Devuelve NULL si la tabla no existe o no tiene estadísticas.
+    """
+    if db_type.lower() == "sqlserver":
+        return (
+            "SELECT SUM(p.row_count) AS registros_aproximados "
+            "FROM sys.dm_db_partition_stats p "
+            f"WHERE p.object_id = OBJECT_ID({sql_literal(table_name)}) AND p.index_id IN (0, 1);"
+        )
+    return (
+        "SELECT SUM(CASE WHEN s.n_live_tup > 0 THEN s.n_live_tup "
+        "WHEN c.reltuples >= 0 THEN c.reltuples END)::bigint AS registros_aproximados "
+        f"FROM pg_partition_tree(to_regclass({sql_literal(table_name)})) t "
+        "JOIN pg_class c ON c.oid = t.relid "
+        "LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid "
+        "WHERE t.isleaf AND c.relkind IN ('r', 'm', 'f');"
+    )
+
+
+def format_count(value: Any) -> str:
+    """
+    1234567 -> "1.234.567"
+    """
+    return f"{int(value):,}".replace(",", ".")
+
+
+# --- Cache de conteos exactos ---
+def _key(connection: Dict[str, Any], table_name: str) -> Optional[Tuple[str, str]]:
+    conn_id = connection.get("id")
+    if not conn_id or not table_name:
+        return None
+    return str(conn_id), table_name.lower()
+
+
+def get_cached_exact_count(connection: Dict[str, Any], table_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Devuelve {"count", "computed_at"} si hay un conteo exacto vigente para la tabla.
+    """
+    key = _key(connection, table_name)
+    if key is None:
+        return None
+    with _lock:
+        entry = _exact_counts.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["computed_at"] > EXACT_COUNT_CACHE_TTL:
+            _exact_counts.pop(key, None)
+            return None
+        return dict(entry)
+
+
+def store_exact_count(connection: Dict[str, Any], table_name: str, count: Any) -> None:
+    key = _key(connection, table_name)
+    if key is None or count is None:
+        return
+    with _lock:
+        _exact_counts[key] = {"count": int(count), "computed_at": time.time()}
+
+
+def _run_exact_count(connection: Dict[str, Any], table_name: str, key: Tuple[str, str]) -> None:
+    try:
+        # Respeta el límite configurado en la conexión; si no hay, usa el deadline propio del conteo
+        timeout_ms = int(connection.get("statement_timeout_ms") or EXACT_COUNT_TIMEOUT_MS)
+        entry = peek_schema_entry(connection)
+        sql = build_exact_count_sql(table_name, connection.get("db_type", ""), entry.get("catalog") if entry else None)
+        if sql is None:
+            print(f"[ROW_COUNT] Tabla {table_name} no encontrada en el catálogo; no se cuenta")
+            return
+        _, rows = execute_sql_query(connection, sql, timeout_ms=timeout_ms)
+        if rows:
+            store_exact_count(connection, table_name, rows[0][0])
+            logging.info(f"[ROW_COUNT] Conteo exacto de {table_name} calculado en segundo plano: {rows[0][0]}")
+    except Exception as e:
+        print(f"[ROW_COUNT] No se pudo calcular el conteo exacto de {table_name}: {e}")
+    finally:
+        with _lock:
+            _in_flight.discard(key)
+
+
+def schedule_exact_count(connection: Dict[str, Any], table_name: str) -> bool:
+    """
+    Lanza el COUNT(*) en segundo plano (uno por tabla a la vez) si la conexión lo tiene activado
+    (exact_count_background, o EXACT_COUNT_BACKGROUND si la conexión no lo define). Retorna True si se encoló.
+    """
+    enabled = connection.get("exact_count_background")
+    if not (EXACT_COUNT_BACKGROUND if enabled is None else enabled):
+        return False
+    key = _key(connection, table_name)
+    if key is None or get_cached_exact_count(connection, table_name) is not None:
+        return False
+    with _lock:
+        if key in _in_flight:
+            return False
+        _in_flight.add(key)
+    try:
+        db_executor.submit(_run_exact_count, dict(connection), table_name, key)
+    except RuntimeError:
+        # Executor cerrado (apagando la app)
+        with _lock:
+            _in_flight.discard(key)
+        return False
+    return True
+
+
+def invalidate_exact_counts(connection_id: Any) -> None:
+    conn_id = str(connection_id)
+    with _lock:
+        for key in [k for k in _exact_counts if k[0] == conn_id]:
+            _exact_counts.pop(key, None)
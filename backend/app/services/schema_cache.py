@@ -0,0 +1,168 @@
+# app/services/schema_cache.py
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from typing import Dict, Any, Optional
+
+from app.services.db_connector import (
+    get_database_catalog,
+    get_schema_fingerprint,
+    render_schema,
+    resolve_schema_options,
+)
+
+# --- Configuración ---
+SCHEMA_CACHE_DIR = os.getenv(
+    "SCHEMA_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), "../../.schema_cache")
+)
+# Durante este tiempo (segundos) se confía en la entrada sin consultar la huella
+SCHEMA_FINGERPRINT_TTL = float(os.getenv("SCHEMA_FINGERPRINT_TTL", "30"))
+
+_entries: Dict[str, Dict[str, Any]] = {}
+_entries_lock = threading.Lock()
+_key_locks: Dict[str, threading.Lock] = {}
+
+
+def _cache_key(connection: Dict[str, Any]) -> Optional[str]:
+    conn_id = connection.get("id")
+    if not conn_id:
+        return None
+    include_views, all_schemas = resolve_schema_options(connection, None, None)
+    return f"{conn_id}:{int(include_views)}{int(all_schemas)}"
+
+
+def _cache_path(key: str) -> str:
+    name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(SCHEMA_CACHE_DIR, f"{name}.json")
+
+
+def _key_lock(key: str) -> threading.Lock:
+    with _entries_lock:
+        lock = _key_locks.get(key)
+        if lock is None:
+            lock = _key_locks[key] = threading.Lock()
+        return lock
+
+
+def _load_from_disk(key: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_cache_path(key), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        return entry if entry.get("key") == key else None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[SCHEMA_CACHE] No se pudo leer cache en disco: {e}")
+        return None
+
+
+def _save_to_disk(entry: Dict[str, Any]) -> None:
+    try:
+        os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+        path = _cache_path(entry["key"])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)  # escritura atómica
+    except Exception as e:
+        print(f"[SCHEMA_CACHE] No se pudo guardar cache en disco: {e}")
+
+
+def _get_entry(key: str) -> Optional[Dict[str, Any]]:
+    with _entries_lock:
+        entry = _entries.get(key)
+    if entry is None:
+        entry = _load_from_disk(key)
+        if entry is not None:
+            entry["checked_at"] = 0  # al venir de disco, se verifica la huella en el primer uso
+            with _entries_lock:
+                _entries[key] = entry
+    return entry
+
+
+def peek_schema_entry(connection: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Devuelve la entrada cacheada (memoria o disco) sin tocar la base de datos del usuario.
+    """
+    key = _cache_key(connection)
+    return _get_entry(key) if key else None
+
+
+def get_schema_entry(connection: Dict[str, Any], force_refresh: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Devuelve {"schema", "catalog", "fingerprint", ...} de la conexión.
+      - Dentro del TTL se usa la entrada tal cual.
+      - Luego se compara la huella del esquema (consulta de una fila) y solo si cambió
+        se vuelve a introspectar el catálogo completo.
+    Retorna None si no fue posible obtener el esquema.
+    """
+    db_type = connection.get("db_type", "")
+    key = _cache_key(connection)
+    if key is None:
+        # Conexiones ad-hoc (sin id): sin cache
+        catalog = get_database_catalog(connection)
+        if not catalog:
+            return None
+        return {"schema": render_schema(catalog, db_type), "catalog": catalog, "fingerprint": None}
+
+    with _key_lock(key):
+        entry = _get_entry(key)
+        now = time.time()
+        if entry and not force_refresh and now - entry.get("checked_at", 0) < SCHEMA_FINGERPRINT_TTL:
+            return entry
+
+        fingerprint = get_schema_fingerprint(connection)
+        if entry and not force_refresh:
+            if fingerprint is None or fingerprint == entry.get("fingerprint"):
+                # Sin cambios (o huella no disponible): se reutiliza la entrada
+                entry["checked_at"] = now
+                return entry
+
+        catalog = get_database_catalog(connection)
+        if not catalog:
+            return entry
+        entry = {
+            "key": key,
+            "connection_id": str(connection.get("id")),
+            "db_type": db_type,
+            "fingerprint": fingerprint,
+            "schema": render_schema(catalog, db_type),
+            "catalog": catalog,
+            "updated_at": now,
+            "checked_at": now,
+        }
+        with _entries_lock:
+            _entries[key] = entry
+        _save_to_disk(entry)
+        logging.info(f"[SCHEMA_CACHE] Esquema actualizado para conexión {entry['connection_id']} ({len(catalog)} tablas)")
+        return entry
+
+
+def get_cached_schema(connection: Dict[str, Any]) -> str:
+    """
+    Reemplazo de get_database_schema que evita introspectar en cada pregunta.
+    """
+    entry = get_schema_entry(connection)
+    return entry["schema"] if entry else ""
+
+
+def invalidate_schema_cache(connection_id: Any) -> None:
+    """
+    Elimina de memoria y disco todas las entradas de una conexión.
+    """
+    prefix = f"{connection_id}:"
+    with _entries_lock:
+        for key in [k for k in _entries if k.startswith(prefix)]:
+            _entries.pop(key, None)
+    for flags in ("00", "01", "10", "11"):
+        try:
+            os.remove(_cache_path(f"{prefix}{flags}"))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[SCHEMA_CACHE] No se pudo borrar cache en disco: {e}")
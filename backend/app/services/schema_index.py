@@ -0,0 +1,250 @@
+# app/services/schema_index.py
+
+import os
+import re
+import math
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.services.db_connector import render_schema, DEFAULT_SCHEMAS
+from app.services.schema_cache import get_schema_entry
+
+# --- Configuración ---
+SCHEMA_PROMPT_PRUNING = os.getenv("SCHEMA_PROMPT_PRUNING", "true").lower() in ("1", "true", "yes")
+# Tablas más relevantes (BM25) que van al prompt; a ellas se suman sus vecinas por FK
+SCHEMA_PROMPT_TOP_K = int(os.getenv("SCHEMA_PROMPT_TOP_K", "8"))
+# Con esquemas chicos no vale la pena recortar: se manda completo
+SCHEMA_PRUNE_MIN_TABLES = int(os.getenv("SCHEMA_PRUNE_MIN_TABLES", "20"))
+# Tope de vecinas por FK que se agregan (evita que una tabla "hub" arrastre todo el esquema)
+SCHEMA_PROMPT_MAX_NEIGHBORS = int(os.getenv("SCHEMA_PROMPT_MAX_NEIGHBORS", "12"))
+# Recorte vs. cache de prompts: un esquema recortado cambia con cada pregunta y rompe el prefijo
+# que cachea el proveedor. Opt-in: con esta opción el esquema completo (estable por conexión) queda
+# en el prefijo cacheado y el recorte viaja aparte como lista de tablas relevantes; se paga el
+# esquema completo (con descuento de cache) a cambio de aciertos de cache entre preguntas distintas.
+# Por defecto se recorta: menos tokens de prompt y sin riesgo de exceder el contexto.
+# Aun con la opción, esquemas más largos que SCHEMA_PROMPT_CACHE_MAX_CHARS (~3k tokens) se recortan.
+SCHEMA_PROMPT_CACHE_LAYOUT = os.getenv("SCHEMA_PROMPT_CACHE_LAYOUT", "false").lower() in ("1", "true", "yes")
+SCHEMA_PROMPT_CACHE_MAX_CHARS = int(os.getenv("SCHEMA_PROMPT_CACHE_MAX_CHARS", "12000"))
+
+# Peso del nombre de la tabla frente a columnas y descripciones
+_TABLE_NAME_WEIGHT = 3
+
+_STOPWORDS = {
+    "de", "del", "la", "las", "el", "los", "un", "una", "unos", "unas", "y", "o", "en", "por", "para",
+    "con", "sin", "que", "cual", "cuales", "cuanto", "cuantos", "cuanta", "cuantas", "como", "donde",
+    "cuando", "hay", "es", "son", "al", "lo", "se", "su", "sus", "me", "mi", "dame", "muestra",
+    "muestrame", "lista", "listar", "tabla", "tablas", "dato", "datos", "registro", "registros",
+    "the", "of", "and", "or", "in", "for", "to", "by", "with", "show", "list", "table", "from",
+}
+
+_CAMEL_RE = re.compile(r"([a-z0-9])([A-Z])")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _normalize_word(word: str) -> str:
+    # Stemming liviano (plural + truncado): "clientes" ~ "cliente", "facturacion" ~ "facturas"
+    if len(word) > 3 and word.endswith("s"):
+        word = word[:-1]
+    return word[:6]
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Separa identificadores (snake_case, camelCase) y texto libre en términos normalizados:
+    sin acentos, en minúsculas, sin stopwords y con stemming liviano.
+    """
+    if not text:
+        return []
+    text = _CAMEL_RE.sub(r"\1 \2", str(text))
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    return [_normalize_word(w) for w in _WORD_RE.findall(text) if w not in _STOPWORDS and len(w) > 1]
+
+
+class SchemaIndex:
+    """
+    Índice BM25 en memoria: un documento por tabla (nombre, columnas y descripciones del diccionario).
+    """
+
+    def __init__(self, catalog: List[Dict[str, Any]], data_dictionary: Optional[dict] = None,
+                 dictionary_table: Optional[str] = None, k1: float = 1.2, b: float = 0.75):
+        self.catalog = catalog
+        self.k1 = k1
+        self.b = b
+        descriptions = _dictionary_by_column(data_dictionary)
+        dict_table = (dictionary_table or "").lower()
+
+        self._docs: List[Counter] = []
+        for table in catalog:
+            terms = tokenize(table["name"]) * _TABLE_NAME_WEIGHT
+            for column in table["columns"]:
+                terms += tokenize(column["name"])
+                # El diccionario describe las columnas de la tabla seleccionada (o de cualquiera si no hay)
+                if descriptions and (not dict_table or _table_matches(table, dict_table)):
+                    terms += tokenize(descriptions.get(column["name"].lower(), ""))
+            self._docs.append(Counter(terms))
+
+        self._lengths = [sum(doc.values()) for doc in self._docs]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        df: Counter = Counter()
+        for doc in self._docs:
+            df.update(doc.keys())
+        n = len(self._docs)
+        self._idf = {term: math.log((n - freq + 0.5) / (freq + 0.5) + 1.0) for term, freq in df.items()}
+
+        self._by_name: Dict[Tuple[str, str], int] = {
+            (t["schema"], t["name"]): idx for idx, t in enumerate(catalog)
+        }
+        # Grafo FK no dirigido (referencia y referenciada son vecinas)
+        self._neighbors: Dict[int, List[int]] = {idx: [] for idx in range(n)}
+        for idx, table in enumerate(catalog):
+            for ref_schema, ref_name in table.get("references") or []:
+                ref_idx = self._by_name.get((ref_schema, ref_name))
+                if ref_idx is not None and ref_idx != idx:
+                    self._neighbors[idx].append(ref_idx)
+                    self._neighbors[ref_idx].append(idx)
+
+    def search(self, question: str, top_k: int) -> List[Tuple[int, float]]:
+        """
+        Retorna [(índice de tabla, score)] de las top_k tablas con score > 0.
+        """
+        query_terms = set(tokenize(question))
+        scores = []
+        for idx, doc in enumerate(self._docs):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[idx] / self._avg_length) if self._avg_length else self.k1
+            for term in query_terms:
+                tf = doc.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            if score > 0:
+                scores.append((idx, score))
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores[:top_k]
+
+    def find_table(self, table_name: str) -> Optional[int]:
+        name = (table_name or "").lower()
+        for idx, table in enumerate(self.catalog):
+            if _table_matches(table, name):
+                return idx
+        return None
+
+    def neighbors(self, idx: int) -> List[int]:
+        return self._neighbors.get(idx, [])
+
+
+def _dictionary_by_column(data_dictionary: Optional[dict]) -> Dict[str, str]:
+    if not data_dictionary or not isinstance(data_dictionary, dict):
+        return {}
+    return {str(col).lower(): str(desc) for col, desc in data_dictionary.items()}
+
+
+def _table_matches(table: Dict[str, Any], name: str) -> bool:
+    return name in (table["name"].lower(), f"{table['schema']}.{table['name']}".lower())
+
+
+# --- Índices memorizados por versión del esquema ---
+_indexes: Dict[str, Tuple[str, SchemaIndex]] = {}
+_indexes_lock = threading.Lock()
+
+
+def _index_signature(entry: Dict[str, Any], data_dictionary: Optional[dict], dictionary_table: Optional[str]) -> str:
+    parts = [
+        str(entry.get("fingerprint")),
+        str(entry.get("updated_at")),
+        str(dictionary_table or ""),
+        repr(sorted(_dictionary_by_column(data_dictionary).items())),
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def get_schema_index(entry: Dict[str, Any], data_dictionary: Optional[dict] = None,
+                     dictionary_table: Optional[str] = None) -> SchemaIndex:
+    """
+    Reutiliza el índice mientras no cambien el esquema ni el diccionario de datos.
+    """
+    key = entry.get("key")
+    if not key:
+        return SchemaIndex(entry["catalog"], data_dictionary, dictionary_table)
+    signature = _index_signature(entry, data_dictionary, dictionary_table)
+    with _indexes_lock:
+        cached = _indexes.get(key)
+    if cached and cached[0] == signature:
+        return cached[1]
+    index = SchemaIndex(entry["catalog"], data_dictionary, dictionary_table)
+    with _indexes_lock:
+        _indexes[key] = (signature, index)
+    return index
+
+
+def select_relevant_tables(
+    index: SchemaIndex,
+    question: str,
+    selected_table: Optional[str] = None,
+    top_k: int = SCHEMA_PROMPT_TOP_K,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Top-k tablas por BM25 + sus vecinas por FK + la tabla seleccionada (siempre).
+    Retorna None si la pregunta no coincide con ninguna tabla (se usa el esquema completo).
+    """
+    hits = [idx for idx, _ in index.search(question, top_k)]
+    selected_idx = index.find_table(selected_table) if selected_table else None
+    if not hits and selected_idx is None:
+        return None
+
+    chosen = set(hits)
+    if selected_idx is not None:
+        chosen.add(selected_idx)
+    # Vecinas por FK: primero las de la tabla seleccionada y luego en orden de relevancia
+    seeds = ([selected_idx] if selected_idx is not None else []) + hits
+    added = 0
+    for idx in seeds:
+        for neighbor in index.neighbors(idx):
+            if added >= SCHEMA_PROMPT_MAX_NEIGHBORS:
+                break
+            if neighbor not in chosen:
+                chosen.add(neighbor)
+                added += 1
+    # Se mantiene el orden del catálogo para que el prompt sea estable
+    return [table for idx, table in enumerate(index.catalog) if idx in chosen]
+
+
+def _display_name(table: Dict[str, Any], db_type: str) -> str:
+    # Mismo nombre que muestra render_schema (calificado fuera de public/dbo)
+    if table["schema"] == DEFAULT_SCHEMAS.get((db_type or "").lower()):
+        return table["name"]
+    return f"{table['schema']}.{table['name']}"
+
+
+def get_prompt_schema(
+    connection: Dict[str, Any],
+    question: str,
+    selected_table: Optional[str] = None,
+) -> Tuple[str, Optional[List[str]]]:
+    """
+    Esquema para el prompt de generación de SQL y, si aplica, las tablas relevantes para la pregunta:
+      - bases chicas (o sin coincidencias): (esquema completo, None)
+      - bases grandes con SCHEMA_PROMPT_CACHE_LAYOUT (opt-in): (esquema completo, [tablas relevantes]);
+        el esquema va al prefijo cacheado y la lista al bloque que cambia por pregunta
+      - bases grandes sin cache (o esquema demasiado largo): (solo las tablas relevantes, None)
+    """
+    entry = get_schema_entry(connection)
+    if not entry:
+        return "", None
+    catalog = entry.get("catalog") or []
+    if not SCHEMA_PROMPT_PRUNING or len(catalog) <= SCHEMA_PRUNE_MIN_TABLES:
+        return entry["schema"], None
+
+    index = get_schema_index(entry, connection.get("data_dictionary"), connection.get("dictionary_table"))
+    tables = select_relevant_tables(index, question, selected_table)
+    if not tables:
+        return entry["schema"], None
+    db_type = connection.get("db_type", "")
+    if SCHEMA_PROMPT_CACHE_LAYOUT and len(entry["schema"]) <= SCHEMA_PROMPT_CACHE_MAX_CHARS:
+        logging.info(f"[SCHEMA_INDEX] Esquema completo en el prefijo; {len(tables)} de {len(catalog)} tablas marcadas como relevantes")
+        return entry["schema"], [_display_name(table, db_type) for table in tables]
+    logging.info(f"[SCHEMA_INDEX] Prompt con {len(tables)} de {len(catalog)} tablas")
+    return render_schema(tables, db_type), None
@@ -0,0 +1,316 @@
+# app/services/sql_cache.py
+
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, List
+
+# --- Configuración ---
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", "86400"))              # el fingerprint ya cubre cambios de esquema
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "5000"))
+# Fracción mínima de términos idénticos para reutilizar el SQL de una pregunta casi igual;
+# el resto solo pueden ser variantes de escritura (plurales, typos), nunca palabras distintas
+SQL_CACHE_NEAR_THRESHOLD = float(os.getenv("SQL_CACHE_NEAR_THRESHOLD", "0.8"))
+# Candidatas (las más recientes del mismo bucket) que se comparan por búsqueda casi duplicada:
+# la búsqueda corre en el event loop y con el lock tomado, así que se acota
+SQL_CACHE_NEAR_MAX_SCAN = int(os.getenv("SQL_CACHE_NEAR_MAX_SCAN", "256"))
+
+_STOPWORDS = {
+    "a", "al", "de", "del", "el", "la", "las", "lo", "los", "un", "una", "unos", "unas", "y", "o", "u",
+    "en", "con", "para", "por", "que", "se", "su", "sus", "es", "son", "hay", "tiene", "tienen",
+    "existe", "existen", "me", "mi", "nos", "favor", "porfa", "dame", "dime", "muestra",
+    "muestrame", "quiero", "saber", "puedes", "podrias", "tabla", "the", "of", "in", "please",
+}
+
+# Palabras de orden, comparación y negación: cambian el SQL aunque el resto de la pregunta sea igual
+# ("de mayor a menor" vs "de menor a mayor", "con" vs "sin"). Se comparan como literales, en orden.
+_ORDER_TERMS = {
+    "mayor", "mayores", "menor", "menores", "mas", "menos", "max", "maximo", "maxima", "min", "minimo", "minima",
+    "asc", "ascendente", "desc", "descendente", "creciente", "decreciente", "mejor", "mejores", "peor", "peores",
+    "primer", "primero", "primeros", "primera", "primeras", "ultimo", "ultimos", "ultima", "ultimas", "top",
+    "antes", "despues", "desde", "hasta", "sobre", "bajo", "superior", "inferior", "arriba", "debajo",
+    "no", "sin", "excepto", "salvo", "nunca",
+    "highest", "lowest", "most", "least", "ascending", "descending", "first", "last",
+    "before", "after", "above", "below", "not", "without",
+}
+
+_WORD_RE = re.compile(r"[a-z0-9_]+")
+_LITERAL_RE = re.compile(r"\d+|'[^']*'|\"[^\"]*\"|[^\W\d_]+")
+
+# Campos de la respuesta del LLM que no se reutilizan (son propios de cada llamada)
+_VOLATILE_META = {
+    "raw_prompt", "raw_response", "response_time_ms", "model",
+    "tokens_prompt", "tokens_completion", "tokens_total", "tokens_cached", "prompt_template_version",
+}
+
+
+def _fold(text: str) -> str:
+    return unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+
+
+def question_terms(question: str) -> List[str]:
+    """
+    Términos normalizados de la pregunta: sin acentos, mayúsculas, puntuación ni stopwords.
+    """
+    return [w for w in _WORD_RE.findall(_fold(question)) if w not in _STOPWORDS]
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question_terms(question))
+
+
+def _literals(question: str) -> Tuple[str, ...]:
+    """
+    Números, textos entre comillas y palabras de orden/comparación, en el orden en que aparecen:
+    si difieren, el SQL no sirve aunque el resto sea igual ("ventas 2023" vs "ventas 2024",
+    "de mayor a menor" vs "de menor a mayor").
+    """
+    literals = []
+    for token in _LITERAL_RE.findall(question or ""):
+        if token[0] in "'\"" or token.isdigit():
+            literals.append(token)
+        else:
+            word = _fold(token)
+            if word in _ORDER_TERMS:
+                literals.append(word)
+    return tuple(literals)
+
+
+def _canonical(term: str) -> str:
+    # Plural y vocal final: "clientes" ~ "cliente", "regiones" ~ "region", "totales" ~ "total"
+    if len(term) > 3 and term.endswith("s"):
+        term = term[:-1]
+    if len(term) > 3 and term.endswith("e"):
+        term = term[:-1]
+    return term
+
+
+def canonical_terms(question: str) -> frozenset:
+    return frozenset(_canonical(t) for t in question_terms(question))
+
+
+def _is_typo(a: str, b: str) -> bool:
+    """
+    True si a y b difieren en una letra agregada, omitida o dos letras vecinas intercambiadas
+    ("clietnes" ~ "clientes"). Un reemplazo no cuenta: "junio" vs "julio" son valores distintos.
+    """
+    if min(len(a), len(b)) < 5 or a == b:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+    if abs(len(a) - len(b)) != 1:
+        return False
+    short, long_ = (a, b) if len(a) < len(b) else (b, a)
+    i = 0
+    while i < len(short) and short[i] == long_[i]:
+        i += 1
+    return short[i:] == long_[i + 1:]
+
+
+def _near_similarity(a: frozenset, b: frozenset) -> float:
+    """
+    Fracción de términos (canónicos) idénticos entre dos preguntas. Si alguna palabra de contenido
+    aparece en una sola de ellas y no es un typo de otra, retorna 0: "región norte" vs "región sur"
+    piden filas distintas aunque compartan casi todos los términos.
+    """
+    if not a or not b:
+        return 0.0
+    only_a, only_b = set(a - b), set(b - a)
+    for term in list(only_a):
+        partner = next((other for other in only_b if _is_typo(term, other)), None)
+        if partner is None:
+            return 0.0
+        only_a.discard(term)
+        only_b.discard(partner)
+    if only_b:
+        return 0.0
+    common = len(a & b)
+    return common / (common + len(a - b))
+
+
+class SQLCache:
+    """
+    Cache pregunta -> SQL (con la metadata de la respuesta del LLM) en dos niveles:
+      - exacto: (conexión, huella del esquema, tabla seleccionada, pregunta normalizada)
+      - casi duplicado: mismo bucket (conexión, huella, tabla), los mismos literales en el mismo
+        orden (números, textos, palabras de orden y comparación) y los mismos términos salvo
+        variantes de escritura (plurales, typos), con al menos el umbral de términos idénticos.
+        Se prefieren entradas con feedback positivo; solo se revisan las SQL_CACHE_NEAR_MAX_SCAN
+        entradas más recientes del bucket.
+    Solo se guardan SQL que se ejecutaron con éxito; el feedback negativo descarta la entrada.
+    """
+
+    def __init__(self, max_entries: int = SQL_CACHE_MAX_ENTRIES, ttl: float = SQL_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._by_log: Dict[int, Tuple] = {}
+        # Claves por bucket, de la menos a la más reciente (la búsqueda casi duplicada no recorre todo)
+        self._by_bucket: Dict[Tuple[str, str, str], "OrderedDict[Tuple, None]"] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _bucket(connection_id: Any, fingerprint: Optional[str], table: Optional[str]) -> Tuple[str, str, str]:
+        return str(connection_id), str(fingerprint or ""), (table or "").lower()
+
+    def get(self, connection_id: Any, fingerprint: Optional[str], table: Optional[str], question: str) -> Optional[Dict[str, Any]]:
+        """
+        Devuelve {"sql", "meta", "match": "exact"|"near", "similarity", ...} o None.
+        """
+        bucket = self._bucket(connection_id, fingerprint, table)
+        normalized = normalize_question(question)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(bucket + (normalized,))
+            if entry is not None and now - entry["stored_at"] > self.ttl:
+                self._remove(bucket + (normalized,))
+                entry = None
+            if entry is not None:
+                self._touch(entry["key"])
+                self.hits += 1
+                return dict(entry, match="exact", similarity=1.0)
+
+            terms = canonical_terms(question)
+            literals = _literals(question)
+            best, best_rank = None, None
+            for scanned, key in enumerate(reversed(self._by_bucket.get(bucket, ()))):
+                if scanned >= SQL_CACHE_NEAR_MAX_SCAN:
+                    break
+                candidate = self._entries[key]
+                if candidate["literals"] != literals or now - candidate["stored_at"] > self.ttl:
+                    continue
+                similarity = _near_similarity(terms, candidate["terms"])
+                if similarity <= 0 or similarity < SQL_CACHE_NEAR_THRESHOLD:
+                    continue
+                rank = (candidate["feedback"] > 0, similarity)
+                if best_rank is None or rank > best_rank:
+                    best, best_rank = candidate, rank
+            if best is None:
+                self.misses += 1
+                return None
+            self._touch(best["key"])
+            self.hits += 1
+            self.near_hits += 1
+            return dict(best, match="near", similarity=round(best_rank[1], 4))
+
+    def put(self, connection_id: Any, fingerprint: Optional[str], table: Optional[str], question: str,
+            sql: str, meta: Dict[str, Any], query_log_id: Optional[int] = None) -> None:
+        bucket = self._bucket(connection_id, fingerprint, table)
+        normalized = normalize_question(question)
+        if not normalized or not sql:
+            return
+        key = bucket + (normalized,)
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None and existing["feedback"] > 0 and existing["sql"] != sql:
+                # Ya hay un SQL validado por un usuario para esta pregunta: se conserva
+                self._link(existing, query_log_id)
+                return
+            if existing is not None:
+                self._remove(key)
+            entry = {
+                "key": key,
+                "question": question,
+                "sql": sql,
+                "meta": {k: v for k, v in meta.items() if k not in _VOLATILE_META},
+                "terms": canonical_terms(question),
+                "literals": _literals(question),
+                "feedback": 0,
+                "log_ids": [],
+                "stored_at": time.monotonic(),
+            }
+            self._entries[key] = entry
+            self._by_bucket.setdefault(bucket, OrderedDict())[key] = None
+            self._link(entry, query_log_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def link_log(self, entry: Dict[str, Any], query_log_id: Optional[int]) -> None:
+        """
+        Asocia un log que se respondió desde el cache, para que su feedback también cuente.
+        """
+        with self._lock:
+            current = self._entries.get(entry.get("key"))
+            if current is not None:
+                self._link(current, query_log_id)
+
+    def record_feedback(self, query_log_id: int, feedback: int) -> None:
+        with self._lock:
+            key = self._by_log.get(query_log_id)
+            entry = self._entries.get(key) if key else None
+            if entry is None:
+                return
+            if feedback < 0:
+                self._remove(key)
+            else:
+                entry["feedback"] += feedback
+
+    def invalidate_connection(self, connection_id: Any) -> None:
+        conn_id = str(connection_id)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == conn_id]:
+                self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+    def _link(self, entry: Dict[str, Any], query_log_id: Optional[int]) -> None:
+        if query_log_id is not None:
+            entry["log_ids"].append(query_log_id)
+            self._by_log[query_log_id] = entry["key"]
+
+    def _touch(self, key: Tuple) -> None:
+        self._entries.move_to_end(key)
+        self._by_bucket[key[:3]].move_to_end(key)
+
+    def _remove(self, key: Tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            bucket_keys = self._by_bucket.get(key[:3])
+            if bucket_keys is not None:
+                bucket_keys.pop(key, None)
+                if not bucket_keys:
+                    self._by_bucket.pop(key[:3], None)
+            for log_id in entry["log_ids"]:
+                if self._by_log.get(log_id) == key:
+                    self._by_log.pop(log_id, None)
+
+
+sql_cache = SQLCache()
+
+
+def cached_llm_response(entry: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Arma (sql, meta) con la misma forma que call_openai_generate_sql(return_metadata=True).
+    """
+    meta = dict(entry["meta"])
+    meta.update({
+        "sql_query": entry["sql"],
+        "raw_prompt": f"NO LLM - SQL reutilizado del cache ({entry['match']}, similitud {entry['similarity']})",
+        "raw_response": None,
+        "response_time_ms": 0,
+        "model": "sql-cache",
+        "tokens_prompt": None,
+        "tokens_completion": None,
+        "tokens_total": None,
+        "tokens_cached": None,
+        "prompt_template_version": "sql-cache",
+        "sql_cache_match": entry["match"],
+    })
+    return entry["sql"], meta
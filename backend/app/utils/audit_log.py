@@ -0,0 +1,224 @@
+# app/utils/audit_log.py
+#
+# Bitácora de auditoría del LLM (logs_llm.txt) sin I/O en el camino de la petición:
+# audit() solo encola el registro (QueueHandler); un hilo (QueueListener) formatea, escribe
+# en lotes y vacía el buffer por tamaño de lote o por intervalo. Rotación por tamaño o por
+# tiempo, con los archivos rotados comprimidos en gzip, y formato texto o JSON lines.
+
+import os
+import gzip
+import json
+import queue
+import shutil
+import atexit
+import logging
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from typing import Any, Dict, Optional
+
+# --- Configuración ---
+AUDIT_LOG_FILE = os.getenv("AUDIT_LOG_FILE", os.path.join(os.path.dirname(__file__), "../../logs_llm.txt"))
+AUDIT_LOG_FORMAT = os.getenv("AUDIT_LOG_FORMAT", "text").lower()            # text | json
+AUDIT_LOG_ROTATE = os.getenv("AUDIT_LOG_ROTATE", "size").lower()            # size | time | none
+AUDIT_LOG_MAX_BYTES = int(os.getenv("AUDIT_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+AUDIT_LOG_WHEN = os.getenv("AUDIT_LOG_WHEN", "midnight")                    # rotación por tiempo
+AUDIT_LOG_BACKUPS = int(os.getenv("AUDIT_LOG_BACKUPS", "10"))
+AUDIT_LOG_COMPRESS = os.getenv("AUDIT_LOG_COMPRESS", "true").lower() in ("1", "true", "yes")
+AUDIT_LOG_BATCH_SIZE = int(os.getenv("AUDIT_LOG_BATCH_SIZE", "256"))        # registros por flush
+AUDIT_LOG_FLUSH_INTERVAL = float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL", "1.0"))  # segundos
+AUDIT_LOG_QUEUE_SIZE = int(os.getenv("AUDIT_LOG_QUEUE_SIZE", "10000"))
+# Respuestas crudas, SQL, explicaciones: se recortan a este largo (0 = sin recorte)
+AUDIT_LOG_MAX_FIELD_CHARS = int(os.getenv("AUDIT_LOG_MAX_FIELD_CHARS", "2000"))
+
+_logger = logging.getLogger("uniquery.llm_audit")
+_logger.setLevel(logging.INFO)
+_logger.propagate = False  # solo va al archivo de auditoría (no a la consola ni al root)
+
+
+def _truncate(value: Any) -> Any:
+    if AUDIT_LOG_MAX_FIELD_CHARS and isinstance(value, str) and len(value) > AUDIT_LOG_MAX_FIELD_CHARS:
+        return f"{value[:AUDIT_LOG_MAX_FIELD_CHARS]}... [+{len(value) - AUDIT_LOG_MAX_FIELD_CHARS} caracteres]"
+    return value
+
+
+# --- Formatos (se aplican en el hilo del listener) ---
+class _TextFormatter(logging.Formatter):
+    """
+    [2025-01-31 12:00:00] [USER: ana@x.com] [SQL] SQL generado | sql=SELECT ...
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        ts = datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S")
+        line = f"[{ts}] [USER: {record.audit_user}] [{record.audit_event}] {record.getMessage()}"
+        fields = " | ".join(f"{k}={_truncate(v)}" for k, v in record.audit_fields.items() if v is not None)
+        return f"{line} | {fields}" if fields else line
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "event": record.audit_event,
+            "user": record.audit_user,
+            "message": record.getMessage(),
+        }
+        payload.update({k: _truncate(v) for k, v in record.audit_fields.items()})
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+# --- Archivo con flush diferido: emit() escribe al buffer; el listener vacía por lote ---
+class _BatchFlushMixin:
+    def flush(self) -> None:
+        pass  # emit() llama a flush() en cada registro; aquí se omite
+
+    def flush_batch(self) -> None:
+        super().flush()
+
+    def close(self) -> None:
+        self.flush_batch()
+        super().close()
+
+
+class _BatchRotatingFileHandler(_BatchFlushMixin, RotatingFileHandler):
+    pass
+
+
+class _BatchTimedRotatingFileHandler(_BatchFlushMixin, TimedRotatingFileHandler):
+    pass
+
+
+class _BatchFileHandler(_BatchFlushMixin, logging.FileHandler):
+    pass
+
+
+def _gzip_namer(name: str) -> str:
+    return f"{name}.gz"
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _build_file_handler() -> logging.Handler:
+    path = os.path.abspath(AUDIT_LOG_FILE)
+    if AUDIT_LOG_ROTATE == "time":
+        handler = _BatchTimedRotatingFileHandler(path, when=AUDIT_LOG_WHEN, backupCount=AUDIT_LOG_BACKUPS, encoding="utf-8", delay=True)
+    elif AUDIT_LOG_ROTATE == "size":
+        handler = _BatchRotatingFileHandler(path, maxBytes=AUDIT_LOG_MAX_BYTES, backupCount=AUDIT_LOG_BACKUPS, encoding="utf-8", delay=True)
+    else:
+        handler = _BatchFileHandler(path, encoding="utf-8", delay=True)
+    if AUDIT_LOG_COMPRESS and AUDIT_LOG_ROTATE in ("time", "size"):
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    handler.setFormatter(_JsonFormatter() if AUDIT_LOG_FORMAT == "json" else _TextFormatter())
+    return handler
+
+
+# --- Cola y listener ---
+class _DroppingQueueHandler(QueueHandler):
+    """
+    Encola el registro tal cual (el formateo ocurre en el listener). Si la cola está llena
+    se descarta y se cuenta: la auditoría nunca frena una petición.
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _BatchingQueueListener(QueueListener):
+    """
+    QueueListener que vacía los archivos cada AUDIT_LOG_BATCH_SIZE registros o cada
+    AUDIT_LOG_FLUSH_INTERVAL segundos (lo que ocurra primero), no en cada registro.
+    """
+
+    def _flush_handlers(self) -> None:
+        for handler in self.handlers:
+            try:
+                handler.flush_batch()
+            except Exception as e:
+                print(f"[AUDIT_LOG] No se pudo escribir la bitácora: {e}")
+
+    def _monitor(self) -> None:
+        q = self.queue
+        pending = 0
+        while True:
+            try:
+                record = q.get(timeout=AUDIT_LOG_FLUSH_INTERVAL if pending else None)
+            except queue.Empty:
+                self._flush_handlers()
+                pending = 0
+                continue
+            if record is self._sentinel:
+                self._flush_handlers()
+                q.task_done()
+                break
+            self.handle(record)
+            q.task_done()
+            pending += 1
+            if pending >= AUDIT_LOG_BATCH_SIZE:
+                self._flush_handlers()
+                pending = 0
+
+    def enqueue_sentinel(self) -> None:
+        # Bloqueante: con la cola llena el cierre espera a que se drene en vez de perder el sentinel
+        self.queue.put(self._sentinel)
+
+
+_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=AUDIT_LOG_QUEUE_SIZE)
+_queue_handler = _DroppingQueueHandler(_queue)
+_listener: Optional[_BatchingQueueListener] = None
+_listener_lock = threading.Lock()
+_logger.addHandler(_queue_handler)
+
+
+def _ensure_listener() -> None:
+    global _listener
+    if _listener is None:
+        with _listener_lock:
+            if _listener is None:
+                listener = _BatchingQueueListener(_queue, _build_file_handler(), respect_handler_level=False)
+                listener.start()
+                _listener = listener
+
+
+def audit(event: str, user_email: Optional[str], message: str = "", **fields: Any) -> None:
+    """
+    Registra un evento de auditoría del LLM (no bloquea ni toca disco).
+    event: etiqueta corta ("PREGUNTA", "SQL", "EXPLAIN", ...); fields: datos extra
+    (sql, respuesta cruda, error...) que se recortan a AUDIT_LOG_MAX_FIELD_CHARS al escribirse.
+    """
+    _ensure_listener()
+    _logger.info(message, extra={"audit_event": event, "audit_user": user_email or "usuario", "audit_fields": fields})
+
+
+def audit_stats() -> Dict[str, Any]:
+    return {"queued": _queue.qsize(), "dropped": _queue_handler.dropped}
+
+
+def shutdown_audit_log() -> None:
+    """
+    Escribe lo pendiente y detiene el listener (shutdown de la app y salida del proceso).
+    """
+    global _listener
+    with _listener_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+atexit.register(shutdown_audit_log)
@@ -0,0 +1,36 @@
+# app/utils/concurrency.py
+
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+# --- Executors dedicados para llamadas bloqueantes (drivers, requests, SQLAlchemy) ---
+# Los drivers de bases de usuario tienen su propio pool para no competir con Supabase/OpenAI/logs.
+DB_EXECUTOR_MAX_WORKERS = int(os.getenv("DB_EXECUTOR_MAX_WORKERS", "16"))
+IO_EXECUTOR_MAX_WORKERS = int(os.getenv("IO_EXECUTOR_MAX_WORKERS", "32"))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_MAX_WORKERS, thread_name_prefix="uq-db")
+io_executor = ThreadPoolExecutor(max_workers=IO_EXECUTOR_MAX_WORKERS, thread_name_prefix="uq-io")
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Ejecuta una llamada bloqueante a la base de datos del usuario sin bloquear el event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Ejecuta una llamada bloqueante de red/log (Supabase, OpenAI, query_logs) fuera del event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executors() -> None:
+    db_executor.shutdown(wait=False, cancel_futures=True)
+    io_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,65 @@
+# app/utils/credential_cache.py
+
+import os
+import time
+import hashlib
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+# --- Cache en memoria (nunca en disco) de credenciales desencriptadas ---
+CREDENTIAL_CACHE_TTL = float(os.getenv("CREDENTIAL_CACHE_TTL", "120"))  # segundos
+CREDENTIAL_CACHE_MAX_ENTRIES = int(os.getenv("CREDENTIAL_CACHE_MAX_ENTRIES", "1024"))
+
+_entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_lock = threading.Lock()
+
+
+def _key(connection: Dict[str, Any]) -> Tuple[str, str]:
+    # El hash incluye el texto cifrado y los datos del servidor: si la conexión se edita,
+    # la entrada vieja simplemente deja de usarse
+    parts = [
+        str(connection.get("password", "")),
+        str(connection.get("db_type", "")),
+        str(connection.get("host", "")),
+        str(connection.get("port", "")),
+        str(connection.get("database", "")),
+        str(connection.get("username", "")),
+    ]
+    return (str(connection.get("id")), hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest())
+
+
+def get_cached_credentials(connection: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Devuelve {"password", "odbc_conn_str"} si hay una entrada vigente para la conexión (aún cifrada).
+    """
+    key = _key(connection)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry["stored_at"] > CREDENTIAL_CACHE_TTL:
+            _entries.pop(key, None)
+            return None
+        return entry
+
+
+def store_credentials(connection: Dict[str, Any], password: str, odbc_conn_str: Optional[str] = None) -> None:
+    key = _key(connection)
+    now = time.monotonic()
+    with _lock:
+        if len(_entries) >= CREDENTIAL_CACHE_MAX_ENTRIES:
+            for k in [k for k, e in _entries.items() if now - e["stored_at"] > CREDENTIAL_CACHE_TTL]:
+                _entries.pop(k, None)
+            if len(_entries) >= CREDENTIAL_CACHE_MAX_ENTRIES:
+                _entries.pop(next(iter(_entries)))
+        _entries[key] = {"password": password, "odbc_conn_str": odbc_conn_str, "stored_at": now}
+
+
+def invalidate_credentials(connection_id: Any) -> None:
+    """
+    Borra las credenciales cacheadas de una conexión (al eliminarla o editarla).
+    """
+    conn_id = str(connection_id)
+    with _lock:
+        for key in [k for k in _entries if k[0] == conn_id]:
+            _entries.pop(key, None)
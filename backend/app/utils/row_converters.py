@@ -0,0 +1,128 @@
+# app/utils/row_converters.py
+
+from decimal import Decimal
+from datetime import datetime, date, time
+from typing import Any, Callable, List, Optional, Sequence
+
+# --- Serializador seguro para cualquier valor raro ---
+def sanitize_value(value):
+    """
+    Convierte a tipos seguros para JSON/log/llm:
+      - Decimal -> float
+      - datetime/date -> str (ISO)
+      - list/tuple/dict -> recursivo
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {k: sanitize_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [sanitize_value(v) for v in value]
+    return value
+
+# --- Conversores especializados por columna ---
+def _iso(value):
+    return value.isoformat()
+
+def _bytes_to_str(value):
+    raw = bytes(value)
+    try:
+        return raw.decode()
+    except UnicodeDecodeError:
+        return str(raw)
+
+# Tipos que ya son seguros para JSON: la columna no necesita conversión
+_SAFE_SCALARS = (bool, int, float, str)
+
+# numeric / decimal: float solo para la respuesta JSON; exportaciones y streaming conservan el Decimal
+_PG_NUMERIC = 1700
+
+# Postgres (psycopg2): type_code es el OID del tipo
+_PG_CONVERTERS = {
+    _PG_NUMERIC: float,     # numeric
+    1082: _iso,             # date
+    1083: _iso,             # time
+    1114: _iso,             # timestamp
+    1184: _iso,             # timestamptz
+    1266: _iso,             # timetz
+    17: _bytes_to_str,      # bytea
+}
+_PG_IDENTITY = {
+    16, 18, 19, 20, 21, 23, 25, 26,      # bool, char, name, int8, int2, int4, text, oid
+    114, 700, 701, 1042, 1043, 2950, 3802,  # json, float4, float8, bpchar, varchar, uuid, jsonb
+}
+
+# SQL Server (pyodbc): type_code es el tipo Python que entrega el driver
+_PY_CONVERTERS = {
+    Decimal: float,
+    datetime: _iso,
+    date: _iso,
+    time: _iso,
+    bytes: _bytes_to_str,
+    bytearray: _bytes_to_str,
+}
+
+
+def _column_converter(type_code: Any, sample: Any, exact_decimals: bool = False) -> Optional[Callable[[Any], Any]]:
+    """
+    Decide una sola vez el conversor de una columna. None = la columna se copia tal cual.
+    """
+    # Si el driver ya entrega un escalar seguro, no hay nada que hacer
+    if sample is not None and type(sample) in _SAFE_SCALARS:
+        return None
+    if exact_decimals and (type_code == _PG_NUMERIC or type_code is Decimal or isinstance(sample, Decimal)):
+        return None
+    if isinstance(type_code, int) and not isinstance(type_code, bool):
+        if type_code in _PG_IDENTITY:
+            return None
+        if type_code in _PG_CONVERTERS:
+            return _PG_CONVERTERS[type_code]
+    elif isinstance(type_code, type):
+        if type_code in _PY_CONVERTERS:
+            return _PY_CONVERTERS[type_code]
+        if type_code in _SAFE_SCALARS:
+            return None
+    # Tipo desconocido (arrays, intervalos, etc.): saneo genérico solo para esta columna
+    return sanitize_value
+
+
+def build_row_converter(description: Sequence[Sequence[Any]], first_row: Optional[Sequence[Any]] = None,
+                        exact_decimals: bool = False) -> Callable[[Sequence[Sequence[Any]]], List[List[Any]]]:
+    """
+    A partir de cursor.description (y opcionalmente la primera fila) arma una función que
+    convierte lotes de filas aplicando conversores solo a las columnas que lo necesitan.
+    exact_decimals: deja numeric/decimal como Decimal (CSV, NDJSON y Arrow sin pérdida de precisión).
+    """
+    converters = []
+    for idx, desc in enumerate(description):
+        sample = first_row[idx] if first_row is not None else None
+        converter = _column_converter(desc[1], sample, exact_decimals)
+        if converter is not None:
+            converters.append((idx, converter))
+
+    if not converters:
+        return lambda rows: [list(row) for row in rows]
+
+    def convert(rows):
+        out = []
+        for row in rows:
+            values = list(row)
+            for idx, converter in converters:
+                value = values[idx]
+                if value is not None:
+                    values[idx] = converter(value)
+            out.append(values)
+        return out
+
+    return convert
+
+
+def convert_rows(description: Sequence[Sequence[Any]], rows: Sequence[Sequence[Any]]) -> List[List[Any]]:
+    """
+    Convierte todas las filas de un resultado decidiendo los conversores por columna.
+    """
+    if not rows:
+        return []
+    return build_row_converter(description, rows[0])(rows)
@@ -0,0 +1,199 @@
+# benchmarks/bench_human_query.py
+#
+# Benchmark end-to-end de POST /human_query sin red: OpenAI y Supabase (PostgREST) son dobles
+# locales y la base consultada es un Postgres desechable (tests/fakes). Reporta p50/p95/p99 por
+# etapa (header Server-Timing) y el throughput.
+#
+# Uso (desde backend/):
+#   python -m benchmarks.bench_human_query [--requests 200] [--concurrency 16] [--llm-latency-ms 400]
+#   TEST_POSTGRES_DSN=postgresql://postgres@localhost/postgres python -m benchmarks.bench_human_query
+#
+# Sin TEST_POSTGRES_DSN se levanta un cluster temporal con initdb/pg_ctl (no como root).
+
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict, Counter
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+from tests.fakes import FakeOpenAI, FakePostgREST, DisposablePostgres, PostgresUnavailable, offline_environment, make_jwt
+
+USER_ID = "00000000-0000-0000-0000-0000000000b1"
+
+# Preguntas que van al LLM (las repetidas pueden salir del cache pregunta->SQL)
+LLM_QUESTIONS = [
+    "¿Cuál es el total de ventas por región?",
+    "total vendido por producto",
+    "ventas por mes del 2024",
+    "¿qué región vendió más en marzo?",
+    "promedio de monto por región y producto",
+]
+# Preguntas que resuelve el motor de intenciones (sin LLM)
+INTENT_QUESTIONS = [
+    "cuántos registros tiene la tabla ventas",
+    "top 10 ventas por monto",
+    "cual es el monto máximo de ventas",
+    "valores distintos de region en ventas",
+    "ventas entre 2024-02-01 y 2024-02-15",
+]
+SCENARIOS = {
+    "llm": LLM_QUESTIONS,
+    "intent": INTENT_QUESTIONS,
+    "mixed": LLM_QUESTIONS + INTENT_QUESTIONS,
+}
+
+_SQL_BY_KEYWORD = [
+    ("producto", "SELECT producto, SUM(monto) AS total FROM ventas GROUP BY producto ORDER BY total DESC;"),
+    ("mes", "SELECT date_trunc('month', fecha_venta) AS mes, SUM(monto) AS total FROM ventas GROUP BY 1 ORDER BY 1;"),
+    ("marzo", "SELECT region, SUM(monto) AS total FROM ventas WHERE fecha_venta >= '2024-03-01' AND fecha_venta < '2024-04-01' GROUP BY region ORDER BY total DESC LIMIT 1;"),
+]
+
+
+def sql_responder(question: str) -> Dict[str, Any]:
+    q = question.lower()
+    for keyword, sql in _SQL_BY_KEYWORD:
+        if keyword in q:
+            return {"sql_query": sql}
+    return {"sql_query": "SELECT region, SUM(monto) AS total FROM ventas GROUP BY region ORDER BY region;"}
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """
+    "connection;dur=3.1, llm_sql;dur=812.4" -> {"connection": 3.1, "llm_sql": 812.4}
+    """
+    timings = {}
+    for metric in (header or "").split(","):
+        name, _, params = metric.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if name and key == "dur":
+                timings[name] = float(value)
+    return timings
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    # Nearest-rank
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+async def run_load(app, questions: List[str], n_requests: int, concurrency: int, warmup: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    plan = [rng.choice(questions) for _ in range(n_requests)]
+    headers = {"Authorization": f"Bearer {make_jwt(USER_ID)}"}
+    stages: Dict[str, List[float]] = defaultdict(list)
+    statuses: Counter = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers, timeout=120) as client:
+        for question in questions[:warmup]:
+            await client.post("/human_query/", json={"question": question})
+
+        async def one(question: str) -> None:
+            async with semaphore:
+                t0 = time.perf_counter()
+                resp = await client.post("/human_query/", json={"question": question})
+                stages["client"].append((time.perf_counter() - t0) * 1000)
+            statuses[resp.status_code] += 1
+            if resp.status_code == 200:
+                for name, ms in parse_server_timing(resp.headers.get("server-timing")).items():
+                    stages[name].append(ms)
+
+        t_start = time.perf_counter()
+        await asyncio.gather(*(one(q) for q in plan))
+        wall = time.perf_counter() - t_start
+
+    return {"stages": stages, "statuses": statuses, "wall_s": wall, "requests": n_requests}
+
+
+def report(result: Dict[str, Any]) -> Dict[str, Any]:
+    order = ["connection", "intent", "schema", "sql_cache", "llm_sql", "plan", "db", "log", "explain", "total", "client"]
+    stages = result["stages"]
+    names = [n for n in order if n in stages] + sorted(n for n in stages if n not in order)
+    summary = {}
+    print(f"{'etapa':<12} {'n':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'media ms':>10}")
+    for name in names:
+        values = stages[name]
+        row = {
+            "n": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "mean": sum(values) / len(values),
+        }
+        summary[name] = row
+        print(f"{name:<12} {row['n']:>6} {row['p50']:>10.1f} {row['p95']:>10.1f} {row['p99']:>10.1f} {row['mean']:>10.1f}")
+    throughput = result["requests"] / result["wall_s"] if result["wall_s"] else 0.0
+    print(f"\n{result['requests']} consultas en {result['wall_s']:.2f} s -> {throughput:,.1f} consultas/s")
+    print("status:", dict(result["statuses"]))
+    return {"stages": summary, "throughput_rps": throughput, "statuses": dict(result["statuses"])}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark offline de POST /human_query")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=3, help="consultas previas (no medidas) para poblar caches de esquema")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--llm-latency-ms", type=float, default=400.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--supabase-latency-ms", type=float, default=20.0)
+    parser.add_argument("--rows", type=int, default=50_000, help="filas de la tabla ventas")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", dest="json_path", help="guarda el resumen en este archivo")
+    args = parser.parse_args(argv)
+
+    openai_fake = FakeOpenAI(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, sql_responder=sql_responder)
+    postgrest = FakePostgREST(latency_ms=args.supabase_latency_ms)
+    postgres = DisposablePostgres()
+    try:
+        postgres.start()
+    except PostgresUnavailable as e:
+        print(f"[BENCH] {e}")
+        return 2
+
+    with openai_fake, postgrest:
+        try:
+            postgres.create_query_logs()
+            postgres.seed_sales(args.rows)
+            postgrest.add_connection(USER_ID, postgres.connection_record())
+            with offline_environment(openai_fake, postgrest, postgres):
+                from app.main import app  # después de apuntar el entorno a los dobles
+
+                async def bench() -> Dict[str, Any]:
+                    await app.router.startup()
+                    try:
+                        return await run_load(app, SCENARIOS[args.scenario], args.requests, args.concurrency, args.warmup, args.seed)
+                    finally:
+                        await app.router.shutdown()
+
+                result = asyncio.run(bench())
+        finally:
+            postgres.stop()
+
+    summary = report(result)
+    summary.update({
+        "scenario": args.scenario,
+        "concurrency": args.concurrency,
+        "llm_latency_ms": args.llm_latency_ms,
+        "llm_calls": {"sql": len(openai_fake.completions("sql")), "explain": len(openai_fake.completions("explain"))},
+    })
+    print("llamadas al LLM:", summary["llm_calls"])
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
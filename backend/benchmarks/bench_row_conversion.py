@@ -0,0 +1,62 @@
+# benchmarks/bench_row_conversion.py
+#
+# Compara el saneo celda por celda (sanitize_value) contra la conversión por columna
+# (build_row_converter) sobre un resultado ancho y mayormente numérico.
+#
+# Uso (desde backend/):  python -m benchmarks.bench_row_conversion [filas] [columnas]
+
+import sys
+import time
+from datetime import datetime, date
+from decimal import Decimal
+
+from app.utils.row_converters import sanitize_value, build_row_converter
+
+
+def build_result(n_rows: int, n_cols: int):
+    """
+    Resultado sintético estilo pyodbc: type_code es el tipo Python de cada columna.
+    Mezcla: enteros, Decimals, floats, fechas y texto (mayoría numérica).
+    """
+    kinds = [int, Decimal, float, int, Decimal, float, date, str, datetime, int]
+    description = []
+    for i in range(n_cols):
+        description.append((f"col_{i}", kinds[i % len(kinds)], None, None, None, None, True))
+    samples = {
+        int: 12345,
+        Decimal: Decimal("1234.5678"),
+        float: 3.14159,
+        date: date(2024, 5, 17),
+        str: "texto",
+        datetime: datetime(2024, 5, 17, 10, 30),
+    }
+    row = tuple(samples[desc[1]] for desc in description)
+    return description, [row] * n_rows
+
+
+def bench(label, fn, rows, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - t0)
+    print(f"{label:<28} {best * 1000:10.1f} ms  ({len(rows) / best:,.0f} filas/s)")
+    return best
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_cols = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    description, rows = build_result(n_rows, n_cols)
+    print(f"Filas: {n_rows:,}  Columnas: {n_cols}")
+
+    per_cell = bench("sanitize_value por celda", lambda r: [[sanitize_value(v) for v in row] for row in r], rows)
+    column_wise = bench("conversión por columna", lambda r: build_row_converter(description, r[0])(r), rows)
+
+    # Mismo resultado con ambos métodos
+    assert [[sanitize_value(v) for v in row] for row in rows[:10]] == build_row_converter(description, rows[0])(rows[:10])
+    print(f"Mejora: {per_cell / column_wise:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+-- Presupuesto de filas: indica si el resultado se cortó y el total estimado por el planner.
+-- log_query_attempt ignora columnas que no existan, así que aplicar esto es opcional pero recomendado.
+ALTER TABLE public.query_logs ADD COLUMN IF NOT EXISTS truncated boolean;
+ALTER TABLE public.query_logs ADD COLUMN IF NOT EXISTS approx_total_rows bigint;
@@ -0,0 +1,2 @@
+-- Motivo de cancelación de la consulta: 'timeout' o 'client_disconnect' (NULL si no se canceló).
+ALTER TABLE public.query_logs ADD COLUMN IF NOT EXISTS cancel_reason text;
@@ -0,0 +1,2 @@
+-- Indica si el resultado se sirvió desde el cache de resultados (sin re-ejecutar el SQL).
+ALTER TABLE public.query_logs ADD COLUMN IF NOT EXISTS result_cache_hit boolean;
@@ -0,0 +1,2 @@
+-- Modo de conteo usado en preguntas "¿cuántos registros...?": 'approx' (estadísticas del catálogo) o 'exact' (COUNT(*)).
+ALTER TABLE public.query_logs ADD COLUMN IF NOT EXISTS count_mode text;
@@ -0,0 +1,2 @@
+-- Si el SQL se reutilizó del cache pregunta->SQL (sin llamar al LLM): 'exact' o 'near'.
+ALTER TABLE public.query_logs ADD COLUMN IF NOT EXISTS sql_cache_match text;
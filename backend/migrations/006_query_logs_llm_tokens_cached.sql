@@ -0,0 +1,2 @@
+-- Tokens del prompt servidos desde el cache de prompts del proveedor (usage.prompt_tokens_details.cached_tokens).
+ALTER TABLE public.query_logs ADD COLUMN IF NOT EXISTS llm_tokens_cached integer;
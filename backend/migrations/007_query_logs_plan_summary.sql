@@ -0,0 +1,3 @@
+-- Plan estimado revisado antes de ejecutar (cost_gate): filas y costo estimados y la acción tomada
+-- ('ok', 'limited', 'confirmed', 'needs_confirmation', 'rejected', 'unavailable').
+ALTER TABLE public.query_logs ADD COLUMN IF NOT EXISTS plan_summary jsonb;
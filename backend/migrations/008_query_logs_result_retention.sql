@@ -0,0 +1,4 @@
+-- Retención de resultados (RESULT_RETENTION): sql_raw_result guarda solo una vista previa.
+-- sha256 del resultado completo y códec del blob en el almacén de resultados ('zstd' o 'gzip'; NULL si no se guardó).
+ALTER TABLE public.query_logs ADD COLUMN IF NOT EXISTS result_sha256 text;
+ALTER TABLE public.query_logs ADD COLUMN IF NOT EXISTS result_blob_codec text;
@@ -0,0 +1,3 @@
+-- Conexión para la que se generó el SQL: /logs/{id}/stream y /logs/{id}/export solo lo
+-- re-ejecutan sobre esa misma conexión (NULL en logs anteriores a esta columna).
+ALTER TABLE public.query_logs ADD COLUMN IF NOT EXISTS connection_id text;
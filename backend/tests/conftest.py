@@ -0,0 +1,54 @@
+# tests/conftest.py
+
+import pytest
+
+from tests.fakes import FakeOpenAI, FakePostgREST, DisposablePostgres, PostgresUnavailable, offline_environment
+
+
+@pytest.fixture(scope="session")
+def fake_openai():
+    with FakeOpenAI() as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
+def fake_postgrest():
+    with FakePostgREST() as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
+def disposable_postgres():
+    """
+    Postgres desechable con query_logs y la tabla ventas, o None si no hay Postgres disponible.
+    """
+    postgres = DisposablePostgres()
+    try:
+        postgres.start()
+    except PostgresUnavailable as e:
+        print(f"[TESTS] Sin Postgres local: {e}")
+        yield None
+        return
+    try:
+        postgres.create_query_logs()
+        postgres.seed_sales(2_000)
+        yield postgres
+    finally:
+        postgres.stop()
+
+
+@pytest.fixture
+def local_postgres(disposable_postgres):
+    if disposable_postgres is None:
+        pytest.skip("Sin Postgres local (define TEST_POSTGRES_DSN)")
+    return disposable_postgres
+
+
+@pytest.fixture(scope="session")
+def offline_env(fake_openai, fake_postgrest, disposable_postgres):
+    """
+    Entorno apuntando a los dobles locales. Los módulos de app leen el entorno al importarse:
+    se importan recién dentro de los tests que usan este fixture.
+    """
+    with offline_environment(fake_openai, fake_postgrest, disposable_postgres) as env:
+        yield env
@@ -0,0 +1,22 @@
+# tests/fakes/__init__.py
+#
+# Dobles locales de los servicios externos, para correr la API sin red:
+#   - FakeOpenAI: chat completions (con y sin stream) con latencia y respuestas configurables
+#   - FakePostgREST: la API REST de Supabase (tablas connections / active_connections)
+#   - DisposablePostgres: un Postgres temporal con query_logs y datos de ejemplo
+
+from tests.fakes.http_server import FakeHTTPServer
+from tests.fakes.openai_server import FakeOpenAI
+from tests.fakes.postgrest_server import FakePostgREST
+from tests.fakes.local_postgres import DisposablePostgres, PostgresUnavailable
+from tests.fakes.environment import offline_environment, make_jwt
+
+__all__ = [
+    "FakeHTTPServer",
+    "FakeOpenAI",
+    "FakePostgREST",
+    "DisposablePostgres",
+    "PostgresUnavailable",
+    "offline_environment",
+    "make_jwt",
+]
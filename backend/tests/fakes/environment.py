@@ -0,0 +1,61 @@
+# tests/fakes/environment.py
+
+import os
+import time
+import shutil
+import tempfile
+import contextlib
+from typing import Dict, Iterator, Optional
+
+import jwt
+from cryptography.fernet import Fernet
+
+from tests.fakes.openai_server import FakeOpenAI
+from tests.fakes.postgrest_server import FakePostgREST
+from tests.fakes.local_postgres import DisposablePostgres
+
+# query_logs sin base: la URL no responde y log_query_attempt registra el error y sigue
+OFFLINE_DB_URL = "postgresql://offline@127.0.0.1:9/offline"
+
+
+def make_jwt(user_id: str = "00000000-0000-0000-0000-000000000001", email: str = "bench@example.com") -> str:
+    """
+    JWT con la forma de Supabase (app.deps.auth no verifica la firma).
+    """
+    payload = {"sub": user_id, "email": email, "exp": int(time.time()) + 3600}
+    return jwt.encode(payload, "fake-secret", algorithm="HS256")
+
+
+@contextlib.contextmanager
+def offline_environment(
+    openai: FakeOpenAI,
+    postgrest: FakePostgREST,
+    postgres: Optional[DisposablePostgres] = None,
+) -> Iterator[Dict[str, str]]:
+    """
+    Apunta la app a los dobles locales. Los módulos de app leen estas variables al importarse,
+    así que hay que importar app.* DENTRO de este contexto (y en un proceso que no los haya importado).
+    """
+    env = {
+        "OPENAI_API_KEY": "sk-fake",
+        "OPENAI_BASE_URL": openai.base_url,
+        "SUPABASE_URL": postgrest.url,
+        "SUPABASE_ANON_KEY": postgrest.api_key,
+        "SUPABASE_DB_URL": postgres.url if postgres is not None else OFFLINE_DB_URL,
+        "FERNET_KEY": os.getenv("FERNET_KEY") or Fernet.generate_key().decode(),
+    }
+    # Archivos locales de la app (respaldo de query_logs, almacén de resultados) en un directorio temporal
+    scratch = tempfile.mkdtemp(prefix="uniquery_test_")
+    env["QUERY_LOG_SPILL_DIR"] = os.path.join(scratch, "query_log_spill")
+    env["RESULT_BLOB_DIR"] = os.path.join(scratch, "result_blobs")
+    previous = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        yield env
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
@@ -0,0 +1,120 @@
+# tests/fakes/http_server.py
+
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, Tuple, List
+from urllib.parse import urlsplit, parse_qsl
+
+
+class FakeHTTPServer:
+    """
+    Servidor HTTP en un hilo (puerto efímero en 127.0.0.1). Cada petición corre en su propio hilo,
+    así que la latencia simulada no serializa a los clientes concurrentes.
+    Las subclases implementan handle(method, path, query, headers, body) -> (status, headers, body).
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.requests: List[Dict[str, Any]] = []
+        self._errors: List[Tuple[int, Dict[str, str]]] = []
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Ciclo de vida ---
+    def start(self) -> "FakeHTTPServer":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self):
+                fake._serve(self)
+
+            do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _dispatch
+
+            def log_message(self, format, *args):  # sin ruido en la salida de los tests
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # --- Inyección de fallas ---
+    def fail_next(self, status: int, count: int = 1, headers: Optional[Dict[str, str]] = None) -> None:
+        """
+        Las próximas `count` peticiones responden `status` (ej. 429 con Retry-After, 503).
+        """
+        with self._lock:
+            self._errors.extend([(status, headers or {})] * count)
+
+    # --- Internos ---
+    def _sleep(self) -> None:
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _serve(self, handler: BaseHTTPRequestHandler) -> None:
+        parts = urlsplit(handler.path)
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw = handler.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            body = raw.decode("utf-8", "replace")
+        headers = {k.lower(): v for k, v in handler.headers.items()}
+        with self._lock:
+            self.requests.append({"method": handler.command, "path": parts.path, "query": parts.query, "body": body})
+            error = self._errors.pop(0) if self._errors else None
+
+        self._sleep()
+        if error is not None:
+            status, extra_headers = error
+            self._send(handler, status, extra_headers, {"error": {"message": f"Falla simulada ({status})"}})
+            return
+        status, resp_headers, resp_body = self.handle(handler.command, parts.path, parse_qsl(parts.query, keep_blank_values=True), headers, body)
+        self._send(handler, status, resp_headers, resp_body)
+
+    @staticmethod
+    def _send(handler: BaseHTTPRequestHandler, status: int, headers: Dict[str, str], body: Any) -> None:
+        if isinstance(body, (bytes, str)):
+            payload = body.encode("utf-8") if isinstance(body, str) else body
+            content_type = headers.pop("Content-Type", "text/plain; charset=utf-8")
+        elif body is None:
+            payload, content_type = b"", headers.pop("Content-Type", "application/json")
+        else:
+            payload = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+            content_type = headers.pop("Content-Type", "application/json")
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(payload)))
+        for key, value in headers.items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def handle(self, method: str, path: str, query: List[Tuple[str, str]], headers: Dict[str, str], body: Any) -> Tuple[int, Dict[str, str], Any]:
+        raise NotImplementedError
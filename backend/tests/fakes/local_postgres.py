@@ -0,0 +1,222 @@
+# tests/fakes/local_postgres.py
+
+import os
+import glob
+import uuid
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+from typing import Dict, Any, Optional
+
+import psycopg2
+from psycopg2.extensions import make_dsn, parse_dsn
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "migrations")
+
+# Columnas base de query_logs (las posteriores llegan por migrations/*.sql)
+_QUERY_LOGS_DDL = """
+CREATE TABLE IF NOT EXISTS public.query_logs (
+    id bigserial PRIMARY KEY,
+    user_id text,
+    user_email text,
+    question text,
+    table_used text,
+    llm_model text,
+    llm_tokens_prompt integer,
+    llm_tokens_completion integer,
+    llm_tokens_total integer,
+    llm_response_time_ms integer,
+    sql_exec_time_ms double precision,
+    sql_generated text,
+    sql_exec_success boolean,
+    error_message text,
+    row_count integer,
+    columns text[],
+    llm_raw_request jsonb,
+    llm_raw_response jsonb,
+    frontend_version text,
+    api_version text,
+    client_ip text,
+    user_agent text,
+    prompt_template_version text,
+    created_at timestamp,
+    updated_at timestamp,
+    feedback smallint,
+    feedback_comment text,
+    llm_final_answer text,
+    sql_raw_result jsonb
+);
+"""
+
+_SALES_DDL = """
+DROP TABLE IF EXISTS public.ventas;
+CREATE TABLE public.ventas (
+    id serial PRIMARY KEY,
+    fecha_venta date NOT NULL,
+    region text NOT NULL,
+    producto text NOT NULL,
+    monto numeric(12, 2) NOT NULL
+);
+INSERT INTO public.ventas (fecha_venta, region, producto, monto)
+SELECT DATE '2024-01-01' + mod(g, 365),
+       (ARRAY['Norte', 'Sur', 'Centro', 'Oriente', 'Poniente'])[1 + mod(g, 5)],
+       'producto_' || mod(g, 40),
+       mod(g * 37, 100000) / 100.0
+FROM generate_series(1, %(rows)s) AS g;
+ANALYZE public.ventas;
+"""
+
+
+class PostgresUnavailable(RuntimeError):
+    """
+    No hay Postgres disponible: ni TEST_POSTGRES_DSN ni binarios (initdb/pg_ctl) utilizables.
+    """
+    pass
+
+
+def _find_binary(name: str) -> Optional[str]:
+    found = shutil.which(name)
+    if found:
+        return found
+    candidates = sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}")) + sorted(glob.glob(f"/usr/local/pgsql/bin/{name}"))
+    return candidates[-1] if candidates else None
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class DisposablePostgres:
+    """
+    Base Postgres desechable para tests y benchmarks:
+      - con TEST_POSTGRES_DSN (o dsn=...) crea una base temporal en ese servidor y la borra al final
+      - si no, levanta un cluster propio con initdb/pg_ctl en un directorio temporal
+    """
+
+    def __init__(self, dsn: Optional[str] = None):
+        self.admin_dsn = dsn or os.getenv("TEST_POSTGRES_DSN")
+        self.params: Dict[str, Any] = {}
+        self._admin: Dict[str, Any] = {}
+        self._data_dir: Optional[str] = None
+        self._pg_ctl: Optional[str] = None
+
+    # --- Ciclo de vida ---
+    def start(self) -> "DisposablePostgres":
+        if self.admin_dsn:
+            admin = parse_dsn(self.admin_dsn)
+        else:
+            admin = self._start_cluster()
+        database = f"uniquery_test_{uuid.uuid4().hex[:8]}"
+        conn = psycopg2.connect(make_dsn(**admin))
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'CREATE DATABASE "{database}"')
+        conn.close()
+        self._admin = admin
+        self.params = dict(admin, dbname=database)
+        return self
+
+    def stop(self) -> None:
+        if self.params:
+            try:
+                conn = psycopg2.connect(make_dsn(**self._admin))
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'DROP DATABASE IF EXISTS "{self.params["dbname"]}" WITH (FORCE)')
+                conn.close()
+            except psycopg2.Error as e:
+                print(f"[TEST_PG] No se pudo borrar la base temporal: {e}")
+            self.params = {}
+        if self._data_dir:
+            subprocess.run([self._pg_ctl, "stop", "-D", self._data_dir, "-m", "immediate"], capture_output=True)
+            shutil.rmtree(self._data_dir, ignore_errors=True)
+            self._data_dir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _start_cluster(self) -> Dict[str, Any]:
+        initdb, pg_ctl = _find_binary("initdb"), _find_binary("pg_ctl")
+        if not initdb or not pg_ctl:
+            raise PostgresUnavailable("No se encontraron initdb/pg_ctl; define TEST_POSTGRES_DSN para usar un servidor existente")
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            raise PostgresUnavailable("Postgres no corre como root; define TEST_POSTGRES_DSN para usar un servidor existente")
+        self._pg_ctl = pg_ctl
+        self._data_dir = tempfile.mkdtemp(prefix="uniquery_pg_")
+        port = _free_port()
+        subprocess.run([initdb, "-D", self._data_dir, "-U", "postgres", "--auth=trust", "-E", "UTF8"],
+                       check=True, capture_output=True)
+        options = f"-p {port} -k {self._data_dir} -c listen_addresses=127.0.0.1 -c fsync=off"
+        subprocess.run([pg_ctl, "start", "-D", self._data_dir, "-o", options, "-w", "-l",
+                        os.path.join(self._data_dir, "server.log")], check=True, capture_output=True)
+        admin = {"host": "127.0.0.1", "port": port, "user": "postgres", "dbname": "postgres"}
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                psycopg2.connect(make_dsn(**admin)).close()
+                return admin
+            except psycopg2.OperationalError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    # --- Acceso ---
+    @property
+    def url(self) -> str:
+        """
+        URL para SQLAlchemy (SUPABASE_DB_URL del query_logger).
+        """
+        p = self.params
+        auth = p["user"] + (f":{p['password']}" if p.get("password") else "")
+        return f"postgresql://{auth}@{p['host']}:{p.get('port', 5432)}/{p['dbname']}"
+
+    def connection_record(self, **extra) -> Dict[str, Any]:
+        """
+        Fila de la tabla connections (Supabase) que apunta a esta base.
+        """
+        p = self.params
+        record = {
+            "name": "Postgres de pruebas",
+            "db_type": "postgres",
+            "host": p["host"],
+            "port": int(p.get("port", 5432)),
+            "database": p["dbname"],
+            "username": p["user"],
+            "password": p.get("password", ""),
+            "dictionary_table": "ventas",
+            "data_dictionary": None,
+        }
+        record.update(extra)
+        return record
+
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> None:
+        conn = psycopg2.connect(make_dsn(**self.params))
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+        finally:
+            conn.close()
+
+    # --- Datos ---
+    def create_query_logs(self) -> None:
+        """
+        query_logs con las columnas base más todas las migraciones del repo.
+        """
+        self.execute(_QUERY_LOGS_DDL)
+        for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql"))):
+            with open(path, encoding="utf-8") as f:
+                self.execute(f.read())
+
+    def seed_sales(self, rows: int = 50_000) -> None:
+        """
+        Tabla ventas de ejemplo (fecha, región, producto, monto) con estadísticas al día.
+        """
+        self.execute(_SALES_DDL, {"rows": rows})
@@ -0,0 +1,122 @@
+# tests/fakes/openai_server.py
+
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, Any, Callable, List, Optional, Tuple, Union
+
+from tests.fakes.http_server import FakeHTTPServer
+
+DEFAULT_SQL = "SELECT region, SUM(monto) AS total FROM ventas GROUP BY region ORDER BY region;"
+DEFAULT_EXPLANATION = "Las ventas se concentran en pocas regiones; la primera de la lista lidera el total."
+
+# Respuesta de generación: dict que se serializa como el JSON que devolvería el modelo
+SqlResponder = Callable[[str], Dict[str, Any]]
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeOpenAI(FakeHTTPServer):
+    """
+    Habla POST /v1/chat/completions como OpenAI:
+      - con response_format=json_object responde la generación de SQL (sql_responder(pregunta))
+      - sin response_format responde la explicación (explanation), con o sin stream=True
+    usage incluye prompt_tokens_details.cached_tokens: el primer mensaje se considera cacheado
+    si ya se vio antes (igual que el cache de prefijos del proveedor).
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        sql_responder: Optional[Union[SqlResponder, Dict[str, Any]]] = None,
+        explanation: str = DEFAULT_EXPLANATION,
+        stream_chunk_delay_ms: float = 0.0,
+    ):
+        super().__init__(latency_ms, jitter_ms)
+        if sql_responder is None:
+            sql_responder = {"sql_query": DEFAULT_SQL}
+        self.sql_responder: SqlResponder = sql_responder if callable(sql_responder) else (lambda question: dict(sql_responder))
+        self.explanation = explanation
+        self.stream_chunk_delay_ms = stream_chunk_delay_ms
+        self._seen_prefixes = set()
+        self._prefix_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/v1"
+
+    def completions(self, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Peticiones recibidas; kind="sql" o "explain" filtra por tipo.
+        """
+        calls = [r for r in self.requests if r["path"].endswith("/chat/completions")]
+        if kind == "sql":
+            return [r for r in calls if (r["body"] or {}).get("response_format")]
+        if kind == "explain":
+            return [r for r in calls if not (r["body"] or {}).get("response_format")]
+        return calls
+
+    def handle(self, method, path, query, headers, body) -> Tuple[int, Dict[str, str], Any]:
+        if method != "POST" or not path.endswith("/chat/completions"):
+            return 404, {}, {"error": {"message": f"Ruta no soportada: {method} {path}"}}
+        if not headers.get("authorization", "").startswith("Bearer "):
+            return 401, {}, {"error": {"message": "Falta la API key"}}
+
+        messages = body.get("messages") or []
+        if body.get("response_format"):
+            question = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+            content = json.dumps(self.sql_responder(question), ensure_ascii=False)
+        else:
+            content = self.explanation
+        usage = self._usage(messages, content)
+
+        if body.get("stream"):
+            return 200, {"Content-Type": "text/event-stream"}, self._stream_body(body, content)
+        return 200, {}, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": usage,
+        }
+
+    def _usage(self, messages: List[Dict[str, Any]], content: str) -> Dict[str, Any]:
+        prompt_tokens = sum(_estimate_tokens(str(m.get("content", ""))) for m in messages)
+        cached = 0
+        if messages:
+            first = str(messages[0].get("content", ""))
+            digest = hashlib.sha256(first.encode("utf-8")).hexdigest()
+            with self._prefix_lock:
+                if digest in self._seen_prefixes:
+                    cached = _estimate_tokens(first)
+                self._seen_prefixes.add(digest)
+        completion_tokens = _estimate_tokens(content)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+
+    def _stream_body(self, body: Dict[str, Any], content: str) -> str:
+        # El servidor arma el stream completo antes de enviarlo; el retraso por chunk se suma a la latencia
+        words = content.split(" ")
+        if self.stream_chunk_delay_ms:
+            time.sleep(self.stream_chunk_delay_ms * len(words) / 1000)
+        chunks = []
+        for i, word in enumerate(words):
+            delta = word if i == 0 else " " + word
+            chunks.append({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+            })
+        lines = [f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n" for chunk in chunks]
+        return "".join(lines) + "data: [DONE]\n\n"
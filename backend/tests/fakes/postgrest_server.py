@@ -0,0 +1,110 @@
+# tests/fakes/postgrest_server.py
+
+import uuid
+import threading
+from typing import Dict, Any, List, Tuple, Optional
+
+from tests.fakes.http_server import FakeHTTPServer
+
+# Clave de upsert (Prefer: resolution=merge-duplicates) por tabla
+_CONFLICT_KEYS = {"active_connections": "user_id"}
+
+
+class FakePostgREST(FakeHTTPServer):
+    """
+    Subconjunto de PostgREST (/rest/v1/<tabla>) suficiente para supabase_service:
+      - filtros col=eq.valor, select=a,b
+      - GET / POST (lista u objeto, upsert con merge-duplicates) / PATCH / DELETE
+      - Prefer: return=representation
+    Exige los headers apikey y Authorization como Supabase.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, api_key: str = "fake-anon-key"):
+        super().__init__(latency_ms, jitter_ms)
+        self.api_key = api_key
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self._data_lock = threading.Lock()
+
+    # --- Datos ---
+    def insert(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        with self._data_lock:
+            return self._insert(table, dict(row))
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        with self._data_lock:
+            return [dict(r) for r in self.tables.get(table, [])]
+
+    def add_connection(self, user_id: str, connection: Dict[str, Any], active: bool = True) -> Dict[str, Any]:
+        """
+        Registra una conexión del usuario (y la deja activa).
+        """
+        row = dict(connection, user_id=user_id)
+        row.setdefault("id", str(uuid.uuid4()))
+        row = self.insert("connections", row)
+        if active:
+            self.insert("active_connections", {"user_id": user_id, "connection_id": row["id"]})
+        return row
+
+    # --- HTTP ---
+    def handle(self, method, path, query, headers, body) -> Tuple[int, Dict[str, str], Any]:
+        if not path.startswith("/rest/v1/"):
+            return 404, {}, {"message": f"Ruta no soportada: {path}"}
+        if headers.get("apikey") != self.api_key or not headers.get("authorization", "").startswith("Bearer "):
+            return 401, {}, {"message": "JWT o apikey inválidos"}
+
+        table = path[len("/rest/v1/"):].strip("/")
+        filters, columns = self._parse_query(query)
+        prefer = headers.get("prefer", "")
+        representation = "return=representation" in prefer
+
+        with self._data_lock:
+            if method == "GET":
+                return 200, {}, [self._project(r, columns) for r in self._select(table, filters)]
+            if method == "POST":
+                payload = body if isinstance(body, list) else [body]
+                merge = "resolution=merge-duplicates" in prefer
+                created = [self._upsert(table, dict(r)) if merge else self._insert(table, dict(r)) for r in payload]
+                return 201, {}, (created if representation else None)
+            if method == "PATCH":
+                matched = self._select(table, filters)
+                for row in matched:
+                    row.update(body or {})
+                return (200 if representation else 204), {}, (list(matched) if representation else None)
+            if method == "DELETE":
+                matched = self._select(table, filters)
+                self.tables[table] = [r for r in self.tables.get(table, []) if r not in matched]
+                return (200 if representation else 204), {}, (matched if representation else None)
+        return 405, {}, {"message": f"Método no soportado: {method}"}
+
+    # --- Internos (con _data_lock tomado) ---
+    @staticmethod
+    def _parse_query(query: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], Optional[List[str]]]:
+        filters, columns = [], None
+        for key, value in query:
+            if key == "select":
+                columns = None if value == "*" else [c.strip() for c in value.split(",") if c.strip()]
+            elif value.startswith("eq."):
+                filters.append((key, value[3:]))
+        return filters, columns
+
+    def _select(self, table: str, filters: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        return [r for r in self.tables.get(table, []) if all(str(r.get(k)) == v for k, v in filters)]
+
+    @staticmethod
+    def _project(row: Dict[str, Any], columns: Optional[List[str]]) -> Dict[str, Any]:
+        return dict(row) if columns is None else {c: row.get(c) for c in columns}
+
+    def _insert(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        if table == "connections":
+            row.setdefault("id", str(uuid.uuid4()))
+        self.tables.setdefault(table, []).append(row)
+        return dict(row)
+
+    def _upsert(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        key = _CONFLICT_KEYS.get(table)
+        if key is not None:
+            for existing in self.tables.get(table, []):
+                if existing.get(key) == row.get(key):
+                    existing.update(row)
+                    return dict(existing)
+        return self._insert(table, row)
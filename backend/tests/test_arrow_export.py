@@ -0,0 +1,146 @@
+# tests/test_arrow_export.py
+#
+# Exportación Arrow/Parquet (app/services/arrow_export.py): el CSV de COPY se relee con los
+# tipos de cursor.description, sin inferir tipos por muestra.
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+
+import os
+from decimal import Decimal
+
+
+def _col(name, type_code, precision=None, scale=None):
+    # (name, type_code, display_size, internal_size, precision, scale, null_ok) como en cursor.description
+    return (name, type_code, None, None, precision, scale, None)
+
+
+DESCRIPTION = [_col("codigo", 25), _col("referencia", 1043), _col("cantidad", 23), _col("monto", 1700, 12, 2),
+               _col("activo", 16), _col("nota", 25), _col("total", 1700)]
+
+
+def _export_csv(tmp_path, csv_text, description=DESCRIPTION):
+    from app.services import arrow_export
+    import pyarrow.ipc as pa_ipc
+
+    csv_path, out_path = tmp_path / "copy.csv", tmp_path / "out.arrow"
+    csv_path.write_text(csv_text, encoding="utf-8")
+    writer = arrow_export._BatchWriter(str(out_path), "arrow")
+    arrow_export._write_copy_csv(str(csv_path), description, writer)
+    with pa_ipc.open_stream(str(out_path)) as reader:
+        return reader.read_all()
+
+
+def test_copy_csv_keeps_text_columns_as_text(offline_env, tmp_path):
+    # Miles de filas "numéricas" antes del "ABC": más que el bloque que pyarrow usa para inferir tipos
+    lines = ["codigo,referencia,cantidad,monto,activo,nota,total"]
+    lines += [f"00{i},{i},{i},{i}.50,t,\"\",{i}.5" for i in range(1, 20_000)]
+    lines.append('00123,ABC,7,1.25,f,,12345678901234567890.123456789')
+    table = _export_csv(tmp_path, "\n".join(lines) + "\n")
+
+    assert table.num_rows == 20_000
+    assert table.schema.field("codigo").type == pa.string()
+    assert table.schema.field("referencia").type == pa.string()
+    assert table.schema.field("cantidad").type == pa.int64()
+    # numeric nunca pasa por float: decimal128 con su typmod, texto exacto si no lo declara
+    assert table.schema.field("monto").type == pa.decimal128(12, 2)
+    assert table.schema.field("total").type == pa.string()
+    assert table.schema.field("activo").type == pa.bool_()
+    last = table.slice(table.num_rows - 1).to_pylist()[0]
+    assert last == {"codigo": "00123", "referencia": "ABC", "cantidad": 7, "monto": Decimal("1.25"), "activo": False,
+                    "nota": None, "total": "12345678901234567890.123456789"}
+    # '' (entre comillas) no es NULL; "NULL" como texto tampoco
+    assert table.column("nota")[0].as_py() == ""
+
+
+def test_copy_csv_with_repeated_names_and_no_rows(offline_env, tmp_path):
+    table = _export_csv(tmp_path, "n,n\nNULL,1\n", [_col("n", 25), _col("n", 23)])
+    assert table.column_names == ["n", "n"]
+    assert [column.to_pylist() for column in table.columns] == [["NULL"], [1]]
+
+    empty = _export_csv(tmp_path, "codigo\n", [_col("codigo", 25)])
+    assert empty.num_rows == 0 and empty.column_names == ["codigo"]
+
+
+def _read(path, fmt):
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pa_parquet
+
+    if fmt == "parquet":
+        return pa_parquet.read_table(path)
+    with pa_ipc.open_stream(path) as reader:
+        return reader.read_all()
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_copy_export_with_all_null_and_mixed_type_columns(offline_env, monkeypatch, fmt):
+    from app.services import arrow_export
+
+    csv_text = 'id,vacio,dato,monto\n1,,1,\n2,,"{""a"": 1}",\n3,,texto,\n'
+
+    def fake_copy(connection, sql_query, fileobj, timeout_ms=None):
+        fileobj.write(csv_text.encode("utf-8"))
+        # int4, int4 siempre nulo, json (sin tipo Arrow) con valores mezclados, numeric siempre nulo
+        return [_col("id", 23), _col("vacio", 23), _col("dato", 114), _col("monto", 1700, 10, 2)]
+
+    monkeypatch.setattr(arrow_export, "EXPORT_USE_COPY", True)
+    monkeypatch.setattr(arrow_export, "copy_query_to_csv", fake_copy)
+    path = arrow_export.export_query_result({"db_type": "postgres"}, "SELECT 1", fmt)
+    try:
+        table = _read(path, fmt)
+    finally:
+        os.remove(path)
+
+    assert table.schema.field("vacio").type == pa.int64()
+    assert table.schema.field("dato").type == pa.string()
+    assert table.schema.field("monto").type == pa.decimal128(10, 2)
+    assert table.to_pydict() == {"id": [1, 2, 3], "vacio": [None] * 3, "dato": ["1", '{"a": 1}', "texto"], "monto": [None] * 3}
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_cursor_export_with_all_null_and_mixed_type_columns(offline_env, monkeypatch, fmt):
+    from app.services import arrow_export
+
+    def fake_iter(connection, sql_query, timeout_ms=None, describe=False):
+        # SQL Server (pyodbc): tipos Python; sql_variant llega sin tipo conocido
+        yield [_col("id", int), _col("vacio", None), _col("variante", None), _col("monto", Decimal, 10, 2)]
+        yield [[1, None, 1, None], [2, None, "a", None]]
+        yield [[3, None, 2.5, Decimal("4.10")]]
+
+    monkeypatch.setattr(arrow_export, "iter_sql_query", fake_iter)
+    path = arrow_export.export_query_result({"db_type": "sqlserver"}, "SELECT 1", fmt)
+    try:
+        table = _read(path, fmt)
+    finally:
+        os.remove(path)
+
+    assert [field.type for field in table.schema] == [pa.int64(), pa.string(), pa.string(), pa.decimal128(10, 2)]
+    assert table.to_pydict() == {"id": [1, 2, 3], "vacio": [None] * 3, "variante": ["1", "a", "2.5"],
+                                 "monto": [None, None, Decimal("4.10")]}
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_failed_export_closes_the_writer_before_removing_the_file(offline_env, monkeypatch, fmt):
+    from app.services import arrow_export
+
+    def fake_iter(connection, sql_query, timeout_ms=None, describe=False):
+        yield [_col("valor", None)]
+        yield [[1], [2]]
+        yield [["no es un número"]]   # el primer lote fijó int64
+
+    writers = []
+
+    class RecordingWriter(arrow_export._BatchWriter):
+        def __init__(self, path, fmt):
+            super().__init__(path, fmt)
+            writers.append(self)
+
+    monkeypatch.setattr(arrow_export, "iter_sql_query", fake_iter)
+    monkeypatch.setattr(arrow_export, "_BatchWriter", RecordingWriter)
+    with pytest.raises((pa.ArrowInvalid, pa.ArrowTypeError)):
+        arrow_export.export_query_result({"db_type": "sqlserver"}, "SELECT 1", fmt)
+
+    writer = writers[0]
+    assert writer.schema is not None and writer._writer is None   # se abrió y se cerró
+    assert not os.path.exists(writer.path)
@@ -0,0 +1,62 @@
+# tests/test_cost_gate.py
+#
+# Control de costo previo a la ejecución (app/services/cost_gate.py) con planes simulados.
+
+import pytest
+
+PG = {"id": "pg-1", "db_type": "postgres", "plan_confirm_cost": 1_000, "plan_max_cost": 100_000}
+
+
+@pytest.fixture
+def gate(offline_env, monkeypatch):
+    from app.services import cost_gate
+
+    plans = {}
+    monkeypatch.setattr(cost_gate, "get_query_plan_summary", lambda connection, sql: plans.get(sql.strip()))
+    monkeypatch.setattr(cost_gate, "_plans", type(cost_gate._plans)())
+    return cost_gate, plans
+
+
+def test_limit_sql_per_engine(offline_env):
+    from app.services.cost_gate import limit_sql
+
+    assert limit_sql("SELECT * FROM ventas -- todo\n;", 11, "postgres") == "SELECT * FROM (\nSELECT * FROM ventas -- todo\n) AS uq_limited LIMIT 11"
+    assert limit_sql("select distinct region from ventas", 11, "sqlserver") == "select distinct TOP (11) region from ventas"
+    assert limit_sql("SELECT TOP 5 * FROM ventas", 11, "sqlserver") is None
+    assert limit_sql("WITH x AS (SELECT 1) SELECT * FROM x", 11, "sqlserver") is None
+
+
+def test_cheap_query_runs_unchanged(gate):
+    cost_gate, plans = gate
+    plans["SELECT 1"] = {"estimated_rows": 1, "estimated_cost": 0.01}
+
+    sql, plan = cost_gate.check_query_cost(PG, "SELECT 1", row_budget=100)
+    assert sql == "SELECT 1"
+    assert plan["action"] == "ok"
+
+
+def test_large_result_is_limited_to_the_row_budget(gate):
+    cost_gate, plans = gate
+    sql = "SELECT * FROM ventas v CROSS JOIN ventas w"
+    limited = cost_gate.limit_sql(sql, 101, "postgres")
+    plans[sql] = {"estimated_rows": 4_000_000, "estimated_cost": 500_000}
+    plans[limited] = {"estimated_rows": 101, "estimated_cost": 12}
+
+    run_sql, plan = cost_gate.check_query_cost(PG, sql, row_budget=100)
+    assert run_sql == limited
+    assert plan == {"estimated_rows": 4_000_000, "estimated_cost": 500_000, "action": "limited", "limited_to": 100, "limited_cost": 12}
+
+
+def test_expensive_query_needs_confirmation_or_is_rejected(gate):
+    cost_gate, plans = gate
+    plans["SELECT region, SUM(monto) FROM ventas GROUP BY region"] = {"estimated_rows": 5, "estimated_cost": 5_000}
+    plans["SELECT region, COUNT(DISTINCT producto) FROM ventas GROUP BY region"] = {"estimated_rows": 5, "estimated_cost": 900_000}
+
+    with pytest.raises(cost_gate.QueryNeedsConfirmationError) as exc:
+        cost_gate.check_query_cost(PG, "SELECT region, SUM(monto) FROM ventas GROUP BY region", row_budget=100)
+    assert exc.value.plan["action"] == "needs_confirmation"
+    _, plan = cost_gate.check_query_cost(PG, "SELECT region, SUM(monto) FROM ventas GROUP BY region", row_budget=100, confirmed=True)
+    assert plan["action"] == "confirmed"
+
+    with pytest.raises(cost_gate.QueryCostRejectedError):
+        cost_gate.check_query_cost(PG, "SELECT region, COUNT(DISTINCT producto) FROM ventas GROUP BY region", row_budget=100, confirmed=True)
@@ -0,0 +1,148 @@
+# tests/test_db_pool.py
+#
+# Pool de conexiones a las bases de los usuarios (app/services/db_pool.py) con una fábrica falsa:
+# checkout/devolución, rollback al devolver, health check, limpieza de inactivas e invalidación.
+
+import threading
+
+import pytest
+
+
+class OperationalError(Exception):
+    """Mismo nombre que la excepción DB-API de psycopg2/pyodbc."""
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = 0
+        self.dead = False
+        self.rollbacks = 0
+        self.pings = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        if self.dead:
+            raise OperationalError("server closed the connection unexpectedly")
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql):
+        if self.conn.dead:
+            raise OperationalError("server closed the connection unexpectedly")
+        self.conn.pings += 1
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+class Factory:
+    def __init__(self):
+        self.created = []
+
+    def __call__(self):
+        conn = FakeConnection(len(self.created) + 1)
+        self.created.append(conn)
+        return conn
+
+
+@pytest.fixture
+def db_pool(offline_env):
+    from app.services import db_pool
+
+    return db_pool
+
+
+def test_checkout_reuses_the_connection_and_rolls_back_on_release(db_pool):
+    factory = Factory()
+    pool = db_pool.ConnectionPool(factory, max_size=2)
+    entry = pool.acquire()
+    pool.release(entry)
+    assert entry.conn.rollbacks == 1 and pool.size == 1
+
+    again = pool.acquire()
+    assert again is entry and len(factory.created) == 1
+    assert entry.conn.pings == 1  # health check en cada checkout por defecto
+    pool.release(again)
+
+
+def test_dead_idle_connection_is_replaced_without_an_error(db_pool):
+    factory = Factory()
+    pool = db_pool.ConnectionPool(factory, max_size=1)
+    pool.release(pool.acquire())
+    factory.created[0].dead = True  # el servidor cerró la sesión mientras estaba inactiva
+
+    entry = pool.acquire()
+    assert entry.conn.number == 2 and factory.created[0].closed
+    pool.release(entry)
+    assert pool.size == 1
+
+
+def test_failed_rollback_discards_and_a_full_pool_times_out(db_pool):
+    factory = Factory()
+    pool = db_pool.ConnectionPool(factory, max_size=1)
+    entry = pool.acquire()
+    with pytest.raises(Exception, match="Tiempo de espera agotado"):
+        pool.acquire(timeout=0.05)
+    entry.conn.dead = True
+    pool.release(entry)
+    assert entry.conn.closed and pool.size == 0
+
+    # El cupo liberado desbloquea a quien esperaba
+    first = pool.acquire()
+    waiter = threading.Thread(target=lambda: pool.release(pool.acquire(timeout=5)))
+    waiter.start()
+    pool.release(first)
+    waiter.join(5)
+    assert not waiter.is_alive() and pool.size == 1
+
+
+def test_idle_reaper_respects_min_size(db_pool):
+    factory = Factory()
+    pool = db_pool.ConnectionPool(factory, min_size=1, max_size=3, idle_timeout=0)
+    entries = [pool.acquire() for _ in range(3)]
+    for entry in entries:
+        pool.release(entry)
+    assert pool.evict_idle() == 2
+    assert pool.size == 1 and sum(c.closed for c in factory.created) == 2
+
+
+def test_manager_keys_pools_by_credentials_and_invalidates(db_pool):
+    manager = db_pool.PoolManager()
+    factory = Factory()
+    connection = {"id": "c1", "db_type": "postgres", "host": "h", "username": "u", "password": "p1"}
+
+    with manager.connection(connection, factory) as conn:
+        first = conn
+    with manager.connection(connection, factory) as conn:
+        assert conn is first
+
+    # Conexión editada (otra password): pool nuevo y el anterior se cierra
+    with manager.connection(dict(connection, password="p2"), factory) as conn:
+        assert conn is not first
+        second = conn
+    assert first.closed
+
+    # Un error de conexión dentro del bloque descarta la conexión
+    with pytest.raises(OperationalError):
+        with manager.connection(dict(connection, password="p2"), factory):
+            raise OperationalError("terminating connection due to administrator command")
+    assert second.closed
+
+    with manager.connection(dict(connection, password="p2"), factory) as conn:
+        third = conn
+    manager.invalidate("c1")
+    assert third.closed and not manager._pools
+    manager.close_all()
@@ -0,0 +1,74 @@
+# tests/test_intent_engine.py
+#
+# Intenciones resueltas sin LLM (app/services/intent_engine.py): preguntas clásicas (columnas,
+# conteos) y plantillas que requieren el catálogo cacheado.
+
+import pytest
+
+CATALOG = [{
+    "schema": "public",
+    "name": "ventas",
+    "kind": "table",
+    "columns": [
+        {"name": "id", "type": "integer"},
+        {"name": "region", "type": "text"},
+        {"name": "monto", "type": "numeric"},
+        {"name": "fecha", "type": "date"},
+    ],
+    "references": [],
+}]
+
+
+@pytest.fixture
+def intent_engine(offline_env):
+    from app.services import intent_engine
+
+    return intent_engine
+
+
+def test_classic_questions_use_the_named_or_selected_table(intent_engine):
+    meta = intent_engine.match_intent("¿Cuáles son las columnas de la tabla clientes?", "postgres", track=False)
+    assert meta["intent"] == "list_columns" and meta["table_name"] == "clientes"
+    assert "information_schema.columns" in meta["sql_query"]
+
+    meta = intent_engine.match_intent("¿Cuántas columnas tiene?", "sqlserver", "ventas", track=False)
+    assert meta["intent"] == "count_columns" and "INFORMATION_SCHEMA.COLUMNS" in meta["sql_query"]
+
+    # La tabla seleccionada viene del usuario: va como literal escapado
+    meta = intent_engine.match_intent("¿Cuáles son las columnas?", "postgres", "x' OR '1'='1", track=False)
+    assert "table_name = 'x'' OR ''1''=''1' ORDER BY" in meta["sql_query"]
+
+    # Sin tabla nombrada ni seleccionada no hay plantilla
+    assert intent_engine.match_intent("¿Cuántas columnas tiene?", "postgres", track=False) is None
+
+
+def test_row_count_is_approximate_unless_asked(intent_engine):
+    approx = intent_engine.match_intent("¿Cuántos registros hay?", "postgres", "ventas", track=False)
+    exact = intent_engine.match_intent("¿Cuántos registros hay?", "postgres", "ventas", catalog=CATALOG, exact_count=True, track=False)
+    assert (approx["count_mode"], exact["count_mode"]) == ("approx", "exact")
+    assert exact["sql_query"] == 'SELECT COUNT(*) FROM "public"."ventas";' and "COUNT(*)" not in approx["sql_query"]
+    # El conteo exacto solo se arma para tablas del catálogo: el nombre puede venir del usuario
+    assert intent_engine.match_intent("¿Cuántos registros hay?", "postgres", "ventas; DROP TABLE ventas",
+                                      catalog=CATALOG, exact_count=True, track=False) is None
+    assert intent_engine.match_intent("¿Cuántos registros hay?", "postgres", "ventas", exact_count=True, track=False) is None
+    # Con fechas es un conteo filtrado: no es el total de la tabla
+    meta = intent_engine.match_intent("¿Cuántos registros hay entre 2024-01-01 y 2024-01-31?", "postgres", "ventas",
+                                      catalog=CATALOG, track=False)
+    assert meta["intent"] == "date_range" and meta["range_kind"] == "count"
+
+
+def test_catalog_templates_resolve_table_and_column(intent_engine):
+    meta = intent_engine.match_intent("top 5 ventas con mayor monto", "postgres", catalog=CATALOG, track=False)
+    assert meta["intent"] == "top_n" and (meta["column_name"], meta["order"], meta["limit"]) == ("monto", "DESC", 5)
+
+    meta = intent_engine.match_intent("promedio de monto en ventas", "sqlserver", catalog=CATALOG, track=False)
+    assert meta["intent"] == "aggregate" and "AVG(CAST([monto] AS FLOAT))" in meta["sql_query"]
+
+    meta = intent_engine.match_intent("valores distintos de region en ventas", "postgres", catalog=CATALOG, track=False)
+    assert meta["intent"] == "distinct" and meta["distinct_kind"] == "values"
+
+
+def test_questions_with_unknown_words_go_to_the_llm(intent_engine):
+    assert intent_engine.match_intent("top 5 ventas con mayor monto por cada vendedor", "postgres", catalog=CATALOG, track=False) is None
+    # Las plantillas nuevas requieren el catálogo
+    assert intent_engine.match_intent("top 5 ventas con mayor monto", "postgres", track=False) is None
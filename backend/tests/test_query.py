@@ -0,0 +1,296 @@
+# tests/test_query.py
+#
+# Pipeline de /human_query contra los dobles locales (tests/fakes): sin OpenAI, Supabase ni red.
+# Los tests end-to-end necesitan un Postgres local (TEST_POSTGRES_DSN o initdb/pg_ctl en el PATH).
+
+import uuid
+import asyncio
+
+import openai
+from fastapi.testclient import TestClient
+
+from tests.fakes import make_jwt
+
+
+def _auth(user_id: str) -> dict:
+    return {"Authorization": f"Bearer {make_jwt(user_id)}"}
+
+
+# --- Dobles ---
+
+def test_fake_openai_answers_sql_and_reports_cached_prefix(offline_env, fake_openai):
+    from app.services.prompt_builder import build_sql_messages, cached_prompt_tokens
+
+    client = openai.OpenAI(api_key="sk-fake", base_url=fake_openai.base_url)
+    messages = build_sql_messages("ventas por región", "Tabla: ventas\n  - monto (numeric)", today="01/01/2026")
+    first = client.chat.completions.create(model="gpt-4o", messages=messages, response_format={"type": "json_object"})
+    second = client.chat.completions.create(model="gpt-4o", messages=messages, response_format={"type": "json_object"})
+
+    assert "sql_query" in first.choices[0].message.content
+    assert cached_prompt_tokens(first.usage) == 0
+    assert cached_prompt_tokens(second.usage) > 0
+
+
+def _wide_catalog(n_tables: int = 30):
+    domains = ["clientes", "facturas", "productos", "proveedores", "empleados", "sucursales"]
+    return [
+        {
+            "schema": "public",
+            "name": f"{domains[i % len(domains)]}_{i}",
+            "kind": "table",
+            "columns": [{"name": "id", "type": "integer"}, {"name": f"{domains[i % len(domains)]}_monto", "type": "numeric"}],
+            "references": [],
+        }
+        for i in range(n_tables)
+    ]
+
+
+def test_pruned_schema_keeps_the_cached_prefix_across_questions(offline_env, fake_openai, monkeypatch):
+    from app.services import schema_index
+    from app.services.db_connector import render_schema
+    from app.services.prompt_builder import build_sql_messages, cached_prompt_tokens
+
+    catalog = _wide_catalog()
+    entry = {"key": "conn-wide", "schema": render_schema(catalog, "postgres"), "catalog": catalog, "fingerprint": "f1"}
+    monkeypatch.setattr(schema_index, "get_schema_entry", lambda connection: entry)
+    monkeypatch.setattr(schema_index, "SCHEMA_PROMPT_CACHE_LAYOUT", True)
+    connection = {"id": "conn-wide", "db_type": "postgres"}
+
+    client = openai.OpenAI(api_key="sk-fake", base_url=fake_openai.base_url)
+    usages, hints = [], []
+    for question in ("total de facturas por mes", "proveedores con más productos"):
+        schema, relevant = schema_index.get_prompt_schema(connection, question)
+        assert schema == entry["schema"]
+        hints.append(relevant)
+        messages = build_sql_messages(question, schema, today="01/01/2026", relevant_tables=relevant)
+        assert "<tablas_relevantes>" in messages[1]["content"]
+        usages.append(client.chat.completions.create(model="gpt-4o", messages=messages).usage)
+
+    assert hints[0] != hints[1]
+    assert cached_prompt_tokens(usages[1]) > 0
+
+    # Sin el layout de cache se vuelve al recorte en el propio esquema
+    monkeypatch.setattr(schema_index, "SCHEMA_PROMPT_CACHE_LAYOUT", False)
+    schema, relevant = schema_index.get_prompt_schema(connection, "total de facturas por mes")
+    assert relevant is None and "proveedores_3" not in schema and "facturas_1" in schema
+
+
+def test_fake_openai_streams_explanation(offline_env, fake_openai):
+    client = openai.OpenAI(api_key="sk-fake", base_url=fake_openai.base_url)
+    stream = client.chat.completions.create(
+        model="gpt-4o", messages=[{"role": "system", "content": "explica"}], stream=True
+    )
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in stream)
+    assert text == fake_openai.explanation
+
+
+def test_llm_client_retries_rate_limited_requests(offline_env, fake_openai):
+    from app.services.llm_client import LLMClient
+
+    async def run():
+        client = LLMClient(max_concurrency=2)
+        try:
+            fake_openai.fail_next(429, count=1, headers={"Retry-After": "0"})
+            response = await client.chat_completion(model="gpt-4o", messages=[{"role": "system", "content": "explica"}])
+            return client.retries, response.choices[0].message.content
+        finally:
+            await client.close()
+
+    retries, content = asyncio.run(run())
+    assert retries == 1
+    assert content == fake_openai.explanation
+
+
+def test_fake_postgrest_serves_active_connection(offline_env, fake_postgrest):
+    from app.services.supabase_service import get_active_connection_for_user
+
+    user_id = str(uuid.uuid4())
+    stored = fake_postgrest.add_connection(user_id, {"name": "demo", "db_type": "postgres", "host": "localhost"})
+
+    connection = get_active_connection_for_user(user_id, make_jwt(user_id))
+    assert connection["id"] == stored["id"]
+    assert get_active_connection_for_user(str(uuid.uuid4()), make_jwt()) is None
+
+
+def test_app_imports_without_live_services(offline_env):
+    from app.main import app
+
+    # Sin el context manager: el shutdown de la app cerraría los executors compartidos por los demás tests
+    assert TestClient(app).get("/health").json() == {"status": "ok"}
+
+
+def test_human_query_batch_survives_an_unexpected_error(offline_env, monkeypatch):
+    import json
+    from app.main import app
+    from app.routers import queries
+
+    async def fake_generate(request, fastapi_request, user, query_log_data, connection=None, llm_slot=None):
+        return {"info": f"hola: {request.question}"}
+
+    def fake_log(query_log_data):
+        if query_log_data["question"] == "falla":
+            raise RuntimeError("driver caído")
+        return 1
+
+    monkeypatch.setattr(queries, "get_active_connection_for_user", lambda user_id, jwt: {"id": "c1", "db_type": "postgres"})
+    monkeypatch.setattr(queries, "get_schema_entry", lambda connection: None)
+    monkeypatch.setattr(queries, "_generate_sql_stage", fake_generate)
+    monkeypatch.setattr(queries, "log_query_attempt", fake_log)
+
+    resp = TestClient(app).post("/human_query/batch", json={"questions": ["hola", "falla", "buenas"]}, headers=_auth(str(uuid.uuid4())))
+
+    assert resp.status_code == 200, resp.text
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    by_index = {line["index"]: line for line in lines[:-1]}
+    assert sorted(by_index) == [0, 1, 2]
+    assert by_index[1]["status"] == 500 and "driver" not in by_index[1]["detail"]
+    assert by_index[0]["status"] == by_index[2]["status"] == 200
+    assert lines[-1] == {**lines[-1], "done": True, "ok": 2, "failed": 1}
+
+
+def test_human_query_batch_items_report_how_much_was_cut_off(offline_env, monkeypatch):
+    import json
+    from app.main import app
+    from app.routers import queries
+
+    plan = {"action": "limited", "estimated_rows": 250_000, "estimated_cost": 9_000.0}
+
+    async def fake_generate(request, fastapi_request, user, query_log_data, connection=None, llm_slot=None):
+        return {"info": None, "sql_query": "SELECT * FROM ventas", "llm_json": {"model": "gpt-4o", "message": "Ventas."},
+                "timings": {}}
+
+    async def fake_execute(ctx, request, fastapi_request, query_log_data):
+        ctx.update(columns=["id"], rows=[[1], [2]], exec_time=1.0, count_mode=None, plan=plan,
+                   exec_meta={"truncated": True, "approx_total_rows": 250_000, "cache_hit": False})
+
+    async def fake_log_and_cache(ctx, request, query_log_data):
+        return 7
+
+    monkeypatch.setattr(queries, "get_active_connection_for_user", lambda user_id, jwt: {"id": "c1", "db_type": "postgres"})
+    monkeypatch.setattr(queries, "get_schema_entry", lambda connection: None)
+    monkeypatch.setattr(queries, "_generate_sql_stage", fake_generate)
+    monkeypatch.setattr(queries, "_execute_stage", fake_execute)
+    monkeypatch.setattr(queries, "_log_and_cache_stage", fake_log_and_cache)
+
+    resp = TestClient(app).post("/human_query/batch", json={"questions": ["ventas"], "max_rows": 2}, headers=_auth(str(uuid.uuid4())))
+
+    assert resp.status_code == 200, resp.text
+    item = json.loads(resp.text.splitlines()[0])
+    assert item["truncated"] is True and item["approx_total_rows"] == 250_000
+    assert item["approximate_count"] is None and item["plan"] == plan
+
+
+def test_human_query_stream_ends_with_an_error_event_on_unexpected_failures(offline_env, monkeypatch):
+    from app.main import app
+    from app.routers import queries
+
+    async def fake_generate(request, fastapi_request, user, query_log_data, connection=None, llm_slot=None):
+        return {"info": "hola"}
+
+    def fake_log(query_log_data):
+        raise RuntimeError("driver caído")
+
+    monkeypatch.setattr(queries, "_generate_sql_stage", fake_generate)
+    monkeypatch.setattr(queries, "log_query_attempt", fake_log)
+
+    resp = TestClient(app).post("/human_query/stream", json={"question": "hola"}, headers=_auth(str(uuid.uuid4())))
+
+    assert resp.status_code == 200, resp.text
+    events = [block.split("\n")[0] for block in resp.text.strip().split("\n\n")]
+    assert events == ["event: stage", "event: error"]
+    assert '"status": 500' in resp.text and "driver" not in resp.text
+
+
+def test_logged_sql_reruns_only_on_its_connection_with_deadline_and_cost_gate(offline_env, monkeypatch):
+    from app.main import app
+    from app.routers import queries
+    from app.services import cost_gate
+    from app.services.db_connector import QueryTimeoutError
+
+    user_id = str(uuid.uuid4())
+    log = {"user_id": user_id, "sql_generated": "SELECT * FROM ventas", "connection_id": "c1"}
+    active = {"id": "c2", "db_type": "postgres", "statement_timeout_ms": 1500}
+    plans = {}
+    calls = []
+
+    def fake_iter(connection, sql, timeout_ms=None):
+        calls.append((connection["id"], timeout_ms))
+        raise QueryTimeoutError("superó el tiempo máximo")
+        yield
+
+    monkeypatch.setattr(queries, "get_query_log", lambda log_id: log)
+    monkeypatch.setattr(queries, "get_active_connection_for_user", lambda user_id, jwt: active)
+    monkeypatch.setattr(queries, "iter_sql_query", fake_iter)
+    monkeypatch.setattr(cost_gate, "get_query_plan_summary", lambda connection, sql: plans.get(connection["id"]))
+    monkeypatch.setattr(cost_gate, "_plans", type(cost_gate._plans)())
+    client = TestClient(app)
+
+    # Otra conexión activa: no se ejecuta el SQL viejo sobre una base distinta
+    resp = client.get("/human_query/logs/3/stream", headers=_auth(user_id))
+    assert resp.status_code == 409 and calls == []
+
+    # Misma conexión: control de costo y deadline de la conexión
+    active["id"] = "c1"
+    plans["c1"] = {"estimated_rows": 10, "estimated_cost": 5e9}
+    resp = client.get("/human_query/logs/3/stream", headers=_auth(user_id))
+    assert resp.status_code == 422 and calls == []
+
+    plans["c1"] = {"estimated_rows": 10, "estimated_cost": 10}
+    cost_gate._plans.clear()
+    resp = client.get("/human_query/logs/4/stream", headers=_auth(user_id))
+    assert resp.status_code == 504
+    assert calls == [("c1", 1500)]
+
+
+# --- End-to-end (requiere Postgres local) ---
+
+def test_human_query_end_to_end(offline_env, fake_openai, fake_postgrest, local_postgres):
+    from app.main import app
+
+    user_id = str(uuid.uuid4())
+    fake_postgrest.add_connection(user_id, local_postgres.connection_record())
+    sql_calls = len(fake_openai.completions("sql"))
+
+    resp = TestClient(app).post("/human_query/", json={"question": "¿Cuál es el total de ventas por región?"}, headers=_auth(user_id))
+
+    assert resp.status_code == 200, resp.text
+    body = resp.json()
+    assert body["columns"] == ["region", "total"]
+    assert len(body["rows"]) == 5
+    assert body["query_log_id"] is not None
+    assert len(fake_openai.completions("sql")) == sql_calls + 1
+    timing = resp.headers["server-timing"]
+    for stage in ("connection", "llm_sql", "db", "total"):
+        assert f"{stage};dur=" in timing
+
+
+def test_human_query_intent_skips_llm(offline_env, fake_openai, fake_postgrest, local_postgres):
+    from app.main import app
+
+    user_id = str(uuid.uuid4())
+    fake_postgrest.add_connection(user_id, local_postgres.connection_record())
+    calls = len(fake_openai.completions())
+
+    resp = TestClient(app).post("/human_query/", json={"question": "cuántos registros tiene la tabla ventas", "exact_count": True}, headers=_auth(user_id))
+
+    assert resp.status_code == 200, resp.text
+    assert "2.000" in resp.json()["answer"]
+    assert len(fake_openai.completions()) == calls
+
+
+def test_human_query_batch_streams_each_question(offline_env, fake_openai, fake_postgrest, local_postgres):
+    import json
+    from app.main import app
+
+    user_id = str(uuid.uuid4())
+    fake_postgrest.add_connection(user_id, local_postgres.connection_record())
+    questions = ["¿Cuál es el total de ventas por región?", "cuántos registros tiene la tabla ventas", "top 5 ventas por monto"]
+
+    resp = TestClient(app).post("/human_query/batch", json={"questions": questions, "exact_count": True}, headers=_auth(user_id))
+
+    assert resp.status_code == 200, resp.text
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    items, summary = lines[:-1], lines[-1]
+    assert sorted(item["index"] for item in items) == [0, 1, 2]
+    assert all(item["status"] == 200 and item["query_log_id"] is not None for item in items)
+    assert summary == {**summary, "done": True, "ok": 3, "failed": 0}
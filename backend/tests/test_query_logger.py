@@ -0,0 +1,154 @@
+# tests/test_query_logger.py
+#
+# Escritor diferido de query_logs (app/services/query_logger.py): lotes, IDs prefetcheados,
+# lectura de logs aún encolados y respaldo en disco cuando la base de logs no responde.
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+
+@pytest.fixture
+def writer(offline_env, tmp_path, monkeypatch):
+    from app.services import query_logger
+
+    monkeypatch.setattr(query_logger, "QUERY_LOG_FLUSH_INTERVAL", 0.01)
+    monkeypatch.setattr(query_logger, "QUERY_LOG_RETRY_INTERVAL", 0.0)
+    w = query_logger.QueryLogWriter()
+    w.spill_path = str(tmp_path / "query_logs.jsonl")
+    written = []
+    monkeypatch.setattr(w, "_execute", lambda inserts, updates: written.append((inserts, updates)))
+    monkeypatch.setattr(w, "_refill_ids", lambda: None)
+    yield w, written
+    w.stop()
+
+
+def test_ids_are_assigned_up_front_and_updates_fold_into_the_insert(writer, monkeypatch):
+    w, written = writer
+    monkeypatch.setattr(w, "_ensure_started", lambda: None)  # el lote se escribe a mano
+    w._ids.extend([41, 42])
+
+    log_id = w.submit_insert({"question": "ventas por mes", "user_id": "u1"})
+    w.submit_update(log_id, {"llm_final_answer": "Las ventas suben."})
+    w.submit_update(7, {"feedback": 1})
+
+    assert log_id == 41
+    assert w.pending(41)["llm_final_answer"] == "Las ventas suben."
+    batch = [w._queue.get_nowait() for _ in range(3)]
+    assert w._write(batch)
+    assert written == [(
+        [{"question": "ventas por mes", "user_id": "u1", "id": 41, "llm_final_answer": "Las ventas suben."}],
+        [{"feedback": 1, "id": 7}],
+    )]
+    assert w.pending(41) is None
+
+
+def test_unavailable_log_database_spills_to_disk_and_replays(writer, monkeypatch):
+    w, written = writer
+
+    def down(inserts, updates):
+        raise OperationalError("INSERT", {}, Exception("connection refused"))
+
+    monkeypatch.setattr(w, "_execute", down)
+    assert w.submit_insert({"question": "q1"}) is None  # sin IDs: la base de logs no responde
+    assert w.flush(5)
+    assert w.stats()["spilled"] == 1
+
+    monkeypatch.setattr(w, "_execute", lambda inserts, updates: written.append((inserts, updates)))
+    w._replay_spill()
+    assert [record["question"] for inserts, _ in written for record in inserts] == ["q1"]
+    assert not w.stats()["spill_file"]
+
+
+def test_update_of_a_spilled_insert_follows_it_to_disk(writer, monkeypatch):
+    w, written = writer
+    monkeypatch.setattr(w, "_ensure_started", lambda: None)
+    w._ids.extend([51])
+
+    def down(inserts, updates):
+        raise OperationalError("INSERT", {}, Exception("connection refused"))
+
+    log_id = w.submit_insert({"question": "ventas por mes"})
+    monkeypatch.setattr(w, "_execute", down)
+    batch = [w._queue.get_nowait()]
+    assert not w._write(batch)
+    w._spill(batch)
+
+    # La base vuelve antes del reintento: la explicación y el feedback no deben ir a la base todavía
+    monkeypatch.setattr(w, "_execute", lambda inserts, updates: written.append((inserts, updates)))
+    w.submit_update(log_id, {"llm_final_answer": "Las ventas suben."})
+    w.submit_update(log_id, {"feedback": 1})
+    assert w._queue.empty()
+
+    w._replay_spill()
+    rows = {}
+    for inserts, updates in written:
+        for record in inserts:
+            rows[record["id"]] = dict(record)
+        for data in updates:
+            rows[data["id"]].update(data)
+    assert rows == {51: {"id": 51, "question": "ventas por mes", "llm_final_answer": "Las ventas suben.", "feedback": 1}}
+
+    # Ya escrito: los siguientes UPDATE vuelven a la cola
+    w.submit_update(log_id, {"feedback_comment": "bien"})
+    assert w._queue.get_nowait() == ("update", {"feedback_comment": "bien", "id": 51})
+
+
+def test_update_queued_before_its_insert_spilled_is_diverted(writer, monkeypatch):
+    w, written = writer
+    monkeypatch.setattr(w, "_ensure_started", lambda: None)
+    w._ids.extend([61])
+
+    log_id = w.submit_insert({"question": "top clientes"})
+    first = [w._queue.get_nowait()]
+    w.submit_update(log_id, {"feedback": -1})
+    w._spill(first)  # el INSERT falló y se respaldó con el UPDATE ya en la cola
+
+    assert w._write([w._queue.get_nowait()])
+    assert written == []
+    w._replay_spill()
+    assert written == [([{"question": "top clientes", "id": 61, "feedback": -1}], [])]
+
+
+def test_id_refill_never_runs_on_the_request_path(writer, monkeypatch):
+    from app.services import query_logger
+
+    w, _ = writer
+    monkeypatch.setattr(w, "_ensure_started", lambda: None)
+    monkeypatch.setattr(query_logger, "QUERY_LOG_ID_LOW_WATER", 2)
+    refills = []
+    monkeypatch.setattr(w, "_refill_ids", lambda: refills.append(True))
+    w._ids.extend([71, 72, 73])
+
+    assert w.submit_insert({"question": "q1"}) == 71
+    assert not w._ids_wanted.is_set()
+    assert w.submit_insert({"question": "q2"}) == 72   # queda 1 < 2: se pide otro bloque
+    assert w._ids_wanted.is_set()
+    assert w.submit_insert({"question": "q3"}) == 73
+    # Sin IDs: el log se encola sin ID (lo asigna la base) en vez de esperar la reserva
+    assert w.submit_insert({"question": "q4"}) is None
+    assert refills == []
+    assert [data.get("id") for _, data in (w._queue.get_nowait() for _ in range(4))] == [71, 72, 73, None]
+
+
+def test_background_thread_refills_ids_below_the_low_water_mark(writer, monkeypatch):
+    import threading
+    from app.services import query_logger
+
+    w, _ = writer
+    monkeypatch.setattr(query_logger, "QUERY_LOG_ID_LOW_WATER", 2)
+    refilled = threading.Event()
+
+    def refill():
+        with w._ids_lock:
+            w._ids.extend([81, 82, 83])
+        refilled.set()
+
+    monkeypatch.setattr(w, "_refill_ids", refill)
+    w.start()
+    assert refilled.wait(5)  # el primer bloque se reserva al arrancar
+    assert w._next_id() == 81
+
+    refilled.clear()
+    assert w._next_id() == 82   # queda 1: el hilo de IDs repone sin que la petición espere
+    assert refilled.wait(5)
+    assert list(w._ids) == [83, 81, 82, 83]
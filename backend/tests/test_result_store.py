@@ -0,0 +1,115 @@
+# tests/test_result_store.py
+#
+# Retención de resultados (app/services/result_store.py): vista previa + sha256 en query_logs
+# y el resultado completo, una sola vez por contenido, en el almacén comprimido.
+
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def store(offline_env, tmp_path, monkeypatch):
+    from app.services import result_store
+
+    blob_store = result_store.ResultBlobStore(str(tmp_path))
+    monkeypatch.setattr(result_store, "result_blob_store", blob_store)
+    monkeypatch.setattr(result_store, "RESULT_PREVIEW_ROWS", 3)
+    return result_store, blob_store
+
+
+def test_large_result_keeps_a_preview_and_the_full_payload_once(store):
+    result_store, blob_store = store
+    columns, rows = ["region", "total"], [[f"r{i}", i * 10] for i in range(10)]
+
+    first = result_store.retain_result(columns, rows)
+    second = result_store.retain_result(columns, [list(r) for r in rows])
+
+    assert first["sql_raw_result"] == rows[:3]
+    assert first["result_sha256"] == second["result_sha256"]
+    assert first["result_blob_codec"] == blob_store.codec
+    assert (blob_store.writes, blob_store.dedup_hits) == (1, 1)
+    assert json.loads(blob_store.get(first["result_sha256"])) == {"columns": columns, "rows": rows}
+
+
+def test_small_result_and_full_retention_skip_the_blob(store, monkeypatch):
+    result_store, blob_store = store
+
+    small = result_store.retain_result(["n"], [[1], [2]])
+    assert small["sql_raw_result"] == [[1], [2]] and small["result_blob_codec"] is None
+
+    monkeypatch.setattr(result_store, "RESULT_RETENTION", "full")
+    assert result_store.retain_result(["n"], [[i] for i in range(10)]) == {"sql_raw_result": [[i] for i in range(10)]}
+    assert blob_store.writes == 0
+
+
+def test_corrupted_blob_is_not_served(store):
+    result_store, blob_store = store
+    digest = result_store.retain_result(["n"], [[i] for i in range(10)])["result_sha256"]
+    path, _ = blob_store.find(digest)
+    os.remove(path)
+    blob_store.put(digest, b'{"columns":["n"],"rows":[]}')  # mismo nombre, otro contenido
+
+    assert blob_store.get(digest) is None
+
+
+def test_sweep_drops_expired_blobs_then_least_recently_used_over_the_cap(store, monkeypatch):
+    import time
+    result_store, blob_store = store
+    digests = [result_store.retain_result(["n"], [[i, k] for i in range(10)])["result_sha256"] for k in range(3)]
+    paths = [blob_store.find(d)[0] for d in digests]
+    now = time.time()
+    os.utime(paths[0], (now - 40 * 86400, now - 40 * 86400))   # sin uso hace 40 días
+    os.utime(paths[1], (now - 3600, now - 3600))
+    os.utime(paths[2], (now - 7200, now - 7200))
+    blob_store.get(digests[2])   # leerlo lo vuelve el más reciente
+
+    # Cabe un solo blob: además del vencido se borra el menos usado
+    monkeypatch.setattr(result_store, "RESULT_BLOB_DIR_MAX_BYTES", os.path.getsize(paths[2]) + 1)
+    assert blob_store.sweep() == 2
+    assert [blob_store.find(d) is not None for d in digests] == [False, False, True]
+    assert blob_store.stats()["evicted"] == 2
+
+
+def test_writes_trigger_a_sweep_off_the_request_path(store, monkeypatch):
+    result_store, blob_store = store
+    monkeypatch.setattr(result_store, "RESULT_BLOB_SWEEP_INTERVAL", 0)
+    monkeypatch.setattr(result_store, "RESULT_BLOB_TTL_DAYS", 0)
+    monkeypatch.setattr(result_store, "RESULT_BLOB_DIR_MAX_BYTES", 1)
+
+    logged = result_store.retain_result(["n"], [[i] for i in range(10)])
+
+    # El blob se guardó y el barrido posterior lo borró: el log conserva la vista previa y el hash
+    assert logged["result_blob_codec"] == blob_store.codec
+    assert blob_store.get(logged["result_sha256"]) is None
+    assert blob_store.stats()["evicted"] == 1
+
+
+def test_deferred_explanation_uses_the_logged_row_count(offline_env, monkeypatch):
+    import uuid
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.routers import queries
+    from tests.fakes import make_jwt
+
+    user_id = str(uuid.uuid4())
+    log = {
+        "user_id": user_id, "question": "ventas", "sql_generated": "SELECT * FROM ventas",
+        "columns": ["id"], "sql_raw_result": [[1], [2], [3]], "row_count": 500, "llm_final_answer": None,
+    }
+    seen = {}
+
+    async def failing_explain(**kwargs):
+        seen.update(kwargs)
+        raise RuntimeError("LLM caído")
+
+    monkeypatch.setattr(queries, "get_query_log", lambda log_id: log)
+    monkeypatch.setattr(queries, "update_query_log", lambda log_id, data: True)
+    monkeypatch.setattr(queries, "call_openai_explain_answer", failing_explain)
+
+    resp = TestClient(app).post("/human_query/logs/7/explain", headers={"Authorization": f"Bearer {make_jwt(user_id)}"})
+
+    assert resp.status_code == 200, resp.text
+    assert seen["total_rows"] == 500 and len(seen["rows"]) == 3
+    assert resp.json()["answer"] == "Consulta ejecutada correctamente. Registros: 500."
@@ -0,0 +1,95 @@
+# tests/test_row_budget.py
+#
+# Presupuesto de filas (app/services/db_connector.py): execute_sql_query deja de leer al alcanzar
+# max_rows, marca el resultado como truncado y toma el total aproximado del plan estimado.
+
+import contextlib
+
+import pytest
+
+PG = {"id": "pg-1", "db_type": "postgres", "password": "secreta"}
+
+
+class FakeCursor:
+    description = [("id", 23), ("region", 25)]
+
+    def __init__(self, db, name=None):
+        self.db = db
+        self.name = name
+        self.itersize = None
+
+    def execute(self, sql, params=None):
+        self.db["executed"].append(sql)
+
+    def fetchmany(self, size):
+        self.db["fetchmany"].append(size)
+        return self.db["rows"][:size]
+
+    def fetchall(self):
+        self.db["fetchall"] += 1
+        return list(self.db["rows"])
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, name=None):
+        cursor = FakeCursor(self.db, name)
+        self.db["cursors"].append(cursor)
+        return cursor
+
+
+@pytest.fixture
+def fake_db(offline_env, monkeypatch):
+    from app.services import db_connector
+
+    db = {"rows": [(i, "norte") for i in range(50)], "executed": [], "fetchmany": [], "fetchall": 0,
+          "cursors": [], "plans": 0, "estimated_rows": 123456}
+
+    def plan_summary(connection, sql_query):
+        db["plans"] += 1
+        return {"estimated_rows": db["estimated_rows"], "estimated_cost": 1000.0}
+
+    monkeypatch.setattr(db_connector, "get_pooled_connection", lambda connection: contextlib.nullcontext(FakeConnection(db)))
+    monkeypatch.setattr(db_connector, "get_query_plan_summary", plan_summary)
+    return db_connector, db
+
+
+def test_budget_stops_reading_and_reports_the_planner_total(fake_db):
+    db_connector, db = fake_db
+    columns, rows, meta = db_connector.execute_sql_query(PG, "SELECT id, region FROM ventas", max_rows=10, return_metadata=True)
+
+    # Una fila de más para saber si hubo corte, leída con cursor server-side
+    assert db["fetchmany"] == [11] and db["fetchall"] == 0
+    assert db["cursors"][0].name and db["cursors"][0].itersize == 11
+    assert columns == ["id", "region"] and len(rows) == 10 and rows[-1] == [9, "norte"]
+    assert meta == {"truncated": True, "approx_total_rows": 123456}
+
+
+def test_result_within_budget_is_exact_and_skips_the_planner(fake_db):
+    db_connector, db = fake_db
+    db["rows"] = db["rows"][:7]
+    _, rows, meta = db_connector.execute_sql_query(PG, "SELECT id, region FROM ventas", max_rows=10, return_metadata=True)
+    assert len(rows) == 7
+    assert meta == {"truncated": False, "approx_total_rows": 7}
+    assert db["plans"] == 0
+
+
+def test_truncated_total_is_unknown_without_a_plan(fake_db, monkeypatch):
+    db_connector, db = fake_db
+    monkeypatch.setattr(db_connector, "get_query_plan_summary", lambda connection, sql_query: None)
+    _, rows, meta = db_connector.execute_sql_query(PG, "SELECT id, region FROM ventas", max_rows=5, return_metadata=True)
+    assert len(rows) == 5 and meta == {"truncated": True, "approx_total_rows": None}
+
+
+def test_row_budget_comes_from_the_connection_and_requests_only_lower_it(fake_db, monkeypatch):
+    db_connector, _ = fake_db
+    monkeypatch.setattr(db_connector, "QUERY_MAX_ROWS", 10000)
+    assert db_connector.resolve_row_budget(PG) == 10000
+    assert db_connector.resolve_row_budget(dict(PG, max_rows=500)) == 500
+    assert db_connector.resolve_row_budget(dict(PG, max_rows=500), requested=50) == 50
+    assert db_connector.resolve_row_budget(dict(PG, max_rows=500), requested=5000) == 500
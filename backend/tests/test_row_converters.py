@@ -0,0 +1,54 @@
+# tests/test_row_converters.py
+#
+# Conversión de filas por columna (app/utils/row_converters.py): el conversor se decide una vez
+# por columna a partir de cursor.description (OID en Postgres, tipo Python en SQL Server).
+
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import pytest
+
+
+@pytest.fixture
+def converters(offline_env):
+    from app.utils import row_converters
+
+    return row_converters
+
+
+def test_postgres_columns_convert_by_oid(converters):
+    # numeric, date, timestamp, bytea, int4, text
+    description = [("monto", 1700), ("fecha", 1082), ("creado", 1114), ("firma", 17), ("id", 23), ("nombre", 25)]
+    rows = [
+        (Decimal("10.50"), date(2024, 3, 1), datetime(2024, 3, 1, 12, 30), memoryview(b"ok"), 1, "Ana"),
+        (None, None, None, b"\xff\xfe", 2, None),
+    ]
+    assert converters.convert_rows(description, rows) == [
+        [10.5, "2024-03-01", "2024-03-01T12:30:00", "ok", 1, "Ana"],
+        [None, None, None, str(b"\xff\xfe"), 2, None],
+    ]
+
+
+def test_sqlserver_columns_convert_by_python_type(converters):
+    description = [("monto", Decimal), ("fecha", date), ("hora", time), ("dato", bytes), ("id", int)]
+    rows = [(Decimal("1.25"), date(2023, 12, 31), time(8, 0), b"abc", 7)]
+    assert converters.convert_rows(description, rows) == [[1.25, "2023-12-31", "08:00:00", "abc", 7]]
+
+
+def test_safe_columns_are_copied_and_unknown_types_are_sanitized(converters):
+    # numeric que el driver ya entrega como float: no se convierte; tipo desconocido (array): saneo genérico
+    description = [("monto", 1700), ("etiquetas", 1009)]
+    convert = converters.build_row_converter(description, first_row=(1.5, [Decimal("2"), date(2024, 1, 1)]))
+    assert convert([(1.5, [Decimal("2"), date(2024, 1, 1)])]) == [[1.5, [2.0, "2024-01-01"]]]
+    assert converters.convert_rows(description, []) == []
+
+
+def test_exact_decimals_keep_numeric_values_for_exports(converters):
+    # La respuesta JSON usa float; CSV/NDJSON/Arrow conservan el Decimal exacto
+    description = [("monto", 1700), ("fecha", 1082)]
+    rows = [(Decimal("12345678901234567.89"), date(2024, 3, 1))]
+    assert converters.convert_rows(description, rows) == [[12345678901234567.89, "2024-03-01"]]
+    exact = converters.build_row_converter(description, rows[0], exact_decimals=True)(rows)
+    assert exact == [[Decimal("12345678901234567.89"), "2024-03-01"]]
+    sqlserver = converters.build_row_converter([("monto", Decimal)], exact_decimals=True)([(Decimal("0.10"),)])
+    assert str(sqlserver[0][0]) == "0.10"
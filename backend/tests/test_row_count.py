@@ -0,0 +1,54 @@
+# tests/test_row_count.py
+#
+# Conteo de registros (app/services/row_count.py): el aproximado no dispara COUNT(*) salvo opt-in.
+
+import pytest
+
+PG = {"id": "pg-1", "db_type": "postgres"}
+
+
+@pytest.fixture
+def row_count(offline_env, monkeypatch):
+    from app.services import row_count
+
+    submitted = []
+    monkeypatch.setattr(row_count.db_executor, "submit", lambda fn, *args: submitted.append(args))
+    monkeypatch.setattr(row_count, "_exact_counts", {})
+    monkeypatch.setattr(row_count, "_in_flight", set())
+    return row_count, submitted
+
+
+def test_count_mode_is_approx_unless_the_user_asks(row_count):
+    row_count, _ = row_count
+    assert row_count.resolve_count_mode("¿Cuántos registros tiene ventas?") == "approx"
+    assert row_count.resolve_count_mode("¿Cuántos registros exactamente tiene ventas?") == "exact"
+    assert row_count.resolve_count_mode("¿Cuántos registros tiene ventas?", exact_count=True) == "exact"
+
+
+def test_approx_answer_schedules_no_scan_by_default(row_count):
+    row_count, submitted = row_count
+    assert row_count.schedule_exact_count(PG, "ventas") is False
+    assert submitted == []
+
+
+def test_background_scan_is_opt_in_per_connection(row_count, monkeypatch):
+    row_count, submitted = row_count
+    assert row_count.schedule_exact_count(dict(PG, exact_count_background=True), "ventas") is True
+    assert row_count.schedule_exact_count(dict(PG, exact_count_background=True), "ventas") is False  # ya en curso
+    assert len(submitted) == 1
+
+    # Activado globalmente, una conexión puede apagarlo
+    monkeypatch.setattr(row_count, "EXACT_COUNT_BACKGROUND", True)
+    assert row_count.schedule_exact_count(dict(PG, exact_count_background=False), "clientes") is False
+    assert len(submitted) == 1
+
+
+def test_exact_count_sql_only_quotes_catalog_tables(row_count):
+    row_count, _ = row_count
+    catalog = [{"schema": "public", "name": "Ventas", "columns": []}, {"schema": "ventas", "name": 'año"2024', "columns": []}]
+    assert row_count.build_exact_count_sql("ventas", "postgres", catalog) == 'SELECT COUNT(*) FROM "public"."Ventas";'
+    assert row_count.build_exact_count_sql('ventas.año"2024', "postgres", catalog) == 'SELECT COUNT(*) FROM "ventas"."año""2024";'
+    sqlserver_catalog = [{"schema": "dbo", "name": "ventas]x", "columns": []}]
+    assert row_count.build_exact_count_sql("ventas]x", "sqlserver", sqlserver_catalog) == "SELECT COUNT(*) FROM [dbo].[ventas]]x];"
+    assert row_count.build_exact_count_sql("ventas; DROP TABLE ventas", "postgres", catalog) is None
+    assert row_count.build_exact_count_sql("ventas", "postgres", None) is None
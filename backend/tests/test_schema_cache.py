@@ -0,0 +1,74 @@
+# tests/test_schema_cache.py
+#
+# Cache de esquema por conexión (app/services/schema_cache.py): dentro del TTL no se consulta nada;
+# después solo se vuelve a introspectar si cambió la huella del esquema.
+
+import pytest
+
+CONNECTION = {"id": "conn-1", "db_type": "postgres"}
+
+
+def _catalog(*names):
+    return [{"schema": "public", "name": name, "kind": "table", "columns": [{"name": "id", "type": "integer"}], "references": []}
+            for name in names]
+
+
+@pytest.fixture
+def schema_db(offline_env, tmp_path, monkeypatch):
+    from app.services import schema_cache
+
+    db = {"fingerprint": "f1", "catalog": _catalog("ventas"), "fingerprint_calls": 0, "catalog_calls": 0}
+
+    def fingerprint(connection):
+        db["fingerprint_calls"] += 1
+        return db["fingerprint"]
+
+    def catalog(connection):
+        db["catalog_calls"] += 1
+        return db["catalog"]
+
+    monkeypatch.setattr(schema_cache, "SCHEMA_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(schema_cache, "_entries", {})
+    monkeypatch.setattr(schema_cache, "get_schema_fingerprint", fingerprint)
+    monkeypatch.setattr(schema_cache, "get_database_catalog", catalog)
+    return schema_cache, db
+
+
+def test_entry_is_trusted_within_the_ttl(schema_db, monkeypatch):
+    schema_cache, db = schema_db
+    monkeypatch.setattr(schema_cache, "SCHEMA_FINGERPRINT_TTL", 3600)
+    first = schema_cache.get_schema_entry(CONNECTION)
+    db["fingerprint"], db["catalog"] = "f2", _catalog("ventas", "clientes")
+    assert schema_cache.get_schema_entry(CONNECTION) is first
+    assert (db["fingerprint_calls"], db["catalog_calls"]) == (1, 1)
+
+
+def test_catalog_is_reloaded_only_when_the_fingerprint_changes(schema_db, monkeypatch):
+    schema_cache, db = schema_db
+    monkeypatch.setattr(schema_cache, "SCHEMA_FINGERPRINT_TTL", 0)
+    assert "ventas" in schema_cache.get_cached_schema(CONNECTION)
+
+    # Misma huella: se reutiliza la entrada sin introspectar
+    schema_cache.get_schema_entry(CONNECTION)
+    assert (db["fingerprint_calls"], db["catalog_calls"]) == (2, 1)
+
+    # Cambió el esquema: nueva introspección
+    db["fingerprint"], db["catalog"] = "f2", _catalog("ventas", "clientes")
+    entry = schema_cache.get_schema_entry(CONNECTION)
+    assert entry["fingerprint"] == "f2" and "clientes" in entry["schema"]
+    assert db["catalog_calls"] == 2
+
+
+def test_disk_entry_is_checked_once_and_invalidation_removes_it(schema_db, monkeypatch):
+    schema_cache, db = schema_db
+    monkeypatch.setattr(schema_cache, "SCHEMA_FINGERPRINT_TTL", 3600)
+    schema_cache.get_schema_entry(CONNECTION)
+
+    # Otro proceso (memoria vacía) lee la entrada de disco y verifica la huella en el primer uso
+    monkeypatch.setattr(schema_cache, "_entries", {})
+    assert schema_cache.peek_schema_entry(CONNECTION)["fingerprint"] == "f1"
+    db["fingerprint"], db["catalog"] = "f2", _catalog("clientes")
+    assert "clientes" in schema_cache.get_schema_entry(CONNECTION)["schema"]
+
+    schema_cache.invalidate_schema_cache(CONNECTION["id"])
+    assert schema_cache.peek_schema_entry(CONNECTION) is None
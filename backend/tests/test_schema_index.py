@@ -0,0 +1,87 @@
+# tests/test_schema_index.py
+#
+# Recorte del esquema para el prompt (app/services/schema_index.py): BM25 sobre nombres de tablas,
+# columnas y diccionario de datos, más las vecinas por FK y la tabla seleccionada.
+
+import pytest
+
+
+def _table(name, columns, references=()):
+    return {
+        "schema": "public",
+        "name": name,
+        "kind": "table",
+        "columns": [{"name": column, "type": "text"} for column in columns],
+        "references": list(references),
+    }
+
+
+CATALOG = [
+    _table("clientes", ["id", "nombre", "region"]),
+    _table("facturas", ["id", "cliente_id", "monto_total", "fecha_emision"], references=[("public", "clientes")]),
+    _table("productos", ["id", "descripcion", "precio"]),
+    _table("proveedores", ["id", "razon_social"]),
+    _table("empleados", ["id", "nombre", "cargo"]),
+    _table("bodegas", ["id", "cod_zona"]),
+]
+
+
+@pytest.fixture
+def schema_index(offline_env):
+    from app.services import schema_index
+
+    return schema_index
+
+
+def test_tokenize_splits_identifiers_and_folds_accents(schema_index):
+    assert schema_index.tokenize("montoTotal fecha_emisión de las Facturaciones") == ["monto", "total", "fecha", "emisio", "factur"]
+
+
+def test_search_ranks_by_table_name_over_columns(schema_index):
+    index = schema_index.SchemaIndex(CATALOG)
+    hits = index.search("facturas por cliente", top_k=3)
+    assert [CATALOG[idx]["name"] for idx, _ in hits][:2] == ["facturas", "clientes"]
+    assert index.search("inventario de satélites", top_k=3) == []
+
+
+def test_dictionary_descriptions_make_cryptic_columns_searchable(schema_index):
+    assert schema_index.SchemaIndex(CATALOG).search("ubicación geográfica", top_k=3) == []
+    index = schema_index.SchemaIndex(CATALOG, {"cod_zona": "Ubicación geográfica de la bodega"}, "bodegas")
+    assert [CATALOG[idx]["name"] for idx, _ in index.search("ubicación geográfica", top_k=3)] == ["bodegas"]
+
+
+def test_relevant_tables_add_fk_neighbors_and_the_selected_table(schema_index):
+    index = schema_index.SchemaIndex(CATALOG)
+    names = [t["name"] for t in schema_index.select_relevant_tables(index, "monto de facturas", "empleados", top_k=1)]
+    # Orden del catálogo; clientes entra como vecina por FK de facturas
+    assert names == ["clientes", "facturas", "empleados"]
+    assert schema_index.select_relevant_tables(index, "inventario de satélites") is None
+
+
+def test_small_schemas_are_sent_whole(schema_index, monkeypatch):
+    from app.services.db_connector import render_schema
+
+    entry = {"key": "conn-small", "schema": render_schema(CATALOG, "postgres"), "catalog": CATALOG, "fingerprint": "f1"}
+    monkeypatch.setattr(schema_index, "get_schema_entry", lambda connection: entry)
+    assert schema_index.get_prompt_schema({"id": "conn-small", "db_type": "postgres"}, "monto de facturas") == (entry["schema"], None)
+
+
+
+def test_large_schemas_are_pruned_by_default(schema_index, monkeypatch):
+    from app.services.db_connector import render_schema
+
+    entry = {"key": "conn-large", "schema": render_schema(CATALOG, "postgres"), "catalog": CATALOG, "fingerprint": "f1"}
+    monkeypatch.setattr(schema_index, "get_schema_entry", lambda connection: entry)
+    monkeypatch.setattr(schema_index, "SCHEMA_PRUNE_MIN_TABLES", 2)
+    connection = {"id": "conn-large", "db_type": "postgres"}
+
+    # Sin configurar nada: solo las tablas relevantes van al prompt
+    schema, relevant = schema_index.get_prompt_schema(connection, "monto de facturas")
+    assert relevant is None
+    assert "facturas" in schema and "proveedores" not in schema
+
+    # Con el layout de cache (opt-in) el esquema va completo, salvo que supere el tope de caracteres
+    monkeypatch.setattr(schema_index, "SCHEMA_PROMPT_CACHE_LAYOUT", True)
+    assert schema_index.get_prompt_schema(connection, "monto de facturas") == (entry["schema"], ["clientes", "facturas"])
+    monkeypatch.setattr(schema_index, "SCHEMA_PROMPT_CACHE_MAX_CHARS", len(entry["schema"]) - 1)
+    assert schema_index.get_prompt_schema(connection, "monto de facturas")[1] is None
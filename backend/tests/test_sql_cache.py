@@ -0,0 +1,68 @@
+# tests/test_sql_cache.py
+#
+# Cache pregunta -> SQL (app/services/sql_cache.py): nivel exacto y casi duplicado.
+
+import pytest
+
+SQL = "SELECT region, SUM(monto) AS total FROM ventas GROUP BY region ORDER BY total DESC"
+
+
+@pytest.fixture
+def cache(offline_env):
+    from app.services.sql_cache import SQLCache
+
+    cache = SQLCache(max_entries=100, ttl=60)
+    cache.put("c1", "f1", "ventas", "Total de ventas por región de mayor a menor", SQL, {"message": "ok"}, query_log_id=1)
+    return cache
+
+
+def test_exact_tier_ignores_case_accents_and_stopwords(cache):
+    entry = cache.get("c1", "f1", "ventas", "¿TOTAL ventas por region de MAYOR a menor?")
+    assert entry["match"] == "exact" and entry["sql"] == SQL
+    # Otra huella de esquema u otra tabla seleccionada: no se reutiliza
+    assert cache.get("c1", "f2", "ventas", "Total de ventas por región de mayor a menor") is None
+    assert cache.get("c1", "f1", "clientes", "Total de ventas por región de mayor a menor") is None
+
+
+def test_near_tier_reuses_a_reworded_question(cache):
+    entry = cache.get("c1", "f1", "ventas", "Muéstrame las ventas totales por regiones, de mayor a menor")
+    assert entry["match"] == "near" and entry["sql"] == SQL
+    # Typo (letras intercambiadas) en un término de una pregunta más larga
+    cache.put("c1", "f1", "ventas", "ventas totales de clientes activos por región de mayor a menor", SQL, {}, query_log_id=3)
+    entry = cache.get("c1", "f1", "ventas", "ventas totales de clietnes activos por región de mayor a menor")
+    assert entry["match"] == "near" and entry["similarity"] >= 0.8
+    assert cache.stats()["near_hits"] == 2
+
+
+def test_near_tier_rejects_a_different_filter_value(cache):
+    cache.put("c1", "f1", "ventas", "total de ventas de la región norte por mes", SQL + " -- norte", {}, query_log_id=4)
+    assert cache.get("c1", "f1", "ventas", "total de ventas de la región sur por mes") is None
+    assert cache.get("c1", "f1", "ventas", "total de ventas de la región norte por mes")["match"] == "exact"
+
+    cache.put("c1", "f1", "ventas", "ventas de junio por región", SQL + " -- junio", {}, query_log_id=5)
+    assert cache.get("c1", "f1", "ventas", "ventas de julio por región") is None
+    # Una palabra de más también cambia la consulta
+    assert cache.get("c1", "f1", "ventas", "ventas de junio por región y vendedor") is None
+
+
+def test_near_tier_rejects_reversed_order_and_different_literals(cache):
+    assert cache.get("c1", "f1", "ventas", "Total de ventas por región de menor a mayor") is None
+    assert cache.get("c1", "f1", "ventas", "Total de ventas por región de mayor a menor sin devoluciones") is None
+
+    cache.put("c1", "f1", "ventas", "ventas por región en 2023", SQL, {}, query_log_id=2)
+    assert cache.get("c1", "f1", "ventas", "ventas por región en 2024") is None
+
+
+def test_near_scan_is_bounded_and_negative_feedback_evicts(cache, monkeypatch):
+    from app.services import sql_cache
+
+    for i in range(5):
+        cache.put("c1", "f1", "ventas", f"conteo de clientes activos grupo {chr(97 + i)}x", f"SELECT {i}", {}, query_log_id=10 + i)
+    # La pregunta original quedó más atrás que las 5 recientes: con el tope no se alcanza a revisar
+    monkeypatch.setattr(sql_cache, "SQL_CACHE_NEAR_MAX_SCAN", 5)
+    assert cache.get("c1", "f1", "ventas", "ventas totales por regiones de mayor a menor") is None
+    monkeypatch.setattr(sql_cache, "SQL_CACHE_NEAR_MAX_SCAN", 256)
+    assert cache.get("c1", "f1", "ventas", "ventas totales por regiones de mayor a menor")["match"] == "near"
+
+    cache.record_feedback(1, -1)
+    assert cache.get("c1", "f1", "ventas", "Total de ventas por región de mayor a menor") is None